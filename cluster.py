@@ -6,6 +6,16 @@ import json
 import tarfile
 import io
 
+# Общий лимит запросов для нод (если модуль intrusions установлен)
+try:
+    from AEngineApps.intrusions import RateLimitServer, NetworkRateBackend
+except ImportError:
+    try:
+        from sec.intrusions import RateLimitServer, NetworkRateBackend
+    except ImportError:
+        RateLimitServer = None
+        NetworkRateBackend = None
+
 class ClusterNode:
     """
     Узел кластера Active-Passive.
@@ -13,7 +23,8 @@ class ClusterNode:
     """
     
     def __init__(self, node_id: str, role: str, master_ip: str, master_port: int, 
-                 sync_dir: str = ".", heartbeat_interval: int = 2, timeout: int = 6):
+                 sync_dir: str = ".", heartbeat_interval: int = 2, timeout: int = 6,
+                 rate_limit_service: bool = False, rate_limit_port: int = None, rate_limit_token: str = None):
         """
         :param node_id: Уникальное имя ноды.
         :param role: "master" (Active) или "slave" (Passive).
@@ -22,6 +33,9 @@ class ClusterNode:
         :param sync_dir: Директория для синхронизации кода.
         :param heartbeat_interval: Как часто Master шлет пульс (в секундах).
         :param timeout: Через сколько секунд отсутствия пульса Slave становится Master'ом.
+        :param rate_limit_service: Запускать на Master сервис счётчиков RateLimiter (RateLimitServer).
+        :param rate_limit_port: TCP порт сервиса счётчиков (по умолчанию порт пульса + 2).
+        :param rate_limit_token: Общий секрет нод для сервиса счётчиков (обязателен при rate_limit_service).
         """
         self.node_id = node_id
         self.role = role.lower()
@@ -33,6 +47,13 @@ class ClusterNode:
         self.timeout = timeout
         self.last_heartbeat = time.time()
         
+        self.rate_limit_service = rate_limit_service
+        self.rate_limit_port = rate_limit_port or master_port + 2
+        self.rate_limit_token = rate_limit_token
+        self._rate_limit_server = None
+        if rate_limit_service and not rate_limit_token:
+            raise ValueError("rate_limit_service требует rate_limit_token: сервис счётчиков доступен по сети")
+        
         self.running = False
         self.on_failover = None  # Коллбек при смене роли Slave -> Master
         
@@ -143,6 +164,28 @@ class ClusterNode:
                 pass
         sock.close()
 
+    def _start_rate_limit_server(self):
+        """Сервис счётчиков RateLimiter на Master (счётчики начинаются заново после failover)."""
+        if not self.rate_limit_service or self._rate_limit_server is not None:
+            return
+        if RateLimitServer is None:
+            print("[Cluster] Модуль intrusions не установлен, сервис лимитов не запущен.")
+            return
+        try:
+            self._rate_limit_server = RateLimitServer(self.master_ip, self.rate_limit_port, token=self.rate_limit_token).start()
+            print(f"[Cluster] Сервис лимитов запущен на {self.master_ip}:{self.rate_limit_port}.")
+        except OSError as e:
+            print(f"[Cluster] Не удалось запустить сервис лимитов: {e}")
+
+    def rate_limit_backend(self, **options):
+        """Бэкенд RateLimiter, общий для нод: счётчики на Master (RateLimiter(app, backend=...)).
+        
+        Опции передаются в NetworkRateBackend (flush_interval, initial_lease и т.д.).
+        """
+        if NetworkRateBackend is None:
+            raise RuntimeError("Модуль intrusions не установлен")
+        return NetworkRateBackend(self.master_ip, self.rate_limit_port, token=self.rate_limit_token, **options)
+
     def _promote_to_master(self):
         """Смена роли с Slave на Master (Failover)."""
         print(f"[Cluster] Нода '{self.node_id}' повышена до Master! Запускаем сервисы.")
@@ -151,6 +194,7 @@ class ClusterNode:
         # Запускаем треды мастера
         threading.Thread(target=self._heartbeat_sender, daemon=True).start()
         threading.Thread(target=self._master_sync_server, daemon=True).start()
+        self._start_rate_limit_server()
         
         if self.on_failover:
             self.on_failover()
@@ -168,10 +212,14 @@ class ClusterNode:
         elif self.role == "master":
             threading.Thread(target=self._master_sync_server, daemon=True).start()
             threading.Thread(target=self._heartbeat_sender, daemon=True).start()
+            self._start_rate_limit_server()
             print(f"[Cluster] Нода '{self.node_id}' запущена как MASTER. Раздаем пульс.")
 
     def stop(self):
         self.running = False
+        if self._rate_limit_server is not None:
+            self._rate_limit_server.stop()
+            self._rate_limit_server = None
 
 
 __all__ = ['ClusterAdmin']
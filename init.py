@@ -20,7 +20,8 @@ MODULE_MAP = {
         "sources": ["intrusions.py"],
         "target": "AEngineApps/intrusions.py",
         "extra_files": [
-            {"src": "signatures_db.json", "dst": "AEngineApps/signatures_db.json"}
+            {"src": "signatures_db.json", "dst": "AEngineApps/signatures_db.json"},
+            {"src": "__RCE.list", "dst": "AEngineApps/__RCE.list"}
         ],
         "description": "IDS/IPS и детекторы атак (SQLi, XSS, RCE, LFI, RateLimiter, открытая база сигнатур)",
     },
@@ -3,55 +3,180 @@ sec/__intrusions.py — IDS/IPS система для AEngineApps.
 Проверяет GET, POST, JSON данные запросов.
 """
 
-from flask import Flask, request, abort
+from flask import Flask, request, abort, g, has_request_context, session
+from werkzeug.datastructures import CombinedMultiDict, Headers, ImmutableMultiDict
 from urllib.parse import unquote
 from typing import Callable, Optional
-from collections import defaultdict
+from collections import defaultdict, deque, OrderedDict
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from contextvars import ContextVar
+from functools import cached_property
+import bisect
+import codecs
+import hashlib
+import heapq
+import hmac
+import html
+import io
+import ipaddress
+import json
+import math
+import mmap
 import os
+import queue
 import re
-import shutil
+import socket
+import struct
+import tempfile
+import threading
 import time
+import weakref
 from abc import ABC, abstractmethod
+from array import array
+
+try:
+    import fcntl
+except ImportError:  # Windows: общее (межпроцессное) состояние RateLimiter недоступно
+    fcntl = None
 
 
 # ─── Утилиты ─────────────────────────────────────────────────
 
 def _get_all_input_values() -> list[str]:
-    """Извлекает ВСЕ пользовательские данные из запроса (GET, POST, JSON)."""
+    """Извлекает ВСЕ пользовательские данные из запроса (GET, POST, JSON).
+
+    Значения берутся из контекста инспекции текущего запроса, поэтому
+    JSON-тело разбирается один раз, сколько бы детекторов ни вызвали функцию.
+    """
+    return list(_get_inspection_context().values)
+
+
+def _extract_input_values(req=None, flattener: Optional["_JsonFlattener"] = None) -> list[str]:
+    """Разбирает GET, POST form и JSON body запроса (по умолчанию — текущего flask.request).
+    
+    Превышение бюджетов JSON фиксируется в flattener.exceeded.
+    """
+    req = req if req is not None else request
     values = []
     
     # GET параметры
-    for val in request.args.values():
+    for val in req.args.values():
         values.append(val)
     
     # POST form data
-    if request.form:
-        for val in request.form.values():
+    if req.form:
+        for val in req.form.values():
             values.append(val)
     
     # JSON body
-    if request.is_json:
+    if req.is_json:
+        flattener = flattener or _JsonFlattener()
         try:
-            json_data = request.get_json(silent=True) or {}
-            values.extend(_flatten_json(json_data))
+            json_data = req.get_json(silent=True) or {}
+            values.extend(_flatten_json(json_data, flattener))
+        except RecursionError:
+            # Вложенность глубже, чем может разобрать json-парсер
+            flattener.exceeded = "depth"
         except Exception:
             pass
     
     return values
 
 
-def _flatten_json(data, prefix: str = "") -> list[str]:
-    """Рекурсивно извлекает все строковые значения из JSON."""
-    values = []
-    if isinstance(data, dict):
-        for k, v in data.items():
-            values.extend(_flatten_json(v, f"{prefix}.{k}"))
-    elif isinstance(data, list):
-        for item in data:
-            values.extend(_flatten_json(item, prefix))
-    elif isinstance(data, str):
-        values.append(data)
-    return values
+class _JsonFlattener:
+    """Итеративный обход JSON с бюджетами глубины, количества элементов и объёма строк.
+
+    Строковые значения отдаются генератором в порядке обхода в глубину, без
+    рекурсии и промежуточных списков. При превышении бюджета обход
+    останавливается, а причина ("depth", "items", "bytes") сохраняется в exceeded.
+    """
+
+    _END = object()
+
+    def __init__(self, max_depth: int = 64, max_items: int = 100_000, max_bytes: int = 10 * 1024 * 1024):
+        self.max_depth = max_depth
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.exceeded: Optional[str] = None
+
+    @classmethod
+    def from_config(cls, config: "InspectionConfig") -> "_JsonFlattener":
+        return cls(config.json_max_depth, config.json_max_items, config.json_max_bytes)
+
+    def iter_strings(self, data):
+        end = self._END
+        items = 0
+        size = 0
+        stack = [(iter((data,)), 0)]
+        while stack:
+            it, depth = stack[-1]
+            node = next(it, end)
+            if node is end:
+                stack.pop()
+                continue
+            items += 1
+            if items > self.max_items:
+                self.exceeded = "items"
+                return
+            if isinstance(node, str):
+                size += len(node)
+                if size > self.max_bytes:
+                    self.exceeded = "bytes"
+                    return
+                yield node
+            elif isinstance(node, (dict, list)):
+                if depth >= self.max_depth:
+                    self.exceeded = "depth"
+                    return
+                stack.append((iter(node.values() if isinstance(node, dict) else node), depth + 1))
+
+
+def _flatten_json(data, flattener: Optional[_JsonFlattener] = None):
+    """Генератор всех строковых значений JSON (с бюджетами flattener)."""
+    return (flattener or _JsonFlattener()).iter_strings(data)
+
+
+_UNICODE_ESCAPE_RE = re.compile(r"(?:\\u|%u)([0-9a-fA-F]{4})|\\x([0-9a-fA-F]{2})")
+_PERCENT_U_RE = re.compile(r"%u([0-9a-fA-F]{4})")
+# Последовательности пробельных символов и одиночные \t \n \r \f \v
+_WHITESPACE_RE = re.compile(r"\s{2,}|[^\S ]")
+
+
+def _unescape_code(match: re.Match) -> str:
+    return chr(int(match.group(1) or match.group(2), 16))
+
+
+def _canonicalize(text: str, layers: int = 3, collapse_whitespace: bool = True,
+                  html_entities: bool = True, backslash_escapes: bool = True) -> str:
+    """Каноническая форма значения для детекторов.
+    
+    До layers раз (пока значение меняется): URL-декодирование, escape-последовательности
+    \\uXXXX / %uXXXX / \\xXX и HTML-сущности — так многократно закодированные
+    payload'ы (%252e%252e, &lt;script&gt;) сводятся к исходному виду. Затем
+    пробельные последовательности схлопываются в один пробел.
+    
+    html_entities=False — для URL запроса: в "?a=1&lt=2" "&lt" — имя параметра, а не "<".
+    backslash_escapes=False — для путей и команд (LFIDetector, RCEDetector): "\\" там
+    разделитель путей Windows, и C:\\x41bc не должен превращаться в C:Abc; %uXXXX
+    декодируется и в этом режиме.
+    """
+    for _ in range(layers):
+        previous = text
+        if "%" in text:
+            text = unquote(text)
+        if backslash_escapes:
+            if "\\" in text or "%u" in text:
+                text = _UNICODE_ESCAPE_RE.sub(_unescape_code, text)
+        elif "%u" in text:
+            text = _PERCENT_U_RE.sub(_unescape_code, text)
+        if html_entities and "&" in text:
+            text = html.unescape(text)
+        if text == previous:
+            break
+    if collapse_whitespace:
+        text = _WHITESPACE_RE.sub(" ", text)
+    return text
 
 
 def _get_request_full_data() -> str:
@@ -62,333 +187,3629 @@ def _get_request_full_data() -> str:
     - Все заголовки (Headers)
     - Тело запроса (Raw Body)
     """
-    parts = []
-    
-    # 1. Путь и Query String
-    parts.append(f"PATH: {request.full_path}")
+    return _get_inspection_context().full_data
+
+
+# Контекст инспекции вне flask-запроса (фоновые воркеры IDS, офлайн-анализ)
+_detached_context: ContextVar[Optional["InspectionContext"]] = ContextVar("_sec_detached_inspection", default=None)
+
+
+def _get_inspection_context(config: Optional["InspectionConfig"] = None) -> "InspectionContext":
+    """Возвращает контекст инспекции текущего запроса, создавая его при первом обращении.
     
-    # 2. Заголовки (Headers)
-    header_str = "\n".join([f"{k}: {v}" for k, v in request.headers.items()])
-    parts.append(f"HEADERS:\n{header_str}")
+    Вне flask-запроса возвращается контекст, установленный через _detached_context.
+    """
+    ctx = _detached_context.get()
+    if ctx is not None:
+        return ctx
+    ctx = g.get("_sec_inspection")
+    if ctx is None:
+        ctx = InspectionContext.from_request(config)
+        g._sec_inspection = ctx
+    return ctx
+
+
+# Символы, после которых окно может обрываться: не буквы/цифры/"_" и не символы
+# escape-последовательностей (%XX, &#NN;, \uXXXX), которые канонизация превращает в буквы
+_WINDOW_ESCAPE_CHARS = "%&#;\\"
+
+
+def _is_text_delimiter(ch: str) -> bool:
+    return not (ch.isalnum() or ch == "_" or ch in _WINDOW_ESCAPE_CHARS)
+
+
+def _window_edges(data, overlap: int, is_delimiter: Callable) -> tuple[int, int]:
+    """Границы окна на разделителях: (конец текущего окна, начало следующего).
+
+    Окно заканчивается сразу после последнего разделителя в пределах overlap
+    от конца, следующее начинается с разделителя не позже чем за overlap до
+    этого конца. Граница окна не разрезает слово: обрезок "or" из "flavor"
+    не выглядит для \\b и lookaround отдельным словом. Без разделителя
+    (одно слово длиннее overlap) окно режется по длине.
+    """
+    n = len(data)
+    cut = n
+    for i in range(n - 1, max(n - overlap, 0) - 1, -1):
+        if is_delimiter(data[i]):
+            cut = i + 1
+            break
+    low = max(cut - overlap, 0)
+    start = low
+    for i in range(low, max(low - overlap, 0) - 1, -1):
+        if is_delimiter(data[i]):
+            start = i
+            break
+    return cut, start
+
+
+def _iter_text_windows(read: Callable[[int], bytes], window: int, overlap: int):
+    """Читает поток окнами по window байт и отдаёт их как текст.
+
+    Каждое окно начинается не меньше чем с overlap последних символов
+    предыдущего, поэтому совпадения длиной до overlap на стыке окон не
+    теряются. Края окон выравниваются по разделителям (_window_edges), а
+    следующий чанк читается заранее, чтобы последнее окно шло до конца
+    потока. Многобайтовые UTF-8 символы на границе чанков собираются
+    инкрементальным декодером.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    text = ""
+    chunk = read(window)
+    while chunk:
+        following = read(window)
+        text += decoder.decode(chunk, final=not following)
+        if not following:
+            yield text
+            break
+        cut, start = _window_edges(text, overlap, _is_text_delimiter)
+        yield text[:cut]
+        text = text[start:]
+        chunk = following
+
+
+# Байты, при которых окно нужно декодировать и канонизировать: URL-/unicode-escape,
+# HTML-сущности и не-ASCII. Без них канонизация окна ничего не меняет.
+_NEEDS_DECODING_RE = re.compile(rb"[%&\\\x80-\xff]")
+
+
+# Байты «слова» для _window_edges: буквы, цифры, "_", не-ASCII (части UTF-8 символов) и escape-символы
+_WINDOW_WORD_BYTES = frozenset(
+    b"0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz_" + _WINDOW_ESCAPE_CHARS.encode()
+) | frozenset(range(0x80, 0x100))
+
+
+def _is_byte_delimiter(byte: int) -> bool:
+    return byte not in _WINDOW_WORD_BYTES
+
+
+def _iter_byte_windows(read: Callable[[int], bytes], window: int, overlap: int):
+    """Читает поток окнами по window байт и отдаёт memoryview на общий буфер без декодирования.
+
+    Буфер фиксированного размера переиспользуется: окно действительно только
+    до следующей итерации. Края окон и перенос перекрытия — как в
+    _iter_text_windows (_window_edges), поэтому для ASCII-потока окна
+    совпадают с текстовыми.
+    """
+    # Перенос в следующее окно: до overlap после конца окна и до 2 × overlap перед ним
+    buffer = bytearray(3 * overlap + window)
+    view = memoryview(buffer)
+    filled = 0
+    chunk = read(window)
+    while chunk:
+        following = read(window)
+        end = filled + len(chunk)
+        buffer[filled:end] = chunk
+        if not following:
+            yield view[:end]
+            break
+        cut, start = _window_edges(view[:end], overlap, _is_byte_delimiter)
+        yield view[:cut]
+        # Копия переноса: источник и приёмник в одном буфере могут пересекаться
+        filled = end - start
+        buffer[:filled] = bytes(view[start:end])
+        chunk = following
+
+
+def _positional_reader(stream) -> Callable[[int], bytes]:
+    """Функция чтения seekable-потока со своей позицией (позиция потока не меняется)."""
+    position = stream.tell()
     
-    # 3. Тело (Body)
-    if request.is_json:
-        parts.append(f"BODY (JSON): {request.get_data(as_text=True)}")
-    elif request.form:
-        parts.append(f"BODY (FORM): {request.get_data(as_text=True)}")
-    else:
-        # Пытаемся взять сырые данные, если они есть
+    def read(size: int) -> bytes:
+        nonlocal position
+        saved = stream.tell()
         try:
-            raw = request.get_data(as_text=True)
-            if raw:
-                parts.append(f"BODY (RAW): {raw}")
-        except:
-            pass
+            stream.seek(position)
+            chunk = stream.read(size)
+            position = stream.tell()
+        finally:
+            stream.seek(saved)
+        return chunk
+    
+    return read
+
+
+class _ReplayStream(io.RawIOBase):
+    """Поток тела запроса: сначала уже прочитанная (спуленная) часть, затем остаток оригинала.
+
+    Подменяет request.stream после потоковой инспекции, чтобы приложение
+    получило тело целиком, а непроверенный остаток не читался заранее.
+    """
+
+    def __init__(self, head, rest):
+        super().__init__()
+        self._head = head
+        self._rest = rest
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = self._head.read(len(buffer)) if self._head is not None else b""
+        if not data:
+            self._head = None
+            data = self._rest.read(len(buffer))
+        n = len(data)
+        buffer[:n] = data
+        return n
+
+
+# ─── Контекст инспекции ───────────────────────────────────────
+
+class _HeaderRules:
+    """Таблица правил инспекции заголовков: имя (lower) → (детекторы, лимит длины значения).
+
+    Правило: {"detectors": [имена детекторов] | "*", "max_bytes": N}; список
+    детекторов можно указать без словаря, пустой список (или None) — заголовок
+    не инспектируется. Ключ "*" — правило для остальных заголовков.
+    """
+
+    def __init__(self, rules: dict):
+        self._table: dict[str, tuple[Optional[frozenset], int]] = {}
+        for name, rule in rules.items():
+            if rule is None or isinstance(rule, (list, tuple, set, str)):
+                rule = {"detectors": rule}
+            detectors = rule.get("detectors", "*")
+            allowed = None if detectors == "*" else frozenset(detectors or ())
+            self._table[name.lower()] = (allowed, rule.get("max_bytes", 8192))
+        self._default = self._table.pop("*", (None, 8192))
+
+    def select(self, headers: list[tuple[str, str]], detector: str) -> str:
+        """Заголовки, которые проверяет detector, строками "Имя: значение" (в пределах лимита).
+
+        Значения длиннее лимита сюда не входят: их отдаёт long_values() для проверки окнами.
+        """
+        table = self._table
+        default = self._default
+        lines = []
+        for name, value in headers:
+            allowed, limit = table.get(name.lower(), default)
+            if allowed is not None and detector not in allowed:
+                continue
+            if len(value) <= limit:
+                lines.append(f"{name}: {value}")
+        return "\n".join(lines)
+
+    def long_values(self, headers: list[tuple[str, str]], detector: str) -> list[tuple[str, str, int]]:
+        """Заголовки detector длиннее лимита: (имя, значение, лимит)."""
+        table = self._table
+        default = self._default
+        result = []
+        for name, value in headers:
+            allowed, limit = table.get(name.lower(), default)
+            if allowed is not None and detector not in allowed:
+                continue
+            if len(value) > limit > 0:
+                result.append((name, value, limit))
+        return result
+
+    def over_budget(self, headers: list[tuple[str, str]]) -> bool:
+        """True, если значение инспектируемого заголовка длиннее лимита правила.
+
+        Используется с header_overflow="block".
+        """
+        table = self._table
+        default = self._default
+        for name, value in headers:
+            allowed, limit = table.get(name.lower(), default)
+            if len(value) > limit and (allowed is None or allowed):
+                return True
+        return False
+
+
+class InspectionConfig:
+    """Параметры разбора запроса для контекста инспекции.
+
+    Args:
+        stream_body: потоковая инспекция тела — тело не декодируется в память
+            целиком, а сканируется окнами (для сырых тел и файлов multipart).
+        stream_window: размер окна в байтах.
+        stream_overlap: перекрытие соседних окон (в символах, для scan_bytes —
+            в байтах); совпадения длиннее перекрытия на стыке окон не гарантируются.
+        max_body_bytes: бюджет инспекции тела в байтах; остаток не сканируется
+            (но приложение получает тело целиком).
+        decode_layers: сколько слоёв кодирования (URL, HTML-сущности, unicode-escape)
+            снимается при канонизации значений; 1 — одно unquote(), как раньше.
+        json_max_depth: максимальная вложенность JSON-тела.
+        json_max_items: максимальное количество элементов JSON (объекты, списки, значения).
+        json_max_bytes: бюджет суммарной длины строковых значений JSON
+            (по умолчанию max_body_bytes).
+        overflow_verdict: что делать с телом сверх бюджета JSON:
+            "block" — считать атакой (IDS вызывает обработчики, IPS блокирует);
+            "inspect" — проверить значения, собранные до превышения.
+        header_rules: правила инспекции заголовков потоковыми детекторами
+            (SQLiDetector, SignatureDetector) поверх DEFAULT_HEADER_RULES:
+            {"имя-заголовка": {"detectors": [...] | "*", "max_bytes": N}}.
+            Заголовки, не отнесённые к детектору, в его поток не попадают.
+        header_overflow: что делать со значением заголовка длиннее max_bytes:
+            "scan" — проверить значение целиком окнами по max_bytes (по умолчанию;
+            длинные Referer, X-Forwarded-For и Cookie встречаются в обычном трафике);
+            "block" — считать атакой, как тело сверх бюджета.
+        scan_bytes: окна потокового тела отдаются детекторам как memoryview
+            без декодирования, если в окне нет %, &, \\ и не-ASCII байт
+            (канонизация такого окна ничего не меняет); остальные окна
+            декодируются и канонизируются как раньше.
+    """
+
+    OVERFLOW_VERDICTS = ("block", "inspect")
+    HEADER_OVERFLOWS = ("scan", "block")
+
+    # Сигнатуры проверяют все заголовки; ключевые слова SQL — только те, что
+    # приходят от клиента как данные (User-Agent, Accept, Cookie дают ложные срабатывания)
+    DEFAULT_HEADER_RULES = {
+        "*": {"detectors": ["SignatureDetector"], "max_bytes": 8192},
+        "referer": {"detectors": ["SignatureDetector", "SQLiDetector"], "max_bytes": 4096},
+        "origin": {"detectors": ["SignatureDetector", "SQLiDetector"], "max_bytes": 1024},
+        "x-forwarded-for": {"detectors": ["SignatureDetector", "SQLiDetector"], "max_bytes": 512},
+        "x-forwarded-host": {"detectors": ["SignatureDetector", "SQLiDetector"], "max_bytes": 512},
+        "x-real-ip": {"detectors": ["SignatureDetector", "SQLiDetector"], "max_bytes": 512},
+        "content-length": [],
+        "connection": [],
+        "accept-encoding": [],
+        "upgrade-insecure-requests": [],
+    }
+
+    def __init__(self, stream_body: bool = False, stream_window: int = 64 * 1024,
+                 stream_overlap: int = 1024, max_body_bytes: int = 10 * 1024 * 1024,
+                 decode_layers: int = 3, json_max_depth: int = 64, json_max_items: int = 100_000,
+                 json_max_bytes: Optional[int] = None, overflow_verdict: str = "block",
+                 header_rules: Optional[dict] = None, scan_bytes: bool = True,
+                 header_overflow: str = "scan"):
+        if overflow_verdict not in self.OVERFLOW_VERDICTS:
+            raise ValueError(f"overflow_verdict должен быть одним из {self.OVERFLOW_VERDICTS}")
+        if header_overflow not in self.HEADER_OVERFLOWS:
+            raise ValueError(f"header_overflow должен быть одним из {self.HEADER_OVERFLOWS}")
+        self.stream_body = stream_body
+        self.stream_window = stream_window
+        self.stream_overlap = stream_overlap
+        self.max_body_bytes = max_body_bytes
+        self.decode_layers = decode_layers
+        self.json_max_depth = json_max_depth
+        self.json_max_items = json_max_items
+        self.json_max_bytes = json_max_bytes if json_max_bytes is not None else max_body_bytes
+        self.overflow_verdict = overflow_verdict
+        self.header_rules = _HeaderRules({**self.DEFAULT_HEADER_RULES, **(header_rules or {})})
+        self.scan_bytes = scan_bytes
+        self.header_overflow = header_overflow
+
+
+_DEFAULT_CONFIG = InspectionConfig()
+
+
+class RequestSnapshot:
+    """Копия данных flask.request для правил, выполняемых вне запроса (асинхронный IDS).
+
+    Повторяет часть API flask.request с теми же типами: headers — werkzeug Headers,
+    args / form / cookies — ImmutableMultiDict, поэтому правила вида
+    r.headers.get("User-Agent") или r.args.get("id") работают одинаково в обоих режимах.
+    """
+
+    def __init__(self, req):
+        self.method = req.method
+        self.path = req.path
+        self.full_path = req.full_path
+        self.url = req.url
+        self.host = req.host
+        self.remote_addr = req.remote_addr
+        self.headers = Headers(req.headers)
+        self.args = ImmutableMultiDict(req.args)
+        self.form = ImmutableMultiDict(req.form)
+        self.cookies = ImmutableMultiDict(req.cookies)
+        self.is_json = req.is_json
+        self.json = req.get_json(silent=True) if req.is_json else None
+
+    @property
+    def values(self) -> CombinedMultiDict:
+        return CombinedMultiDict([self.args, self.form])
+
+
+class InspectionContext:
+    """Данные одного запроса, разобранные один раз и общие для всех детекторов.
+
+    Создаётся в before_request (IDS.run_detectors) и хранится в flask.g.
+    Производные представления (decoded/lower/upper, полный поток) вычисляются
+    лениво при первом обращении и дальше переиспользуются.
+
+    Атрибуты:
+        values: пользовательские значения (GET, POST form, JSON) без декодирования.
+        inputs: values + request.full_path — то, что проверяют детекторы.
+        decoded / lower / upper: канонические представления inputs (индексы совпадают):
+            снятые слои кодирования, схлопнутые пробелы; строятся один раз на запрос.
+        full_data: полный поток запроса (путь, заголовки, тело). В режиме
+            stream_body тело сюда не входит — его отдаёт iter_stream() окнами.
+    """
+
+    def __init__(self, method: str, path: str, full_path: str, remote_addr: Optional[str],
+                 values: list[str], headers: list[tuple[str, str]],
+                 body: str = "", body_kind: str = "RAW",
+                 config: Optional[InspectionConfig] = None,
+                 body_streams: Optional[list] = None, overflow: Optional[str] = None):
+        self.method = method
+        self.path = path
+        self.full_path = full_path
+        self.remote_addr = remote_addr
+        self.values = values
+        self.headers = headers
+        self.body = body
+        self.body_kind = body_kind
+        self.config = config or _DEFAULT_CONFIG
+        # Фабрики бинарных потоков тела для потоковой инспекции
+        self.body_streams = body_streams or []
+        # Превышенный бюджет разбора ("depth", "items", "bytes" — тело, "header" — заголовок) или None
+        self.overflow = overflow
+        # Копия flask.request для правил RuleDetector вне запроса (асинхронный режим)
+        self.request: Optional[RequestSnapshot] = None
+
+    @classmethod
+    def from_request(cls, config: Optional[InspectionConfig] = None, req=None) -> "InspectionContext":
+        """Снимает данные с запроса: по умолчанию текущего flask.request,
+        либо с переданного объекта werkzeug Request (офлайн-прогон без контекста Flask)."""
+        req = req if req is not None else request
+        config = config or _DEFAULT_CONFIG
+        if req.is_json:
+            body_kind = "JSON"
+        elif req.form:
+            body_kind = "FORM"
+        else:
+            body_kind = "RAW"
+        
+        body = ""
+        body_streams = []
+        if config.stream_body:
+            body_streams = cls._request_body_streams(config, body_kind, req)
+            if req.files:
+                body_kind = "FILES"
+        else:
+            try:
+                body = req.get_data(as_text=True)
+            except Exception:
+                body = ""
+        
+        flattener = _JsonFlattener.from_config(config)
+        values = _extract_input_values(req, flattener)
+        headers = list(req.headers.items())
+        overflow = flattener.exceeded
+        if overflow is None and config.header_overflow == "block" and config.header_rules.over_budget(headers):
+            overflow = "header"
+        
+        return cls(
+            method=req.method,
+            path=req.path,
+            full_path=req.full_path,
+            remote_addr=req.remote_addr,
+            values=values,
+            headers=headers,
+            body=body,
+            body_kind=body_kind,
+            config=config,
+            body_streams=body_streams,
+            overflow=overflow,
+        )
+
+    @staticmethod
+    def _request_body_streams(config: InspectionConfig, body_kind: str, req) -> list:
+        """Готовит источники тела запроса для окон, не декодируя его целиком.
+
+        Каждый источник — функция без аргументов, возвращающая read(size).
+        """
+        if req.files:
+            # multipart: werkzeug уже сохранил файлы (крупные — во временные файлы)
+            return [
+                lambda storage=storage: _positional_reader(storage.stream)
+                for storage in req.files.values()
+            ]
+        
+        if body_kind != "RAW":
+            # JSON / form уже прочитаны Flask; окна берутся из кешированных байт без копии в str
+            data = req.get_data()
+            return [lambda: io.BytesIO(data).read] if data else []
+        
+        spool = None
+        
+        def open_raw() -> Callable[[int], bytes]:
+            # Первое обращение: копируем до max_body_bytes в спул (в памяти не больше окна),
+            # а request.stream подменяем на «спул + непрочитанный остаток»
+            nonlocal spool
+            if spool is None:
+                original = req.stream
+                spool = tempfile.SpooledTemporaryFile(max_size=config.stream_window)
+                remaining = config.max_body_bytes
+                while remaining > 0:
+                    chunk = original.read(min(config.stream_window, remaining))
+                    if not chunk:
+                        break
+                    spool.write(chunk)
+                    remaining -= len(chunk)
+                spool.seek(0)
+                # Детекторы читают спул через _positional_reader, не сдвигая его позицию
+                req.stream = _ReplayStream(spool, original)
+            return _positional_reader(spool)
+        
+        return [open_raw]
+
+    def iter_stream(self, detector: Optional[str] = None):
+        """Отдаёт канонизированный полный поток запроса частями (без схлопывания пробелов).
+
+        Без detector — одна часть full_decoded со всеми заголовками. С detector —
+        путь и только заголовки, которые правила header_rules относят к этому
+        детектору, затем тело отдельной частью. В режиме stream_body тело
+        отдаётся окнами stream_window байт с перекрытием stream_overlap
+        в пределах бюджета max_body_bytes; при scan_bytes окна, которым не
+        нужна канонизация, отдаются как memoryview (детекторы сканируют байты).
+        """
+        if detector is None:
+            yield self.full_decoded
+        else:
+            yield self.head_decoded(detector)
+            yield from self.header_windows(detector)
+            if self.body_decoded:
+                yield self.body_decoded
+        
+        config = self.config
+        remaining = config.max_body_bytes
+        
+        for open_stream in self.body_streams:
+            read = open_stream()
+            
+            def read_budgeted(size: int, read=read) -> bytes:
+                nonlocal remaining
+                if remaining <= 0:
+                    return b""
+                chunk = read(min(size, remaining))
+                remaining -= len(chunk)
+                return chunk
             
-    return "\n---\n".join(parts)
+            if not config.scan_bytes:
+                for text in _iter_text_windows(read_budgeted, config.stream_window, config.stream_overlap):
+                    yield _canonicalize(text, config.decode_layers, collapse_whitespace=False)
+                continue
+            
+            for window in _iter_byte_windows(read_budgeted, config.stream_window, config.stream_overlap):
+                if _NEEDS_DECODING_RE.search(window) is None:
+                    yield window
+                else:
+                    text = str(window, "utf-8", errors="replace")
+                    yield _canonicalize(text, config.decode_layers, collapse_whitespace=False)
 
+    def snapshot(self) -> "InspectionContext":
+        """Компактная копия данных запроса, не связанная с flask.request.
+        
+        Потоковое тело читается в пределах max_body_bytes. Используется для
+        инспекции вне запроса (асинхронный режим IDS). Если заданы правила
+        RuleDetector, к снимку прикладывается RequestSnapshot текущего запроса.
+        """
+        body = self.body
+        if self.body_streams:
+            parts = []
+            remaining = self.config.max_body_bytes
+            for open_stream in self.body_streams:
+                read = open_stream()
+                while remaining > 0:
+                    chunk = read(min(remaining, self.config.stream_window))
+                    if not chunk:
+                        break
+                    parts.append(chunk)
+                    remaining -= len(chunk)
+            body = b"".join(parts).decode("utf-8", errors="replace")
+        snapshot = InspectionContext(
+            method=self.method,
+            path=self.path,
+            full_path=self.full_path,
+            remote_addr=self.remote_addr,
+            values=list(self.values),
+            headers=list(self.headers),
+            body=body,
+            body_kind=self.body_kind,
+            config=self.config,
+            overflow=self.overflow,
+        )
+        if RuleDetector.rules and has_request_context():
+            snapshot.request = RequestSnapshot(request)
+        return snapshot
 
-# ─── Абстрактный детектор ─────────────────────────────────────
+    @cached_property
+    def inputs(self) -> list[str]:
+        return self.values + [self.full_path]
 
-class BaseDetector(ABC):
-    """Базовый класс детектора атак."""
-    
-    def __init__(self, app: Flask):
-        self.app = app
+    @cached_property
+    def decoded(self) -> list[str]:
+        layers = self.config.decode_layers
+        decoded = [_canonicalize(val, layers) for val in self.values]
+        decoded.append(_canonicalize(self.full_path, layers, html_entities=False))
+        return decoded
 
-    @abstractmethod
-    def run(self) -> None:
-        pass
+    @cached_property
+    def path_values(self) -> list[str]:
+        """Входные значения для детекторов путей и команд: decoded без \\xXX / \\uXXXX.
 
-    def log(self, message: str) -> None:
-        """Логирует критическое событие."""
-        self.app.logger.critical(message)
+        Значение без "\\", "%" и "&" канонизируется одинаково в обоих режимах,
+        поэтому берётся из decoded.
+        """
+        layers = self.config.decode_layers
+        result = []
+        for i, (val, decoded) in enumerate(zip(self.inputs, self.decoded)):
+            if "\\" in val or "%" in val or "&" in val:
+                decoded = _canonicalize(val, layers, html_entities=i < len(self.values), backslash_escapes=False)
+            result.append(decoded)
+        return result
 
-    def trigger_response(self) -> None:
-        """Вызывается при обнаружении атаки (переопределяется IDS/IPS)."""
-        pass
+    @cached_property
+    def path_values_lower(self) -> list[str]:
+        return [val.lower() for val in self.path_values]
 
+    @cached_property
+    def input_chars(self) -> frozenset:
+        """Множество символов всех декодированных входных значений (для префильтров детекторов)."""
+        return frozenset().union(*self.decoded)
 
-# ─── Детекторы ─────────────────────────────────────────────────
+    @cached_property
+    def value_chars(self) -> frozenset:
+        """Множество символов декодированных значений без URL запроса (decoded[-1])."""
+        return frozenset().union(*self.decoded[:-1])
 
-class RCEDetector(BaseDetector):
-    """Обнаружение Remote Code Execution."""
-    dangerous = ["echo", "eval", "exec", "system", "popen", "subprocess"]
+    @cached_property
+    def lower(self) -> list[str]:
+        return [val.lower() for val in self.decoded]
 
-    def run(self) -> None:
-        # Проверяем только параметры и тело для предотвращения логов от User-Agent и т.д.
-        user_inputs = _get_all_input_values()
-        user_inputs.append(request.full_path)
-        
-        for val in user_inputs:
-            decoded = unquote(val).lower()
-            # Проверка по списку опасных команд
-            for el in decoded.split():
-                if el in self.dangerous or shutil.which(el):
-                    self.log(f"DETECTED RCE: {request.method} {request.path} | payload: {val[:50]}")
-                    self.trigger_response()
-                    return
+    @cached_property
+    def upper(self) -> list[str]:
+        return [val.upper() for val in self.decoded]
+
+    @cached_property
+    def full_data(self) -> str:
+        parts = []
+        
+        # 1. Путь и Query String
+        parts.append(f"PATH: {self.full_path}")
+        
+        # 2. Заголовки (Headers)
+        header_str = "\n".join([f"{k}: {v}" for k, v in self.headers])
+        parts.append(f"HEADERS:\n{header_str}")
+        
+        # 3. Тело (Body); потоковое тело отдаётся окнами через iter_stream()
+        if self.body_streams:
+            pass
+        elif self.body_kind != "RAW" or self.body:
+            parts.append(f"BODY ({self.body_kind}): {self.body}")
+        
+        return "\n---\n".join(parts)
 
+    @cached_property
+    def path_decoded(self) -> str:
+        """Путь и query string в формате full_data (канонизированы без HTML-сущностей)."""
+        path = _canonicalize(self.full_path, self.config.decode_layers, collapse_whitespace=False, html_entities=False)
+        return f"PATH: {path}"
 
-class LFIDetector(BaseDetector):
-    """Обнаружение Local/Remote File Inclusion."""
+    def head_decoded(self, detector: str) -> str:
+        """Путь и заголовки для detector по header_rules (канонизированы, кешируются на запрос)."""
+        cache = self.__dict__.setdefault("_head_decoded", {})
+        text = cache.get(detector)
+        if text is None:
+            header_str = self.config.header_rules.select(self.headers, detector)
+            headers = _canonicalize(header_str, self.config.decode_layers, collapse_whitespace=False)
+            text = cache[detector] = f"{self.path_decoded}\n---\nHEADERS:\n{headers}"
+        return text
+
+    def header_windows(self, detector: str) -> list[str]:
+        """Значения заголовков detector длиннее лимита правила — окнами по лимиту.
+
+        Края окон выравниваются по разделителям, как окна потокового тела,
+        поэтому payload после заполнителя в длинном заголовке не теряется.
+        """
+        cache = self.__dict__.setdefault("_header_windows", {})
+        windows = cache.get(detector)
+        if windows is None:
+            windows = cache[detector] = []
+            layers = self.config.decode_layers
+            for name, value, limit in self.config.header_rules.long_values(self.headers, detector):
+                read = io.BytesIO(value.encode("utf-8", errors="replace")).read
+                overlap = min(self.config.stream_overlap, limit // 4)
+                for text in _iter_text_windows(read, limit, overlap):
+                    windows.append(_canonicalize(f"{name}: {text}", layers, collapse_whitespace=False))
+        return windows
+
+    @property
+    def overflow_blocks(self) -> bool:
+        """Превышение бюджета считается атакой (overflow_verdict или header_overflow="block")."""
+        return self.overflow is not None and (self.overflow == "header" or self.config.overflow_verdict == "block")
+
+    @cached_property
+    def body_decoded(self) -> str:
+        """Тело запроса в том же формате, что в full_data ("" для потокового или пустого тела)."""
+        if self.body_streams or not (self.body_kind != "RAW" or self.body):
+            return ""
+        return _canonicalize(f"BODY ({self.body_kind}): {self.body}", self.config.decode_layers, collapse_whitespace=False)
+
+    @cached_property
+    def full_decoded(self) -> str:
+        # Переводы строк сохраняются: сигнатуры с флагом m опираются на границы строк
+        header_str = "\n".join([f"{k}: {v}" for k, v in self.headers])
+        headers = _canonicalize(header_str, self.config.decode_layers, collapse_whitespace=False)
+        parts = [self.path_decoded, f"HEADERS:\n{headers}"]
+        if self.body_decoded:
+            parts.append(self.body_decoded)
+        return "\n---\n".join(parts)
+
+    @cached_property
+    def full_upper(self) -> str:
+        return self.full_decoded.upper()
+
+
+# ─── Мульти-паттерн матчер ────────────────────────────────────
+
+class _LiteralMatcher:
+    """Поиск набора литералов за один проход по строке.
+
+    Все литералы собираются в одну регулярку-дерево (trie) внутри lookahead,
+    поэтому в каждой позиции проверяется только ветка по текущему символу,
+    и стоимость поиска зависит от длины входа, а не от количества паттернов.
+    В каждой позиции находится самый длинный литерал, а более короткие
+    литералы, являющиеся его префиксами, добавляются из заранее посчитанной
+    таблицы. Без учёта регистра строка один раз приводится к регистру fold
+    (это заметно быстрее re.IGNORECASE на больших альтернативах по unicode).
+    Байты (bytes, memoryview) сканируются без декодирования; без учёта регистра
+    небольшие наборы (до _BYTES_IGNORECASE_LIMIT литералов) ищутся байтовой
+    регуляркой с re.IGNORECASE без копии входа, а для больших альтернатив
+    re.IGNORECASE в разы медленнее, и вход один раз приводится к регистру
+    (bytes.lower/upper — ASCII, без декодирования).
+
+    Args:
+        literals: {литерал: категория}.
+        ignore_case: поиск без учёта регистра.
+        word_chars: класс символов «слова» (например, r"\\S"). Если задан,
+            литерал засчитывается только как целый токен.
+        fold: приведение регистра строки при ignore_case (str.lower или str.upper).
+    """
+
+    _BYTES_IGNORECASE_LIMIT = 64
+
+    def __init__(self, literals: dict[str, str], ignore_case: bool = False,
+                 word_chars: Optional[str] = None, fold: Callable[[str], str] = str.lower):
+        self.ignore_case = ignore_case
+        self.word_chars = word_chars
+        self.fold = fold
+        self.literals = {self._key(lit): (lit, cat) for lit, cat in literals.items()}
+        
+        alternation = self._trie_pattern(self.literals) or "(?!)"
+        if word_chars:
+            pattern = f"(?<!{word_chars})(?=({alternation})(?!{word_chars}))"
+        else:
+            pattern = f"(?=({alternation}))"
+        self._regex = re.compile(pattern)
+        self._pattern = pattern
+        
+        # Для токенов префиксы не совпадают сами по себе (мешает граница слова)
+        self._prefixes: dict[str, list[str]] = {}
+        if not word_chars:
+            for key in self.literals:
+                self._prefixes[key] = [
+                    other for other in self.literals
+                    if other != key and key.startswith(other)
+                ]
+
+    @staticmethod
+    def _trie_pattern(words) -> str:
+        """Строит регулярку-дерево: общие префиксы литералов не повторяются."""
+        trie: dict = {}
+        for word in words:
+            node = trie
+            for ch in word:
+                node = node.setdefault(ch, {})
+            node[""] = {}
+        
+        def build(node: dict) -> str:
+            branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+            if not branches:
+                return ""
+            body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+            # Жадная необязательная группа: сначала пробуем более длинный литерал
+            return f"(?:{body})?" if "" in node else body
+        
+        return build(trie)
+
+    def _key(self, literal: str) -> str:
+        return self.fold(literal) if self.ignore_case else literal
+
+    @cached_property
+    def _bytes_fold(self) -> Optional[Callable[[bytes], bytes]]:
+        """Приведение регистра байтового входа или None (регистр учитывается в регулярке)."""
+        if not self.ignore_case or len(self.literals) <= self._BYTES_IGNORECASE_LIMIT:
+            return None
+        return bytes.upper if self.fold is str.upper else bytes.lower
+
+    @cached_property
+    def _bytes_regex(self) -> "re.Pattern":
+        in_pattern = self.ignore_case and self._bytes_fold is None
+        return re.compile(self._pattern.encode("utf-8"), re.IGNORECASE if in_pattern else 0)
+
+    def _prepare(self, data) -> tuple["re.Pattern", object]:
+        """Регулярка и вход: строка приводится к регистру копией, байты по возможности сканируются как есть."""
+        if isinstance(data, str):
+            return self._regex, self._key(data)
+        if self._bytes_fold is not None:
+            return self._bytes_regex, self._bytes_fold(bytes(data))
+        return self._bytes_regex, data
+
+    def _match_key(self, m: re.Match) -> str:
+        key = m.group(1)
+        return key if isinstance(key, str) else self._key(str(key, "utf-8"))
+
+    def search(self, data) -> Optional[str]:
+        """Возвращает первый найденный литерал или None (data — str, bytes или memoryview)."""
+        regex, subject = self._prepare(data)
+        m = regex.search(subject)
+        if m is None:
+            return None
+        return self.literals[self._match_key(m)][0]
+
+    def findall(self, data) -> dict[str, str]:
+        """Возвращает все найденные литералы: {литерал: категория}."""
+        found: dict[str, str] = {}
+        regex, subject = self._prepare(data)
+        for m in regex.finditer(subject):
+            key = self._match_key(m)
+            for k in (key, *self._prefixes.get(key, ())):
+                lit, cat = self.literals[k]
+                found.setdefault(lit, cat)
+        return found
+
+
+# ─── Сигнатурный движок ───────────────────────────────────────
+
+_REGEX_META = "()[]|.^$*+?{}\\"
+_ESCAPED_CHARS = {"n": "\n", "t": "\t", "r": "\r", "f": "\f", "v": "\v"}
+_REPEAT_RE = re.compile(r"\{(\d*)(?:,\d*)?\}")
+
+
+def _skip_group(pattern: str, i: int) -> int:
+    """Возвращает индекс сразу после группы или класса, начинающегося в позиции i."""
+    depth = 0
+    in_class = False
+    n = len(pattern)
+    while i < n:
+        ch = pattern[i]
+        if ch == "\\":
+            i += 2
+            continue
+        if in_class:
+            if ch == "]":
+                in_class = False
+                if depth == 0:
+                    return i + 1
+        elif ch == "[":
+            in_class = True
+            # "]" сразу после "[" или "[^" — литерал внутри класса
+            if pattern[i + 1:i + 2] == "^":
+                i += 1
+            if pattern[i + 1:i + 2] == "]":
+                i += 1
+        elif ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+            if depth == 0:
+                return i + 1
+        i += 1
+    return n
+
+
+def _parse_quantifier(pattern: str, i: int) -> tuple[int, Optional[int]]:
+    """Разбирает квантификатор в позиции i.
+
+    Returns:
+        (новая позиция, минимальное число повторений) или (i, None), если квантификатора нет.
+    """
+    ch = pattern[i:i + 1]
+    if ch in ("*", "?"):
+        min_rep, i = 0, i + 1
+    elif ch == "+":
+        min_rep, i = 1, i + 1
+    elif ch == "{":
+        m = _REPEAT_RE.match(pattern, i)
+        if not m:
+            return i, None
+        min_rep, i = int(m.group(1) or 0), m.end()
+    else:
+        return i, None
+    # Ленивый/possessive модификатор
+    if pattern[i:i + 1] in ("?", "+"):
+        i += 1
+    return i, min_rep
+
+
+def _split_alternatives(pattern: str) -> list[str]:
+    """Делит шаблон по «|» верхнего уровня."""
+    branches = []
+    last = i = 0
+    n = len(pattern)
+    while i < n:
+        ch = pattern[i]
+        if ch == "\\":
+            i += 2
+        elif ch in "([":
+            i = _skip_group(pattern, i)
+        elif ch == "|":
+            branches.append(pattern[last:i])
+            i += 1
+            last = i
+        else:
+            i += 1
+    branches.append(pattern[last:])
+    return branches
+
+
+def _group_body(group: str) -> Optional[str]:
+    """Возвращает содержимое группы "(...)", если она участвует в совпадении как подстрока."""
+    if not group.endswith(")"):
+        return None
+    inner = group[1:-1]
+    if not inner.startswith("?"):
+        return inner
+    if inner.startswith("?:"):
+        return inner[2:]
+    if inner.startswith("?P<"):
+        close = inner.find(">")
+        return inner[close + 1:] if close != -1 else None
+    m = re.match(r"\?[aiLmsu-]+:", inner)
+    if m:
+        return inner[m.end():]
+    # Lookaround, условные группы, комментарии, глобальные флаги
+    return None
+
+
+def _required_literals(pattern: str, min_len: int = 3) -> Optional[frozenset]:
+    """Извлекает из регулярки набор литералов, хотя бы один из которых обязан быть во входе.
+
+    Разбор консервативный: классы символов, якоря и необязательные части
+    разрывают литерал; группы и альтернативы «|» разбираются рекурсивно.
+    Из всех кандидатов выбирается набор с самым длинным минимальным
+    литералом (не короче min_len). None — если такого набора нет.
+    """
+    if re.search(r"\(\?[aiLmsu]*x", pattern):
+        return None
     
-    patterns = re.compile(
-        r"(?:\.\./|\.\.\\|%2e%2e|%252e%252e|/etc/|/proc/|c:\\|%00)",
-        re.IGNORECASE
-    )
+    branches = _split_alternatives(pattern)
+    if len(branches) > 1:
+        result = set()
+        for branch in branches:
+            required = _required_literals(branch, min_len)
+            if required is None:
+                return None
+            result |= required
+        return frozenset(result)
     
-    def run(self) -> None:
-        # Проверяем только параметры и тело
-        user_inputs = _get_all_input_values()
-        user_inputs.append(request.full_path)
+    candidates: list[frozenset] = []
+    current: list[str] = []
+    i, n = 0, len(pattern)
+    
+    def close_run():
+        if current:
+            run = "".join(current)
+            if len(run) >= min_len:
+                candidates.append(frozenset([run]))
+            current.clear()
+    
+    while i < n:
+        ch = pattern[i]
+        lit = None
+        if ch == "\\":
+            nxt = pattern[i + 1:i + 2]
+            if nxt and not nxt.isalnum() and nxt != "_":
+                lit, i = nxt, i + 2
+            elif nxt in _ESCAPED_CHARS:
+                lit, i = _ESCAPED_CHARS[nxt], i + 2
+            else:
+                # Классы (\d, \w, ...), якоря, коды символов и обратные ссылки
+                close_run()
+                i += 2
+                if nxt == "x":
+                    i += 2
+                elif nxt == "u":
+                    i += 4
+                elif nxt == "U":
+                    i += 8
+                elif nxt == "N" and pattern[i:i + 1] == "{":
+                    i = pattern.find("}", i) + 1 or n
+                elif nxt.isdigit():
+                    while i < n and pattern[i].isdigit():
+                        i += 1
+                i, _ = _parse_quantifier(pattern, i)
+                continue
+        elif ch == "(":
+            close_run()
+            end = _skip_group(pattern, i)
+            body = _group_body(pattern[i:end])
+            i, min_rep = _parse_quantifier(pattern, end)
+            if body is not None and (min_rep is None or min_rep >= 1):
+                required = _required_literals(body, min_len)
+                if required is not None:
+                    candidates.append(required)
+            continue
+        elif ch == "[":
+            close_run()
+            i, _ = _parse_quantifier(pattern, _skip_group(pattern, i))
+            continue
+        elif ch in ".^$":
+            close_run()
+            i, _ = _parse_quantifier(pattern, i + 1)
+            continue
+        elif ch == "{" and _REPEAT_RE.match(pattern, i):
+            # Квантификатор без операнда — шаблон некорректен для разбора
+            return None
+        else:
+            lit, i = ch, i + 1
         
-        for val in user_inputs:
-            decoded = unquote(val)
-            if self.patterns.search(decoded):
-                self.log(f"DETECTED LFI/RFI: {request.method} {request.path} | payload: {val[:50]}")
-                self.trigger_response()
-                return
-            
-            # Дополнительная проверка на существование путей
-            if os.path.exists(decoded) and len(val) > 3:
-                # Исключаем базовые пути проекта и статику
-                if not any(x in decoded.replace("\\", "/") for x in ["/static/", "/templates/"]):
-                    self.log(f"DETECTED LFI (path exists): {request.method} {request.path} | path: {val[:50]}")
-                    self.trigger_response()
-                    return
+        i, min_rep = _parse_quantifier(pattern, i)
+        if min_rep is None:
+            current.append(lit)
+        else:
+            if min_rep >= 1:
+                current.append(lit)
+            close_run()
+    close_run()
+    
+    if not candidates:
+        return None
+    return max(candidates, key=lambda lits: (min(map(len, lits)), -len(lits)))
 
 
-class SQLiDetector(BaseDetector):
-    """Обнаружение SQL Injection."""
-    dangerous = {
-        "@VARIABLE", "AND", "OR", "AS", "WHERE", "ORDER", 
-        "RLIKE", "SLEEP", "SELECT", "UNION", "DROP",
-        "INSERT", "UPDATE", "DELETE", "CONCAT", "BENCHMARK"
-    }
-    special = {"--", "/*", "*/", "#", ";"}
+def _flags_to_inline(flags: int) -> Optional[str]:
+    """Переводит флаги скомпилированного паттерна в inline-форму (?ims:...)."""
+    inline = ""
+    if flags & re.IGNORECASE:
+        inline += "i"
+    if flags & re.MULTILINE:
+        inline += "m"
+    if flags & re.DOTALL:
+        inline += "s"
+    if flags & ~(re.IGNORECASE | re.MULTILINE | re.DOTALL | re.UNICODE):
+        return None
+    return inline
 
-    def run(self) -> None:
-        # 1. Проверка ключевых слов по всему потоку (включая заголовки)
-        full_data = _get_request_full_data()
-        upper = unquote(full_data).upper()
+
+class _SignatureSet:
+    """Скомпилированная база сигнатур: сканирование за фиксированное число проходов.
+
+    - Из каждой сигнатуры извлекается набор обязательных литералов. Все литералы
+      ищутся одним проходом _LiteralMatcher, и регулярка сигнатуры запускается
+      только если во входе встретился хотя бы один из её литералов.
+    - Сигнатуры без литерала объединяются в общие регулярки с именованными
+      группами (по _CHUNK штук), имя сработавшей берётся из m.lastgroup.
+    - Несовместимые с объединением (обратные ссылки, свои именованные группы,
+      нестандартные флаги) проверяются по отдельности.
+    - Байтовый вход (bytes, memoryview) сканируется байтовыми версиями паттернов
+      без декодирования; паттерны, не переводимые в байты (не-ASCII, \\u-escape),
+      проверяются по тексту, декодированному один раз на вход.
+    """
+
+    _CHUNK = 50
+
+    def __init__(self, signatures: dict[str, "re.Pattern"], severities: Optional[dict[str, str]] = None):
+        # Словарь, из которого собран набор (проверка актуальности в SignatureDetector._get_engine)
+        self.source = signatures
+        self.severities = dict(severities or {})
+        self.names = list(signatures)
+        self.patterns = list(signatures.values())
         
-        words = re.split(r"[\W_]+", upper)
-        words = [w for w in words if w]
-        if any(w in self.dangerous for w in words):
-            self.log(f"DETECTED SQLi (keyword): {request.method} {request.path} | keyword found in stream")
-            self.trigger_response()
-            return
+        by_literal: dict[str, list[int]] = defaultdict(list)
+        mergeable: list[int] = []
+        self._standalone: list[int] = []
+        
+        for idx, pattern in enumerate(self.patterns):
+            literals = _required_literals(pattern.pattern)
+            if literals is not None:
+                for literal in {lit.lower() for lit in literals}:
+                    by_literal[literal].append(idx)
+            elif self._can_merge(pattern):
+                mergeable.append(idx)
+            else:
+                self._standalone.append(idx)
+        
+        self._by_literal = dict(by_literal)
+        self._prefilter = _LiteralMatcher(dict.fromkeys(self._by_literal, "signature"), ignore_case=True)
+        
+        self._combined: list[tuple["re.Pattern", dict[str, int]]] = []
+        for start in range(0, len(mergeable), self._CHUNK):
+            self._compile_chunk(mergeable[start:start + self._CHUNK])
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    @staticmethod
+    def _can_merge(pattern: "re.Pattern") -> bool:
+        if pattern.groupindex or _flags_to_inline(pattern.flags) is None:
+            return False
+        source = pattern.pattern
+        if re.search(r"\\[1-9]|\(\?P=|\(\?\(", source):
+            return False
+        # Глобальные inline-флаги вида (?i) нельзя вложить в группу
+        if re.search(r"\(\?[aiLmsux]+\)", source):
+            return False
+        return True
+
+    def _compile_chunk(self, indices: list[int]) -> None:
+        groups = {f"s{idx}": idx for idx in indices}
+        alternatives = [
+            f"(?P<s{idx}>(?{_flags_to_inline(self.patterns[idx].flags)}:{self.patterns[idx].pattern}))"
+            if _flags_to_inline(self.patterns[idx].flags)
+            else f"(?P<s{idx}>(?:{self.patterns[idx].pattern}))"
+            for idx in indices
+        ]
+        try:
+            self._combined.append((re.compile("|".join(alternatives)), groups))
+        except re.error:
+            self._standalone.extend(indices)
+
+    @staticmethod
+    def _to_bytes(pattern: "re.Pattern") -> Optional["re.Pattern"]:
+        """Байтовая версия паттерна или None, если она не эквивалентна исходной."""
+        if not pattern.pattern.isascii():
+            return None
+        try:
+            return re.compile(pattern.pattern.encode("ascii"), pattern.flags & ~re.UNICODE)
+        except (re.error, ValueError):
+            return None
+
+    @cached_property
+    def _bytes_patterns(self) -> list[Optional["re.Pattern"]]:
+        return [self._to_bytes(pattern) for pattern in self.patterns]
+
+    @cached_property
+    def _bytes_combined(self) -> list[Optional["re.Pattern"]]:
+        return [self._to_bytes(combined) for combined, _groups in self._combined]
+
+    def iter_matches(self, data):
+        """Генератор имён сработавших сигнатур (data — str, bytes или memoryview).
+
+        Останавливается, как только вызывающий код перестаёт запрашивать
+        значения, поэтому поиск первого совпадения не проверяет остальные.
+        """
+        binary = not isinstance(data, str)
+        text = None if binary else data
+        
+        def subject_for(bytes_pattern, pattern):
+            # Паттерн без байтовой версии проверяется по тексту, декодированному один раз
+            nonlocal text
+            if not binary:
+                return pattern, data
+            if bytes_pattern is not None:
+                return bytes_pattern, data
+            if text is None:
+                text = str(data, "utf-8", errors="replace")
+            return pattern, text
+        
+        bytes_patterns = self._bytes_patterns if binary else None
+        
+        def matches(idx: int) -> bool:
+            pattern, subject = subject_for(bytes_patterns and bytes_patterns[idx], self.patterns[idx])
+            return pattern.search(subject) is not None
+        
+        candidates = set()
+        for literal in self._prefilter.findall(data):
+            candidates.update(self._by_literal[literal])
+        for idx in sorted(candidates):
+            if matches(idx):
+                yield self.names[idx]
+        
+        for idx in self._standalone:
+            if matches(idx):
+                yield self.names[idx]
+        
+        for i, (combined, groups) in enumerate(self._combined):
+            combined, subject = subject_for(self._bytes_combined[i] if binary else None, combined)
+            seen = set()
+            for m in combined.finditer(subject):
+                idx = groups[m.lastgroup]
+                if idx not in seen:
+                    seen.add(idx)
+                    yield self.names[idx]
+
+    def search(self, data) -> Optional[str]:
+        """Возвращает имя первой сработавшей сигнатуры или None."""
+        return next(self.iter_matches(data), None)
+
+
+# ─── Индекс исполняемых файлов ────────────────────────────────
+
+class _ExecutableIndex:
+    """Множество имён исполняемых файлов в памяти (замена shutil.which на каждый токен).
+
+    Собирается при старте из каталогов $PATH и списка команд __RCE.list,
+    лежащего рядом с модулем. Раз в refresh_interval секунд индекс
+    пересобирается в фоновом потоке; запросы в это время читают старую
+    копию, поэтому проверка токена — всегда только поиск во frozenset.
+
+    Токен-путь проверяется по имени файла, только если это абсолютный путь
+    в каталоге бинарников (/bin, /usr/bin, ... и каталоги $PATH); любой другой
+    путь (docs/install, /account/id) должен совпасть с полным путём из индекса.
+    """
+
+    _NAME_RE = re.compile(r"^[\w.+-]+$")
+    # Элементы __RCE.list: имя команды без точек или абсолютный путь к ней
+    _LIST_NAME_RE = re.compile(r"^[a-z0-9][\w+-]*$")
+    BIN_DIRS = ("/bin", "/sbin", "/usr/bin", "/usr/sbin", "/usr/local/bin", "/usr/local/sbin")
+    # Обычные слова и имена функций из __RCE.list: как отдельные токены они
+    # встречаются в безобидном тексте ("meet at noon"), а не как команды
+    IGNORED_LIST_NAMES = frozenset({
+        "as", "at", "batch", "calc", "clip", "control", "cut", "dialog", "diff", "expect",
+        "explorer", "fetch", "find", "fish", "foot", "head", "host", "hyper", "kill", "kitty",
+        "make", "mount", "net", "paint", "paste", "patch", "perf", "reg", "route", "screen",
+        "script", "service", "sort", "source", "strip", "tail", "time", "top", "totem",
+        "ver", "vol", "watch", "where", "which", "write",
+        "backtick", "passthru", "popen", "proc_open", "shell_exec", "subprocess", "system",
+    })
+
+    def __init__(self, refresh_interval: float = 300.0, command_lists: Optional[list[str]] = None):
+        self.refresh_interval = refresh_interval
+        if command_lists is None:
+            command_lists = [os.path.join(os.path.dirname(os.path.abspath(__file__)), "__RCE.list")]
+        self.command_lists = command_lists
+        self._names: frozenset = frozenset()
+        self._paths: frozenset = frozenset()
+        self._bin_dirs: frozenset = frozenset()
+        self._built_at = 0.0
+        self._refreshing = False
+        self._lock = threading.Lock()
+        self.refresh()
+
+    @classmethod
+    def _normalize(cls, name: str) -> Optional[str]:
+        name = os.path.basename(name.strip()).lower()
+        if os.name == "nt":
+            stem, ext = os.path.splitext(name)
+            if ext and ext.upper() in os.environ.get("PATHEXT", ".COM;.EXE;.BAT;.CMD").split(";"):
+                name = stem
+        return name if cls._NAME_RE.match(name) else None
+
+    @staticmethod
+    def _normalize_path(path: str) -> str:
+        return os.path.normpath(path.strip().replace("\\", "/")).replace("\\", "/").lower()
+
+    def _scan(self) -> tuple[frozenset, frozenset, frozenset]:
+        names, paths = set(), set()
+        bin_dirs = {self._normalize_path(d) for d in self.BIN_DIRS}
+        
+        for directory in os.environ.get("PATH", "").split(os.pathsep):
+            if not directory:
+                continue
+            try:
+                entries = list(os.scandir(directory))
+            except OSError:
+                continue
+            bin_dirs.add(self._normalize_path(os.path.abspath(directory)))
+            for entry in entries:
+                try:
+                    if not entry.is_file():
+                        continue
+                    if os.name != "nt" and not os.access(entry.path, os.X_OK):
+                        continue
+                except OSError:
+                    continue
+                name = self._normalize(entry.name)
+                if name:
+                    names.add(name)
+                    paths.add(self._normalize_path(entry.path))
+        
+        for list_path in self.command_lists:
+            try:
+                with open(list_path, "r", encoding="utf-8") as f:
+                    lines = [line.strip().lower() for line in f]
+            except OSError:
+                continue
+            for line in lines:
+                name = os.path.basename(line)
+                if not self._LIST_NAME_RE.match(name) or name in self.IGNORED_LIST_NAMES:
+                    continue
+                if line == name:
+                    names.add(name)
+                elif line.startswith("/"):
+                    paths.add(self._normalize_path(line))
+        
+        return frozenset(names), frozenset(paths), frozenset(bin_dirs)
+
+    def refresh(self) -> None:
+        """Пересобирает индекс (синхронно)."""
+        names, paths, bin_dirs = self._scan()
+        with self._lock:
+            self._names, self._paths, self._bin_dirs = names, paths, bin_dirs
+            self._built_at = time.monotonic()
+            self._refreshing = False
+
+    def _refresh_in_background(self) -> None:
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self.refresh, daemon=True).start()
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def __contains__(self, token: str) -> bool:
+        return self.find([token]) is not None
+
+    def find(self, tokens) -> Optional[str]:
+        """Возвращает первый токен, совпадающий с исполняемым файлом, или None."""
+        if time.monotonic() - self._built_at > self.refresh_interval:
+            self._refresh_in_background()
+        names, paths, bin_dirs = self._names, self._paths, self._bin_dirs
+        for token in tokens:
+            if token in names:
+                return token
+            if "/" in token or "\\" in token:
+                path = self._normalize_path(token)
+                if path in paths:
+                    return token
+                # Путь к бинарнику (/usr/bin/id) — по имени файла, только в каталоге бинарников
+                directory, name = os.path.split(path)
+                if os.path.isabs(path) and directory in bin_dirs and self._normalize(name) in names:
+                    return token
+        return None
+
+
+# ─── Индекс чувствительных путей ──────────────────────────────
+
+class _SensitivePathIndex:
+    """Проверка «похоже ли значение на путь к существующему/чувствительному файлу» без ФС.
+
+    Вместо os.path.exists() на каждое значение (системный вызов с путём,
+    который контролирует атакующий) используются структуры в памяти:
+
+    - exact: файлы и каталоги дерева проекта (относительные и абсолютные пути),
+      собранные один раз при старте;
+    - prefixes: чувствительные каталоги и файлы (системные и служебные каталоги
+      проекта), значение совпадает, если любой его префикс по компонентам пути
+      есть в наборе.
+
+    Отрицательные результаты кешируются в ограниченном LRU, поэтому
+    повторяющиеся значения не разбираются повторно.
+    """
+
+    SYSTEM_PREFIXES = [
+        "/etc", "/proc", "/sys", "/dev", "/boot", "/root", "/home",
+        "/var/log", "/var/run", "/run/secrets",
+        "~/.ssh", "~/.aws", "~/.bash_history",
+        "c:/windows", "c:/users", "c:/boot.ini", "c:/inetpub",
+    ]
+    PROJECT_PREFIXES = [".git", ".env", ".apm", "security.sig", "sec_sign.key"]
+    SKIP_DIRS = {".git", "__pycache__", "venv", ".venv", "env", "node_modules", "static", "templates", "logs"}
+
+    def __init__(self, roots: list[str], max_entries: int = 50000, cache_size: int = 4096):
+        self.max_entries = max_entries
+        self.cache_size = cache_size
+        self._exact: set[str] = set()
+        self._prefixes: set[str] = {p.lower() for p in self.SYSTEM_PREFIXES + self.PROJECT_PREFIXES}
+        self._negative: "OrderedDict[str, None]" = OrderedDict()
+        self._lock = threading.Lock()
+        
+        for root in dict.fromkeys(os.path.abspath(r) for r in roots if r):
+            self._index_tree(root)
+
+    def _index_tree(self, root: str) -> None:
+        root_norm = self._normalize(root)
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = [d for d in dirnames if d not in self.SKIP_DIRS]
+            for name in dirnames + filenames:
+                if len(self._exact) >= self.max_entries:
+                    return
+                rel = self._normalize(os.path.relpath(os.path.join(dirpath, name), root))
+                self._exact.add(rel)
+                self._exact.add(f"{root_norm}/{rel}")
+
+    @staticmethod
+    def _normalize(value: str) -> str:
+        path = value.strip().replace("\\", "/")
+        while "//" in path:
+            path = path.replace("//", "/")
+        while path.startswith("./"):
+            path = path[2:]
+        return path.rstrip("/") or path
+
+    def contains(self, value: str) -> bool:
+        """True, если значение указывает на файл проекта или чувствительный путь."""
+        # Одиночное слово без разделителей и точки путём не считаем
+        if not any(ch in value for ch in "/\\.:~"):
+            return False
+        
+        with self._lock:
+            if value in self._negative:
+                self._negative.move_to_end(value)
+                return False
+        
+        norm = self._normalize(value)
+        if norm in self._exact or self._matches_prefix(norm.lower()):
+            return True
+        
+        with self._lock:
+            self._negative[value] = None
+            if len(self._negative) > self.cache_size:
+                self._negative.popitem(last=False)
+        return False
+
+    def _matches_prefix(self, path: str) -> bool:
+        prefix = ""
+        lead = "/" if path.startswith("/") else ""
+        for part in filter(None, path.split("/")):
+            prefix = f"{prefix}/{part}" if prefix else lead + part
+            if prefix in self._prefixes:
+                return True
+        return False
+
+
+# ─── Абстрактный детектор ─────────────────────────────────────
+
+class BaseDetector(ABC):
+    """Базовый класс детектора атак.
+    
+    cacheable: результат детектора зависит только от данных контекста
+    инспекции (путь, заголовки, тело), поэтому его вердикт можно кешировать.
+    Для пользовательских детекторов по умолчанию False.
+    
+    trigger_chars: символы, без которых детектор не может сработать на входных
+    данных (ctx.inputs). Если ни одного из них нет, детектор не запускается,
+    а значения без них пропускаются внутри run(). None — без префильтра.
+    
+    score: баллы аномалии за срабатывание в режиме оценки (IDS(scoring=True)).
+    """
+    
+    cacheable = False
+    trigger_chars: Optional[str] = None
+    _trigger_re: Optional[re.Pattern] = None
+    # Пул процессов для больших сканов (назначается IDS с scan_processes > 0)
+    scan_pool: Optional["_ScanPool"] = None
+    score = 5
+    # Режим оценки аномалий: детектор может сообщать о нескольких совпадениях
+    scoring = False
+    
+    def __init__(self, app: Flask):
+        self.app = app
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._trigger_re = re.compile(f"[{re.escape(cls.trigger_chars)}]") if cls.trigger_chars else None
+        cls._compile_patterns()
+
+    @classmethod
+    def _compile_patterns(cls) -> None:
+        """Компилирует матчеры паттернов класса.
+        
+        Вызывается один раз при создании класса детектора (в том числе для
+        наследников, переопределивших списки паттернов).
+        """
+        pass
+
+    @abstractmethod
+    def run(self) -> None:
+        pass
+
+    def may_trigger(self, ctx: InspectionContext) -> bool:
+        """Дешёвый префильтр запроса: False — детектор заведомо не сработает."""
+        return self.trigger_chars is None or not ctx.input_chars.isdisjoint(self.trigger_chars)
+
+    def _may_match(self, value: str) -> bool:
+        """Префильтр отдельного значения по trigger_chars."""
+        return self._trigger_re is None or self._trigger_re.search(value) is not None
+
+    @property
+    def context(self) -> InspectionContext:
+        """Контекст инспекции текущего запроса (разобранные входные данные)."""
+        return _get_inspection_context()
+
+    def log(self, message: str) -> None:
+        """Логирует критическое событие."""
+        self.app.logger.critical(message)
+
+    def trigger_response(self, points: Optional[int] = None) -> bool:
+        """Вызывается при обнаружении атаки (переопределяется IDS/IPS).
+        
+        points — баллы аномалии вместо self.score (режим оценки). Возвращает
+        True, если запрос уже признан атакой и продолжать проверку не нужно.
+        """
+        return False
+
+
+# ─── Детекторы ─────────────────────────────────────────────────
+
+class RCEDetector(BaseDetector):
+    """Обнаружение Remote Code Execution."""
+    cacheable = True
+    dangerous = ["echo", "eval", "exec", "system", "popen", "subprocess"]
+    _executables: Optional[_ExecutableIndex] = None
+    # Слово в позиции команды после разделителя оболочки: ;id, |/usr/bin/id, && id, $(id), `id`
+    _command_re = re.compile(r"(?:[;|&`]|\$\()\s*([^\s;|&`()<>]+)")
+
+    def __init__(self, app: Flask):
+        super().__init__(app)
+        if RCEDetector._executables is None:
+            RCEDetector._executables = _ExecutableIndex()
+
+    @classmethod
+    def _compile_patterns(cls) -> None:
+        cls._matcher = _LiteralMatcher(dict.fromkeys(cls.dangerous, "command"), word_chars=r"\S")
+
+    def run(self) -> None:
+        # Проверяем только параметры и тело для предотвращения логов от User-Agent и т.д.
+        ctx = self.context
+        
+        values = len(ctx.values)
+        for i, (val, decoded) in enumerate(zip(ctx.inputs, ctx.path_values_lower)):
+            # Проверка по списку опасных команд (токены целиком, один проход)
+            found = self._matcher.search(decoded)
+            if found is None:
+                # Имена из $PATH и __RCE.list — поиск в памяти, без обращений к ФС.
+                # В URL "&" разделяет параметры, поэтому позиции команд — только в значениях
+                tokens = decoded.split()
+                if i < values:
+                    tokens += self._command_re.findall(decoded)
+                found = self._executables.find(tokens)
+            if found is not None:
+                self.log(f"DETECTED RCE: {ctx.method} {ctx.path} | payload: {val[:50]}")
+                self.trigger_response()
+                return
+
+
+class LFIDetector(BaseDetector):
+    """Обнаружение Local/Remote File Inclusion.
+    
+    Режим проверки путей (path_check):
+        "index" — по индексу дерева проекта и чувствительных путей в памяти (по умолчанию);
+        "fs"    — os.path.exists() на каждое значение (прежнее поведение);
+        "off"   — только паттерны.
+    """
+    cacheable = True
+    # Каждый паттерн и проверка путей по индексу требуют хотя бы одного из этих символов
+    trigger_chars = "./\\%:~\x00"
+    # URL запроса всегда содержит "/", а проверка путей к нему не применяется:
+    # для него "/" значим только в составе /etc/ и /proc/
+    _url_trigger_re = re.compile(r"[.\\%:~\x00]|/(?:etc|proc)/", re.IGNORECASE)
+    
+    # Многократно закодированные формы (%252e%252e, %2500) снимает канонизация значений
+    patterns = re.compile(
+        r"(?:\.\./|\.\.\\|/etc/|/proc/|c:\\|%00|\x00)",
+        re.IGNORECASE
+    )
+    path_check = "index"
+    _path_index: Optional[_SensitivePathIndex] = None
+    
+    def __init__(self, app: Flask):
+        super().__init__(app)
+        if self.path_check == "index" and LFIDetector._path_index is None:
+            LFIDetector._path_index = _SensitivePathIndex([os.getcwd(), getattr(app, "root_path", None)])
+    
+    def may_trigger(self, ctx: InspectionContext) -> bool:
+        # os.path.exists() срабатывает и на имена без спецсимволов
+        if self.path_check == "fs":
+            return True
+        return (not ctx.value_chars.isdisjoint(self.trigger_chars)
+                or self._url_trigger_re.search(ctx.decoded[-1]) is not None)
+    
+    def _path_exists(self, decoded: str) -> bool:
+        if self.path_check == "index":
+            return self._path_index.contains(decoded)
+        if self.path_check == "fs":
+            return os.path.exists(decoded)
+        return False
+    
+    def run(self) -> None:
+        # Проверяем только параметры и тело
+        ctx = self.context
+        
+        prefilter = self.path_check != "fs"
+        values = len(ctx.values)
+        for i, (val, decoded) in enumerate(zip(ctx.inputs, ctx.path_values)):
+            if prefilter:
+                if i < values and not self._may_match(decoded):
+                    continue
+                if i == values and self._url_trigger_re.search(decoded) is None:
+                    continue
+            if self.patterns.search(decoded):
+                self.log(f"DETECTED LFI/RFI: {ctx.method} {ctx.path} | payload: {val[:50]}")
+                self.trigger_response()
+                return
+            
+            # Дополнительная проверка на существование путей (только значения, не URL запроса)
+            if i < len(ctx.values) and len(val) > 3 and self._path_exists(decoded):
+                # Исключаем базовые пути проекта и статику
+                if not any(x in decoded.replace("\\", "/") for x in ["/static/", "/templates/"]):
+                    self.log(f"DETECTED LFI (path exists): {ctx.method} {ctx.path} | path: {val[:50]}")
+                    self.trigger_response()
+                    return
+
+
+class SQLiDetector(BaseDetector):
+    """Обнаружение SQL Injection."""
+    cacheable = True
+    dangerous = {
+        "@VARIABLE", "AND", "OR", "AS", "WHERE", "ORDER", 
+        "RLIKE", "SLEEP", "SELECT", "UNION", "DROP",
+        "INSERT", "UPDATE", "DELETE", "CONCAT", "BENCHMARK"
+    }
+    special = {"--", "/*", "*/", "#", ";"}
+
+    @classmethod
+    def _compile_patterns(cls) -> None:
+        # Ключевые слова — целые токены, разделённые [\W_]
+        cls._keywords = _LiteralMatcher(
+            dict.fromkeys(cls.dangerous, "keyword"), ignore_case=True, word_chars=r"[^\W_]", fold=str.upper,
+        )
+        cls._special = _LiteralMatcher(dict.fromkeys(cls.special, "special"))
+
+    def _has_keyword(self, text) -> bool:
+        pool = self.scan_pool
+        if pool is not None and pool.offloads(text) and pool.sql_keywords is self._keywords:
+            found = pool.run(_scan_sql_keywords, text)
+            if found is not pool.FAILED:
+                return found
+        return self._keywords.search(text) is not None
+
+    def run(self) -> None:
+        ctx = self.context
+        
+        # 1. Проверка ключевых слов по всему потоку (включая заголовки)
+        # (заголовки — только отнесённые к SQLiDetector правилами header_rules)
+        if any(map(self._has_keyword, ctx.iter_stream("SQLiDetector"))):
+            self.log(f"DETECTED SQLi (keyword): {ctx.method} {ctx.path} | keyword found in stream")
+            self.trigger_response()
+            return
+
+        # 2. Проверка спецсимволов ТОЛЬКО в данных пользователя (параметры и тело)
+        # Мы НЕ проверяем заголовки на спецсимволы, так как там часто бывают ';' и '#'
+        # (путь запроса входит в ctx.inputs)
+        for val, decoded_val in zip(ctx.inputs, ctx.upper):
+            if self._special.search(decoded_val) is not None:
+                # Исключаем ложное срабатывание на простые ';' в параметрах, если это не похоже на инъекцию
+                # Но для безопасности блокируем большинство спецсимволов в параметрах
+                self.log(f"DETECTED SQLi (special char): {ctx.method} {ctx.path} | char in payload: {val[:50]}")
+                self.trigger_response()
+                return
+
+
+class XSSDetector(BaseDetector):
+    """Обнаружение Cross-Site Scripting."""
+    cacheable = True
+    # Разделяем на критические (сразу бан) и подозрительные (нужно комбо)
+    critical_patterns = [
+        "<script", "javascript:", "onerror=", "onload=", "onclick=", "eval(", "alert("
+    ]
+    suspicious_patterns = [
+        "<", ">", "/*", "*/", " src=", " href=", "document.", "cookie"
+    ]
+    # Каждый критический паттерн содержит один из символов; без них набирается
+    # не больше двух подозрительных ("document.", "cookie") — порог не достигается
+    trigger_chars = "<>:=(*"
+
+    @classmethod
+    def _compile_patterns(cls) -> None:
+        literals = dict.fromkeys(cls.suspicious_patterns, "suspicious")
+        literals.update(dict.fromkeys(cls.critical_patterns, "critical"))
+        cls._matcher = _LiteralMatcher(literals)
+
+    def run(self) -> None:
+        ctx = self.context
+        
+        for val, decoded in zip(ctx.inputs, ctx.lower):
+            if not self._may_match(decoded):
+                continue
+            found = self._matcher.findall(decoded)
+            if not found:
+                continue
+            
+            # 1. Проверка критических паттернов
+            critical = [p for p, category in found.items() if category == "critical"]
+            if critical:
+                self.log(f"DETECTED XSS (critical): {ctx.method} {ctx.path} | pattern '{critical[0]}' in {val[:30]}")
+                self.trigger_response()
+                return
+            
+            # 2. Проверка комбинации подозрительных (3 и более)
+            matches = [p for p, category in found.items() if category == "suspicious"]
+            if len(matches) >= 3:
+                self.log(f"DETECTED XSS (pattern match): {ctx.method} {ctx.path} | patterns {matches} in {val[:30]}")
+                self.trigger_response()
+                return
+
+
+class SignatureDetector(BaseDetector):
+    """Сигнатурный анализ: поиск известных CVE и паттернов атак.
+    
+    Загружает сигнатуры из открытой базы signatures_db.json.
+    Если файл не найден — использует встроенный набор.
+    """
+    cacheable = True
+    
+    # Встроенные сигнатуры (fallback)
+    _builtin_signatures = {
+        "Log4Shell (CVE-2021-44228)": re.compile(r"\$\{jndi:(ldap|rmi|ldaps|dns):", re.I),
+        "Spring4Shell (CVE-2022-22965)": re.compile(r"class\.module\.classLoader\.(resources|URLs)", re.I),
+        "Shellshock (CVE-2014-6271)": re.compile(r"\(\)\s*\{\s*[:;]\s*\}\s*;", re.I),
+        "Struts2 RCE (S2-045)": re.compile(r"%\{\(#[^}]+\)\.?(getValue|exec|getRuntime)", re.I),
+        "PHP Serialization Exploit": re.compile(r"O:\d+:\"[^\"]+\":\d+:\{", re.I),
+        "Generic Web Shell": re.compile(r"(passthru|shell_exec|system|phpinfo|base64_decode)\s*\(", re.I),
+    }
+    
+    signatures = {}
+    # Уровень опасности сигнатур из базы и баллы аномалии для режима оценки
+    severities: dict[str, str] = {}
+    severity_scores = {"critical": 5, "high": 4, "medium": 3, "low": 2}
+    _db_loaded = False
+    _engine: Optional[_SignatureSet] = None
+    # Публикация новой базы (signatures, severities, _engine) выполняется под этой блокировкой
+    _swap_lock = threading.Lock()
+    _reloader: Optional["_SignatureReloader"] = None
+
+    def __init__(self, app: Flask):
+        super().__init__(app)
+        if not SignatureDetector._db_loaded:
+            SignatureDetector._load_db()
+    
+    @staticmethod
+    def _default_db_path() -> str:
+        return os.path.join(os.path.dirname(os.path.abspath(__file__)), "signatures_db.json")
+    
+    @staticmethod
+    def _parse_db(db_path: str) -> tuple[dict, dict]:
+        """Читает и компилирует JSON-базу: ({имя: паттерн}, {имя: severity}).
+        
+        Некорректные регулярки пропускаются; ошибки чтения и разбора JSON пробрасываются.
+        """
+        import json
+        with open(db_path, "r", encoding="utf-8") as f:
+            db = json.load(f)
+        
+        signatures, severities = {}, {}
+        for sig in db.get("signatures", []):
+            name = sig.get("name", "Unknown")
+            pattern = sig.get("pattern")
+            flags_str = sig.get("flags", "")
+            
+            if not pattern:
+                continue
+            
+            flags = 0
+            if "i" in flags_str:
+                flags |= re.IGNORECASE
+            if "s" in flags_str:
+                flags |= re.DOTALL
+            if "m" in flags_str:
+                flags |= re.MULTILINE
+            
+            try:
+                signatures[name] = re.compile(pattern, flags)
+                severities[name] = sig.get("severity")
+            except re.error:
+                pass
+        return signatures, severities
+    
+    @classmethod
+    def _install(cls, signatures: dict, severities: dict, engine: Optional[_SignatureSet] = None) -> None:
+        """Публикует новую базу заменой ссылок; словари после публикации не изменяются.
+        
+        Запрос, уже взявший движок (_get_engine), дорабатывает на старом наборе.
+        """
+        if engine is None:
+            engine = _SignatureSet(signatures, severities)
+        with cls._swap_lock:
+            cls.signatures = signatures
+            cls.severities = severities
+            cls._engine = engine
+            cls._db_loaded = True
+        _bump_ruleset_generation(signatures=True)
+    
+    @classmethod
+    def _load_db(cls, db_path: Optional[str] = None):
+        """Загружает сигнатуры из signatures_db.json рядом с этим файлом (или из db_path, заменяя текущую базу)."""
+        import json
+        if db_path is None:
+            db_path = cls._default_db_path()
+            base, base_severities = cls.signatures, cls.severities
+        else:
+            base, base_severities = {}, {}
+        
+        if os.path.exists(db_path):
+            try:
+                signatures, severities = cls._parse_db(db_path)
+                cls._install({**base, **signatures}, {**base_severities, **severities})
+                print(f"[IPS] Загружено {len(signatures)} сигнатур из открытой базы ({os.path.basename(db_path)})")
+                return
+            except (json.JSONDecodeError, IOError) as e:
+                print(f"[IPS] Ошибка загрузки базы сигнатур: {e}, используем встроенные")
+        
+        cls._install(dict(cls._builtin_signatures), {})
+        print(f"[IPS] Используется встроенная база ({len(cls.signatures)} сигнатур)")
+    
+    @classmethod
+    def load_signatures(cls, path: str):
+        """Загрузить дополнительные сигнатуры из указанного JSON файла."""
+        import json
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                db = json.load(f)
+            # Копия базы: словари, которые могут читать запросы, не изменяются
+            signatures, severities = dict(cls.signatures), dict(cls.severities)
+            for sig in db.get("signatures", []):
+                pattern = sig.get("pattern")
+                if pattern:
+                    flags = re.IGNORECASE if "i" in sig.get("flags", "") else 0
+                    if "s" in sig.get("flags", ""):
+                        flags |= re.DOTALL
+                    signatures[sig.get("name", "Custom")] = re.compile(pattern, flags)
+                    severities[sig.get("name", "Custom")] = sig.get("severity")
+            cls._install(signatures, severities)
+        except Exception as e:
+            print(f"[IPS] Ошибка загрузки доп. сигнатур: {e}")
+
+    @classmethod
+    def watch_db(cls, path: Optional[str] = None, interval: float = 2.0) -> "_SignatureReloader":
+        """Включает горячую перезагрузку базы при изменении файла (один наблюдатель на процесс)."""
+        path = path or cls._default_db_path()
+        reloader = SignatureDetector._reloader
+        if reloader is not None and (reloader.path != path or reloader.interval != interval):
+            reloader.stop()
+            reloader = None
+        if reloader is None:
+            reloader = SignatureDetector._reloader = _SignatureReloader(path, interval)
+        return reloader
+
+    @classmethod
+    def _get_engine(cls) -> _SignatureSet:
+        """Возвращает скомпилированный набор сигнатур.
+        
+        Пересобирается, только если словарь signatures заменили или изменили
+        в обход _install (например, напрямую из пользовательского кода).
+        """
+        engine = cls._engine
+        signatures = cls.signatures
+        if engine is None or engine.source is not signatures or len(engine) != len(signatures):
+            with cls._swap_lock:
+                engine = cls._engine
+                signatures = cls.signatures
+                if engine is None or engine.source is not signatures or len(engine) != len(signatures):
+                    engine = _SignatureSet(signatures, cls.severities)
+                    cls._engine = engine
+        return engine
+
+    def run(self) -> None:
+        ctx = self.context
+        
+        engine = self._get_engine()
+        pool = self.scan_pool
+        
+        def search(text) -> Optional[str]:
+            if pool is not None and pool.offloads(text):
+                found = pool.run(_scan_signatures, text)
+                if found is not pool.FAILED:
+                    return found
+            return engine.search(text)
+        
+        if self.scoring:
+            self._run_scoring(ctx, engine, pool)
+            return
+        
+        name = next(filter(None, map(search, ctx.iter_stream("SignatureDetector"))), None)
+        if name is not None:
+            self.log(f"DETECTED SIGNATURE: {name} | {ctx.method} {ctx.path}")
+            self.trigger_response()
+
+    def _run_scoring(self, ctx: InspectionContext, engine: _SignatureSet, pool: Optional["_ScanPool"]) -> None:
+        """Режим оценки: каждая сигнатура добавляет баллы по severity, пока не достигнут порог."""
+        seen = set()
+        for text in ctx.iter_stream("SignatureDetector"):
+            names = None
+            if pool is not None and pool.offloads(text):
+                names = pool.run(_scan_signatures_all, text)
+            if names is None or names is pool.FAILED:
+                names = engine.iter_matches(text)
+            for name in names:
+                if name in seen:
+                    continue
+                seen.add(name)
+                points = self.severity_scores.get(engine.severities.get(name), self.score)
+                self.log(f"DETECTED SIGNATURE: {name} (+{points}) | {ctx.method} {ctx.path}")
+                if self.trigger_response(points):
+                    return
+
+
+class RuleDetector(BaseDetector):
+    """Анализ на основе правил (Rule-based Analysis)."""
+    
+    rules = [] # Список функций-правил или объектов
+
+    def add_rule(self, condition_fn, action_msg="Rule Triggered"):
+        self.rules.append((condition_fn, action_msg))
+        _bump_ruleset_generation()
+
+    def run(self) -> None:
+        # Пример дефолтного правила: блокировка curl (если нужно)
+        # if "curl" in request.headers.get("User-Agent", "").lower():
+        #     self.log("BLOCK RULE: curl access denied")
+        #     self.trigger_response()
+        #     return
+
+        # Вне flask-запроса (асинхронный IDS) правило получает снимок запроса
+        if has_request_context():
+            subject = request
+        else:
+            subject = self.context.request or self.context
+        for condition, msg in self.rules:
+            try:
+                matched = condition(subject)
+            except Exception as e:
+                self.app.logger.error(f"RuleDetector rule {msg!r} failed: {e!r}")
+                continue
+            # Вне try: IPS прерывает запрос исключением из trigger_response
+            if matched:
+                self.log(f"BLOCK RULE: {msg} | {subject.method} {subject.path}")
+                self.trigger_response()
+                return
+
+
+# ─── Пул процессов для сканирования ──────────────────────────
+
+# Наборы правил в процессе-воркере пула (заполняются инициализатором)
+_worker_rules: dict = {}
+
+# Пулы процессов текущего процесса (пересоздаются заранее при перезагрузке сигнатур)
+_scan_pools: "weakref.WeakSet[_ScanPool]" = weakref.WeakSet()
+
+
+def _scan_worker_init(signatures: dict, sql_keywords: "_LiteralMatcher") -> None:
+    """Инициализатор процесса пула: компилирует набор сигнатур один раз на процесс."""
+    _worker_rules["signatures"] = _SignatureSet(signatures)
+    _worker_rules["sql_keywords"] = sql_keywords
+
+
+def _scan_worker_ping() -> int:
+    return os.getpid()
+
+
+def _scan_signatures(text: str) -> Optional[str]:
+    return _worker_rules["signatures"].search(text)
+
+
+def _scan_signatures_all(text: str) -> list[str]:
+    return list(_worker_rules["signatures"].iter_matches(text))
+
+
+def _scan_sql_keywords(text) -> bool:
+    return _worker_rules["sql_keywords"].search(text) is not None
+
+
+class _ScanPool:
+    """Пул процессов для тяжёлых regex-сканов (SignatureDetector, ключевые слова SQLiDetector).
+
+    Сканирование держит GIL, поэтому в многопоточном сервере большой запрос
+    останавливает остальные потоки. Тексты длиннее threshold символов
+    отправляются в заранее запущенные процессы с уже скомпилированными
+    правилами; поток запроса при этом ждёт результат, не занимая GIL.
+    Короткие тексты сканируются в своём потоке.
+
+    Процессы запускаются через start_method ("forkserver", где он доступен,
+    иначе "spawn"), а не fork: копия многопоточного сервера с захваченными
+    блокировками может зависнуть в воркере. При смене базы сигнатур
+    (поколение _signature_generation; add_rule его не меняет) пул
+    пересоздаётся в фоновом потоке, а до готовности нового пула тексты
+    сканируются в потоке запроса текущим набором — старый пул с прежними
+    сигнатурами для них не используется.
+    """
+
+    # Результат при ошибке пула — скан выполняется в потоке запроса
+    FAILED = object()
+
+    def __init__(self, processes: int = 2, threshold: int = 256 * 1024, timeout: float = 10.0,
+                 start_method: Optional[str] = None):
+        self.processes = processes
+        self.threshold = threshold
+        self.timeout = timeout
+        self.offloaded = 0
+        self.failures = 0
+        self.rebuilds = 0
+        if start_method is None:
+            start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        self._mp_context = multiprocessing.get_context(start_method)
+        self._lock = threading.Lock()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._generation = None
+        self._rebuilding = False
+        self._closed = False
+        self.sql_keywords = None
+        # Первый пул собирается синхронно: к первому запросу процессы уже запущены
+        self._rebuild()
+        _scan_pools.add(self)
+
+    def _start_executor(self) -> ProcessPoolExecutor:
+        if not SignatureDetector._db_loaded:
+            SignatureDetector._load_db()
+        self.sql_keywords = SQLiDetector._keywords
+        executor = ProcessPoolExecutor(
+            max_workers=self.processes,
+            mp_context=self._mp_context,
+            initializer=_scan_worker_init,
+            initargs=(dict(SignatureDetector.signatures), self.sql_keywords),
+        )
+        # Процессы запускаются сразу, а не на первом большом запросе
+        try:
+            for future in [executor.submit(_scan_worker_ping) for _ in range(self.processes)]:
+                future.result()
+        except BaseException:
+            executor.shutdown(wait=False)
+            raise
+        return executor
+
+    def _rebuild(self) -> None:
+        """Собирает пул для текущей базы сигнатур; повторяет, если база сменилась во время сборки."""
+        while True:
+            generation = _signature_generation
+            try:
+                executor = self._start_executor()
+            except Exception as e:
+                self.failures += 1
+                print(f"[IPS] Ошибка пересоздания пула сканирования: {e}")
+                with self._lock:
+                    # До следующей смены базы сканы выполняются в потоке запроса
+                    self._generation = generation
+                    self._rebuilding = False
+                return
+            with self._lock:
+                old = self._executor
+                if self._closed:
+                    old, executor = executor, None
+                self._executor = executor
+                self._generation = generation
+                self.rebuilds += 1
+                done = self._closed or generation == _signature_generation
+                if done:
+                    self._rebuilding = False
+            if old is not None:
+                old.shutdown(wait=False)
+            if done:
+                return
+
+    def refresh(self) -> None:
+        """Запускает пересоздание пула в фоновом потоке, если база сигнатур сменилась."""
+        with self._lock:
+            if self._rebuilding or self._closed or self._generation == _signature_generation:
+                return
+            self._rebuilding = True
+        threading.Thread(target=self._rebuild, name="scan-pool-rebuild", daemon=True).start()
+
+    def _current_executor(self) -> Optional[ProcessPoolExecutor]:
+        """Пул для текущей базы сигнатур или None, пока он пересоздаётся."""
+        executor = self._executor
+        if executor is not None and self._generation == _signature_generation:
+            return executor
+        self.refresh()
+        return None
+
+    def offloads(self, text: str) -> bool:
+        return len(text) >= self.threshold
+
+    def run(self, func: Callable, text: str):
+        """Выполняет скан в пуле (FAILED при ошибке пула)."""
+        if isinstance(text, memoryview):
+            # memoryview не сериализуется; окно всё равно копируется при передаче в процесс
+            text = text.tobytes()
+        executor = self._current_executor()
+        if executor is None:
+            return self.FAILED
+        try:
+            result = executor.submit(func, text).result(timeout=self.timeout)
+        except Exception as e:
+            self.failures += 1
+            print(f"[IPS] Ошибка пула сканирования: {e}, скан выполняется в потоке запроса")
+            return self.FAILED
+        self.offloaded += 1
+        return result
+
+    def shutdown(self) -> None:
+        with self._lock:
+            self._closed = True
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+    def stats(self) -> dict:
+        return {
+            "processes": self.processes,
+            "threshold": self.threshold,
+            "offloaded": self.offloaded,
+            "failures": self.failures,
+            "rebuilds": self.rebuilds,
+        }
+
+
+# ─── Горячая перезагрузка сигнатур ───────────────────────────
+
+class _SignatureReloader:
+    """Фоновая перезагрузка базы сигнатур при изменении файла.
+
+    Поток раз в interval секунд сравнивает mtime и размер файла. Изменённая
+    база читается и компилируется (_SignatureSet) в этом же потоке, а затем
+    публикуется одной заменой ссылок (SignatureDetector._install): запросы
+    не ждут компиляции и не видят частично собранный словарь, а запрос, уже
+    взявший движок, дорабатывает на старом наборе. Файл с ошибкой (например,
+    записанный не до конца) или без сигнатур пропускается — действует прежняя
+    база, попытка повторится при следующем изменении файла. Сигнатуры,
+    добавленные через load_signatures, при перезагрузке заменяются содержимым файла.
+    """
+
+    def __init__(self, path: str, interval: float = 2.0):
+        self.path = path
+        self.interval = interval
+        self.reloads = 0
+        self.errors = 0
+        self._stamp = self._file_stamp()
+        self._stop = threading.Event()
+        threading.Thread(target=self._watch, daemon=True).start()
+
+    def _file_stamp(self) -> Optional[tuple[int, int]]:
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self.interval):
+            stamp = self._file_stamp()
+            if stamp is None or stamp == self._stamp:
+                continue
+            self._stamp = stamp
+            self.reload()
+
+    def reload(self) -> bool:
+        """Перечитывает и публикует базу (синхронно, в вызывающем потоке)."""
+        try:
+            signatures, severities = SignatureDetector._parse_db(self.path)
+            if not signatures:
+                raise ValueError("в базе нет корректных сигнатур")
+        except (OSError, ValueError) as e:
+            self.errors += 1
+            print(f"[IPS] Ошибка перезагрузки базы сигнатур: {e}, действует прежняя база")
+            return False
+        
+        SignatureDetector._install(signatures, severities, _SignatureSet(signatures, severities))
+        self.reloads += 1
+        print(f"[IPS] База сигнатур перезагружена: {len(signatures)} сигнатур ({os.path.basename(self.path)})")
+        
+        # Пулы процессов пересоздаются в фоне сразу, а не при первом большом запросе
+        for pool in list(_scan_pools):
+            pool.refresh()
+        return True
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def stats(self) -> dict:
+        return {
+            "path": self.path,
+            "interval": self.interval,
+            "reloads": self.reloads,
+            "errors": self.errors,
+        }
+
+
+# ─── Бан-лист ─────────────────────────────────────────────────
+
+class _CidrTrie:
+    """Префиксное дерево сетей по байтам адреса (шаг 8 бит).
+
+    Узел — [дети {байт: узел}, срок бана]. Префикс, не кратный 8, разворачивается
+    в соседние узлы последнего байта (/20 → 16 узлов), поэтому проверка адреса —
+    не больше 4 (IPv4) или 16 (IPv6) поисков в словаре, независимо от числа банов.
+    В узле хранится самый поздний срок из попавших в него сетей.
+    """
+
+    def __init__(self):
+        self.root: list = [{}, 0.0]
+
+    def insert(self, packed: bytes, prefix: int, expires: float) -> None:
+        node = self.root
+        full, rest = divmod(prefix, 8)
+        for byte in packed[:full]:
+            child = node[0].get(byte)
+            if child is None:
+                child = node[0][byte] = [{}, 0.0]
+            node = child
+        if not rest:
+            node[1] = max(node[1], expires)
+            return
+        base = packed[full] & (0xFF << (8 - rest)) & 0xFF
+        for byte in range(base, base + (1 << (8 - rest))):
+            child = node[0].get(byte)
+            if child is None:
+                child = node[0][byte] = [{}, 0.0]
+            child[1] = max(child[1], expires)
+
+    def match(self, packed: bytes, now: float) -> bool:
+        node = self.root
+        if node[1] > now:
+            return True
+        for byte in packed:
+            node = node[0].get(byte)
+            if node is None:
+                return False
+            if node[1] > now:
+                return True
+        return False
+
+
+class BanList:
+    """Список забаненных адресов и сетей (IPv4/IPv6, CIDR) со сроком действия.
+
+    Проверка (check_request) ставится самым первым before_request приложения
+    (install): запрос с забаненного адреса отклоняется (403) до разбора тела
+    и запуска детекторов. Баны добавляют IPS (ban_list=...) при блокировке
+    атаки и RateLimiter при превышении лимита правилом с ban_ttl, либо
+    вызов ban().
+
+    Если задан path, список хранится в JSON-файле: загружается при создании
+    (воркеры получают баны при старте), а фоновый поток раз в sync_interval
+    секунд дописывает новые баны и подхватывает баны других процессов. Записи
+    сливаются по времени изменения, снятие бана (unban) тоже распространяется.
+    """
+
+    _V4_MAPPED = b"\0" * 10 + b"\xff\xff"
+
+    def __init__(self, path: Optional[str] = None, default_ttl: float = 3600.0,
+                 max_entries: int = 100_000, sync_interval: float = 2.0):
+        self.path = path
+        self.default_ttl = default_ttl
+        self.max_entries = max_entries
+        self.sync_interval = sync_interval
+        self.blocked = 0
+        self.dropped = 0
+        # сеть → [срок бана, время изменения, причина]; срок 0 — бан снят
+        self._entries: dict[str, list] = {}
+        self._v4 = _CidrTrie()
+        self._v6 = _CidrTrie()
+        self._active = 0
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._stamp: Optional[tuple[int, int]] = None
+        self._apps = weakref.WeakSet()
+        self._stop = threading.Event()
+        if path:
+            self.sync()
+            threading.Thread(target=self._sync_loop, daemon=True).start()
+
+    # ─── Проверка ───────────────────────────────────────────
+
+    def install(self, flask_app: Flask) -> None:
+        """Ставит проверку бан-листа первым before_request приложения (один раз)."""
+        if flask_app in self._apps:
+            return
+        flask_app.before_request_funcs.setdefault(None, []).insert(0, self.check_request)
+        self._apps.add(flask_app)
+
+    def check_request(self) -> None:
+        if self._active and self.is_banned(request.remote_addr):
+            self.blocked += 1
+            abort(403)
+
+    def is_banned(self, addr: Optional[str]) -> bool:
+        if not addr:
+            return False
+        try:
+            if ":" in addr:
+                packed = socket.inet_pton(socket.AF_INET6, addr)
+                if packed[:12] == self._V4_MAPPED:
+                    return self._v4.match(packed[12:], time.time())
+                return self._v6.match(packed, time.time())
+            return self._v4.match(socket.inet_pton(socket.AF_INET, addr), time.time())
+        except OSError:
+            return False
+
+    def __contains__(self, addr: str) -> bool:
+        return self.is_banned(addr)
+
+    # ─── Изменение ──────────────────────────────────────────
+
+    @staticmethod
+    def _network(target: str):
+        network = ipaddress.ip_network(target, strict=False)
+        mapped = getattr(network.network_address, "ipv4_mapped", None)
+        if mapped is not None and network.prefixlen >= 96:
+            network = ipaddress.ip_network(f"{mapped}/{network.prefixlen - 96}")
+        return network
+
+    def ban(self, target: str, ttl: Optional[float] = None, reason: str = "") -> bool:
+        """Банит адрес или сеть ("203.0.113.7", "198.51.100.0/24", "2001:db8::/32") на ttl секунд.
+
+        Возвращает False, если список переполнен (max_entries активных банов).
+        ValueError — если target не адрес и не сеть.
+        """
+        network = self._network(target)
+        key = str(network)
+        now = time.time()
+        expires = now + (ttl if ttl is not None else self.default_ttl)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] >= expires:
+                return True
+            if entry is None and len(self._entries) >= self.max_entries:
+                self._rebuild(now)
+                if len(self._entries) >= self.max_entries:
+                    self.dropped += 1
+                    return False
+            if entry is None or entry[0] <= now:
+                self._active += 1
+            self._entries[key] = [expires, now, reason]
+            trie = self._v4 if network.version == 4 else self._v6
+            trie.insert(network.network_address.packed, network.prefixlen, expires)
+            self._dirty = True
+        return True
+
+    def unban(self, target: str) -> bool:
+        """Снимает бан сети (ровно этой записи, а не покрывающих её сетей)."""
+        key = str(self._network(target))
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= now:
+                return False
+            self._entries[key] = [0.0, now, ""]
+            self._rebuild(now)
+            self._dirty = True
+        return True
+
+    def _rebuild(self, now: float) -> None:
+        """Удаляет истёкшие записи и пересобирает деревья. Вызывается под _lock."""
+        v4, v6 = _CidrTrie(), _CidrTrie()
+        entries = {}
+        for key, entry in self._entries.items():
+            expires, updated, _reason = entry
+            if expires > now:
+                network = ipaddress.ip_network(key)
+                (v4 if network.version == 4 else v6).insert(network.network_address.packed, network.prefixlen, expires)
+                entries[key] = entry
+            elif not expires and now - updated < self.default_ttl:
+                # Снятый бан хранится, пока не разойдётся по файлу другим процессам
+                entries[key] = entry
+        self._entries = entries
+        self._v4, self._v6 = v4, v6
+        self._active = sum(1 for entry in entries.values() if entry[0] > now)
+
+    # ─── Файл ───────────────────────────────────────────────
+
+    def _file_stamp(self) -> Optional[tuple[int, int]]:
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _sync_loop(self) -> None:
+        while not self._stop.wait(self.sync_interval):
+            try:
+                self.sync()
+            except (OSError, ValueError) as e:
+                print(f"[IPS] Ошибка синхронизации бан-листа {self.path}: {e}")
+
+    def sync(self) -> None:
+        """Сливает список с файлом: читает изменения других процессов, записывает свои."""
+        lock_file = open(self.path + ".lock", "a") if fcntl is not None else None
+        try:
+            if lock_file is not None:
+                fcntl.lockf(lock_file, fcntl.LOCK_EX)
+            stamp = self._file_stamp()
+            if stamp is not None and stamp != self._stamp:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self._merge(json.load(f).get("bans", {}))
+                self._stamp = stamp
+            if self._dirty:
+                self._write()
+        finally:
+            if lock_file is not None:
+                lock_file.close()
+
+    def _merge(self, bans: dict) -> None:
+        now = time.time()
+        with self._lock:
+            changed = False
+            for key, (expires, updated, reason) in bans.items():
+                entry = self._entries.get(key)
+                if entry is None or updated > entry[1]:
+                    self._entries[key] = [float(expires), float(updated), reason]
+                    changed = True
+            if changed:
+                self._rebuild(now)
+
+    def _write(self) -> None:
+        with self._lock:
+            self._rebuild(time.time())
+            data = {"bans": dict(self._entries)}
+            self._dirty = False
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(prefix=".banlist-", dir=directory)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+        self._stamp = self._file_stamp()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self.path and self._dirty:
+            self.sync()
+
+    # ─── Состояние ──────────────────────────────────────────
+
+    def entries(self) -> list[dict]:
+        now = time.time()
+        with self._lock:
+            return [
+                {"network": key, "expires_in": round(entry[0] - now, 1), "reason": entry[2]}
+                for key, entry in self._entries.items()
+                if entry[0] > now
+            ]
+
+    def stats(self) -> dict:
+        return {
+            "entries": self._active,
+            "blocked": self.blocked,
+            "dropped": self.dropped,
+            "path": self.path,
+        }
+
+    def __len__(self) -> int:
+        return self._active
+
+
+# ─── Rate Limiter ─────────────────────────────────────────────
+
+# Переменная окружения с путём к файлу общего состояния RateLimiter
+# (выставляется LocalCluster для процессов-нод)
+SHARED_RATE_ENV = "AENGINE_RATELIMIT_SHM"
+
+
+class RateAlgorithm:
+    """Алгоритм лимита: начальное состояние ключа и проверка запроса над ним.
+
+    Состояние — список чисел, первый элемент — время последнего запроса
+    (для вытеснения). Бэкенды хранят состояния и вызывают allow атомарно
+    для ключа, сам алгоритм данных не хранит.
+
+    Алгоритмы:
+        "sliding_window" — скользящее окно из двух счётчиков: текущего окна и
+            предыдущего, вклад которого взвешивается по ещё не прошедшей доле окна;
+        "token_bucket" — ведро на max_requests токенов, пополняемое со скоростью
+            max_requests / window;
+        "gcra" — GCRA: одно число на ключ (теоретическое время следующего запроса);
+        "log" — точный журнал отметок времени (память O(max_requests) на ключ,
+            не поддерживается SharedMemoryRateBackend).
+    Первые три — O(1) по времени и памяти на ключ.
+    """
+
+    NAMES = ("sliding_window", "token_bucket", "gcra", "log")
+
+    def __init__(self, name: str, max_requests: int, window: float):
+        if name not in self.NAMES:
+            raise ValueError(f"algorithm должен быть одним из {self.NAMES}")
+        if max_requests <= 0 or window <= 0:
+            raise ValueError("max_requests и window должны быть положительными")
+        self.name = name
+        self.max_requests = max_requests
+        self.window = window
+        self.allow: Callable[[list, float], tuple[bool, int]] = getattr(self, f"_allow_{name}")
+        # Через сколько секунд простоя состояние равно начальному (двухсчётчиковому окну нужно предыдущее окно)
+        self.idle_after = window * 2 if name == "sliding_window" else window
+
+    @cached_property
+    def spec(self) -> tuple:
+        return self.name, self.max_requests, self.window
+
+    @cached_property
+    def namespace(self) -> str:
+        """Пространство ключей: разные лимиты в одном бэкенде не делят счётчики."""
+        return f"{self.name}:{self.max_requests}/{self.window}"
+
+    def new_state(self, now: float) -> list:
+        if self.name == "sliding_window":
+            return [now, int(now // self.window), 0, 0]
+        if self.name == "token_bucket":
+            return [now, float(self.max_requests), now]
+        if self.name == "gcra":
+            return [now, now]
+        return [now, deque()]
+
+    def remaining(self, state: list, now: float) -> int:
+        """Сколько запросов подряд allow разрешил бы сейчас (состояние не меняется)."""
+        if self.name == "sliding_window":
+            index = int(now // self.window)
+            previous, current = state[3], state[2]
+            if index != state[1]:
+                previous, current = (current if index == state[1] + 1 else 0), 0
+            estimate = previous * (1.0 - (now / self.window - index)) + current
+            return max(0, math.ceil(self.max_requests - estimate))
+        if self.name == "token_bucket":
+            return int(min(float(self.max_requests), state[1] + (now - state[2]) * self.max_requests / self.window))
+        if self.name == "gcra":
+            interval = self.window / self.max_requests
+            return max(0, int((self.window - (max(state[1], now) - now)) / interval + 1e-9))
+        return max(0, self.max_requests - sum(1 for t in state[1] if now - t < self.window))
+
+    def _allow_sliding_window(self, state: list, now: float) -> tuple[bool, int]:
+        # state: [последний запрос, номер окна, счётчик текущего окна, счётчик предыдущего]
+        index = int(now // self.window)
+        if index != state[1]:
+            state[3] = state[2] if index == state[1] + 1 else 0
+            state[2] = 0
+            state[1] = index
+        elapsed = now / self.window - index
+        estimate = state[3] * (1.0 - elapsed) + state[2]
+        if estimate >= self.max_requests:
+            return False, int(estimate)
+        state[2] += 1
+        return True, int(estimate) + 1
+
+    def _allow_token_bucket(self, state: list, now: float) -> tuple[bool, int]:
+        # state: [последний запрос, токены, время пополнения]
+        tokens = min(float(self.max_requests), state[1] + (now - state[2]) * self.max_requests / self.window)
+        state[2] = now
+        if tokens < 1.0:
+            state[1] = tokens
+            return False, self.max_requests
+        state[1] = tokens - 1.0
+        return True, self.max_requests - int(state[1])
+
+    def _allow_gcra(self, state: list, now: float) -> tuple[bool, int]:
+        # state: [последний запрос, TAT]; интервал между запросами T = window / max_requests,
+        # допускается всплеск до max_requests (TAT не дальше now + window)
+        interval = self.window / self.max_requests
+        tat = max(state[1], now)
+        if tat + interval - now > self.window:
+            return False, self.max_requests
+        state[1] = tat + interval
+        return True, round((state[1] - now) / interval)
+
+    def _allow_log(self, state: list, now: float) -> tuple[bool, int]:
+        # state: [последний запрос, deque отметок времени]; устаревшие снимаются с начала
+        timestamps = state[1]
+        while timestamps and now - timestamps[0] >= self.window:
+            timestamps.popleft()
+        if len(timestamps) >= self.max_requests:
+            return False, len(timestamps)
+        timestamps.append(now)
+        return True, len(timestamps)
+
+
+class RateLimitBackend(ABC):
+    """Хранилище состояний RateLimiter.
+
+    hit атомарно для ключа читает состояние, применяет algorithm.allow и
+    сохраняет результат. Один бэкенд может обслуживать несколько лимитеров:
+    ключи разделяются по algorithm.namespace.
+    """
+
+    # Бэкенд хранит состояние фиксированного размера (алгоритм "log" не поддерживается)
+    fixed_state = False
+
+    @abstractmethod
+    def hit(self, key: str, algorithm: RateAlgorithm, now: float) -> tuple[bool, int]:
+        """Возвращает (разрешён ли запрос, текущая нагрузка ключа)."""
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class LocalRateBackend(RateLimitBackend):
+    """Состояния RateLimiter в памяти процесса.
+
+    Состояния хранятся в LRU: на каждом запросе проверяется только самая
+    давняя запись (удаляется, если устарела или превышен max_keys), общей
+    чистки словаря нет.
+
+    Режим атаки (attack_threshold): если за секунду из LRU вытесняется
+    attack_threshold ещё активных ключей (распределённый флуд — новых
+    адресов больше, чем помещается в max_keys), счёт переключается на
+    SketchRateBackend фиксированного размера (sketch_memory байт на лимит)
+    с точным состоянием только для heavy_hitters самых активных ключей.
+    Обратно — когда оценка числа ключей в окне опускается ниже max_keys / 2,
+    но не раньше attack_cooldown секунд; точные состояния тяжёлых ключей
+    переносятся в LRU.
+    """
+
+    def __init__(self, max_keys: int = 100_000, attack_threshold: Optional[int] = None,
+                 sketch_memory: int = 4 << 20, heavy_hitters: int = 1024, attack_cooldown: float = 60.0):
+        self.max_keys = max_keys
+        self.attack_threshold = attack_threshold
+        self.sketch_memory = sketch_memory
+        self.heavy_hitters = heavy_hitters
+        self.attack_cooldown = attack_cooldown
+        self.sketch: Optional[SketchRateBackend] = None
+        self.attacks = 0
+        self._states: "OrderedDict[str, tuple[RateAlgorithm, list]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Вытеснения активных ключей за текущую секунду
+        self._pressure = 0
+        self._pressure_second = 0
+        self._attack_since = 0.0
+
+    def _state(self, key: str, algorithm: RateAlgorithm, now: float) -> list:
+        """Состояние ключа (создаётся при отсутствии) и вытеснение одной давней записи. Вызывается под _lock."""
+        states = self._states
+        full_key = f"{algorithm.namespace}|{key}"
+        entry = states.get(full_key)
+        if entry is None:
+            entry = states[full_key] = (algorithm, algorithm.new_state(now))
+        else:
+            states.move_to_end(full_key)
+
+        oldest = next(iter(states))
+        oldest_algorithm, oldest_state = states[oldest]
+        if oldest != full_key:
+            if now - oldest_state[0] >= oldest_algorithm.idle_after:
+                del states[oldest]
+            elif len(states) > self.max_keys:
+                del states[oldest]
+                self._pressure += 1
+        return entry[1]
+
+    def hit(self, key: str, algorithm: RateAlgorithm, now: float) -> tuple[bool, int]:
+        sketch = self.sketch
+        if sketch is not None:
+            result = sketch.hit(key, algorithm, now)
+            if int(now) != self._pressure_second:
+                with self._lock:
+                    self._check_attack(now)
+            return result
+
+        with self._lock:
+            state = self._state(key, algorithm, now)
+            allowed, current = algorithm.allow(state, now)
+            state[0] = now
+            if self.attack_threshold is not None and int(now) != self._pressure_second:
+                self._check_attack(now)
+        return allowed, current
+
+    def _check_attack(self, now: float) -> None:
+        """Раз в секунду: вход в режим атаки или выход из него. Вызывается под _lock."""
+        second = int(now)
+        if second == self._pressure_second:
+            return
+        pressure, self._pressure, self._pressure_second = self._pressure, 0, second
+
+        if self.sketch is None:
+            if pressure >= self.attack_threshold:
+                self.sketch = SketchRateBackend(self.sketch_memory, heavy_hitters=self.heavy_hitters)
+                self._states.clear()
+                self._attack_since = now
+                self.attacks += 1
+                print(f"[IPS] RateLimiter: режим атаки ({pressure} активных ключей вытеснено за секунду), "
+                      f"счёт по скетчу {self.sketch_memory // 1024} КБ")
+        elif now - self._attack_since >= self.attack_cooldown and self.sketch.distinct() < self.max_keys // 2:
+            for full_key, algorithm, state in self.sketch.heavy_states():
+                self._states[full_key] = (algorithm, state)
+            self.sketch = None
+            print("[IPS] RateLimiter: режим атаки завершён")
+
+    def lease(self, key: str, algorithm: RateAlgorithm, used: int, now: float) -> int:
+        """Засчитывает used запросов ключа и возвращает, сколько ещё запросов алгоритм разрешил бы сейчас.
+
+        Используется сервисом RateLimitServer: запросы, уже пропущенные клиентами
+        по аренде, засчитываются моментом обмена.
+        """
+        with self._lock:
+            state = self._state(key, algorithm, now)
+            for _ in range(used):
+                if not algorithm.allow(state, now)[0]:
+                    break
+            if used:
+                state[0] = now
+            return algorithm.remaining(state, now)
+
+    def stats(self) -> dict:
+        sketch = self.sketch
+        return {
+            "keys": len(self._states),
+            "attack_mode": sketch is not None,
+            "attacks": self.attacks,
+            "top": sketch.top(10) if sketch is not None else [],
+        }
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+
+class _RateSketch:
+    """Счёт одного лимита в режиме атаки.
+
+    Два count-min скетча (текущее и предыдущее окно, консервативное
+    обновление) оценивают скользящее окно любого ключа; space-saving таблица
+    хранит точное состояние алгоритма для capacity самых активных ключей.
+    Учитываются все запросы, в том числе отклонённые: ключ, продолжающий
+    флуд, остаётся заблокированным.
+    """
+
+    def __init__(self, algorithm: RateAlgorithm, width: int, depth: int, capacity: int):
+        self.algorithm = algorithm
+        self.width = width
+        self.depth = depth
+        self.capacity = capacity
+        self._rows = [(i, i * width) for i in range(depth)]
+        self.current = array("I", bytes(4 * width * depth))
+        self.previous = array("I", bytes(4 * width * depth))
+        self.index = 0
+        # Ненулевые ячейки первой строки — для оценки числа ключей (linear counting)
+        self.filled = 0
+        self.previous_filled = 0
+        # Тяжёлые ключи: ключ → [счёт, состояние алгоритма]
+        self.heavy: dict[str, list] = {}
+        self._heap: list[tuple[int, str]] = []
+
+    def _cells(self, key: str) -> list[int]:
+        # Двойное хеширование: depth индексов из одного hash()
+        h = hash(key)
+        h1, h2 = h & 0xFFFFFFFF, ((h >> 32) & 0xFFFFFFFF) | 1
+        width = self.width
+        return [row + (h1 + i * h2) % width for i, row in self._rows]
+
+    def _rotate(self, now: float) -> None:
+        index = int(now // self.algorithm.window)
+        if index == self.index:
+            return
+        size = self.width * self.depth
+        if index == self.index + 1:
+            self.previous, self.previous_filled = self.current, self.filled
+        else:
+            self.previous, self.previous_filled = array("I", bytes(4 * size)), 0
+        self.current = array("I", bytes(4 * size))
+        self.filled = 0
+        self.index = index
+        # Счёты тяжёлых ключей затухают вдвое за окно, простаивающие ключи освобождают место
+        idle_after = self.algorithm.idle_after
+        for key, entry in list(self.heavy.items()):
+            entry[0] //= 2
+            if now - entry[1][0] >= idle_after:
+                del self.heavy[key]
+        self._heap = [(entry[0], key) for key, entry in self.heavy.items()]
+        heapq.heapify(self._heap)
+
+    def hit(self, key: str, now: float) -> tuple[bool, int]:
+        self._rotate(now)
+        algorithm = self.algorithm
+        cells = self._cells(key)
+        current, previous = self.current, self.previous
+        count = min(current[c] for c in cells)
+        estimate = min(previous[c] for c in cells) * (1.0 - (now / algorithm.window - self.index)) + count
+
+        # Консервативное обновление: растут только ячейки, равные минимуму
+        target = count + 1
+        for c in cells:
+            if current[c] < target:
+                if c < self.width and not current[c]:
+                    self.filled += 1
+                current[c] = target
+
+        entry = self.heavy.get(key)
+        if entry is not None:
+            entry[0] += 1
+            allowed, load = algorithm.allow(entry[1], now)
+            entry[1][0] = now
+            return allowed, load
+
+        allowed = estimate < algorithm.max_requests
+        self._admit(key, int(estimate) + 1, now)
+        return allowed, int(estimate) + 1
+
+    def _admit(self, key: str, count: int, now: float) -> None:
+        """Space-saving: ключ занимает место наименее активного, если его оценка больше."""
+        heavy, heap = self.heavy, self._heap
+        if len(heavy) >= self.capacity:
+            # Куча с ленивым обновлением: счёт в куче может отставать от счёта ключа
+            while True:
+                least, victim = heap[0]
+                entry = heavy.get(victim)
+                if entry is None:
+                    heapq.heappop(heap)
+                elif entry[0] != least:
+                    heapq.heapreplace(heap, (entry[0], victim))
+                else:
+                    break
+            if count <= least:
+                return
+            heapq.heappop(heap)
+            del heavy[victim]
+        algorithm = self.algorithm
+        state = algorithm.new_state(now)
+        # Точное состояние начинается с оценки скетча
+        for _ in range(min(count, algorithm.max_requests)):
+            algorithm.allow(state, now)
+        heavy[key] = [count, state]
+        heapq.heappush(heap, (count, key))
+
+    def distinct(self) -> int:
+        """Оценка числа разных ключей в окне (linear counting по первой строке)."""
+        filled = max(self.filled, self.previous_filled)
+        if filled >= self.width:
+            return self.width * self.depth
+        return int(-self.width * math.log(1.0 - filled / self.width))
+
+
+class SketchRateBackend(RateLimitBackend):
+    """Состояния RateLimiter фиксированного размера для режима атаки.
+
+    На каждый лимит (algorithm.namespace) — count-min скетч двух окон на
+    memory байт и space-saving таблица heavy_hitters самых активных ключей с
+    точным состоянием (см. _RateSketch). Память не зависит от числа разных
+    ключей. Ключи вне таблицы считаются скользящим окном по оценке скетча
+    независимо от алгоритма; оценка может быть только завышенной (коллизии),
+    поэтому ошибается в сторону блокировки.
+    """
+
+    def __init__(self, memory: int = 4 << 20, depth: int = 4, heavy_hitters: int = 1024):
+        self.memory = memory
+        self.depth = depth
+        self.width = max(1024, memory // (2 * depth * 4))
+        self.heavy_hitters = heavy_hitters
+        self._sketches: dict[str, _RateSketch] = {}
+        self._lock = threading.Lock()
+
+    def hit(self, key: str, algorithm: RateAlgorithm, now: float) -> tuple[bool, int]:
+        with self._lock:
+            sketch = self._sketches.get(algorithm.namespace)
+            if sketch is None:
+                sketch = self._sketches[algorithm.namespace] = _RateSketch(
+                    algorithm, self.width, self.depth, self.heavy_hitters
+                )
+            return sketch.hit(key, now)
+
+    def distinct(self) -> int:
+        """Оценка числа разных ключей в окне (максимум по лимитам)."""
+        with self._lock:
+            return max((sketch.distinct() for sketch in self._sketches.values()), default=0)
+
+    def top(self, n: int = 10) -> list[tuple[str, int]]:
+        """Самые активные ключи: [(ключ, счёт)] по убыванию."""
+        with self._lock:
+            items = [(key, entry[0]) for sketch in self._sketches.values() for key, entry in sketch.heavy.items()]
+        return sorted(items, key=lambda item: item[1], reverse=True)[:n]
+
+    def heavy_states(self):
+        """Точные состояния тяжёлых ключей: (namespace|ключ, алгоритм, состояние)."""
+        with self._lock:
+            return [
+                (f"{namespace}|{key}", sketch.algorithm, entry[1])
+                for namespace, sketch in self._sketches.items()
+                for key, entry in sketch.heavy.items()
+            ]
+
+
+class SharedMemoryRateBackend(RateLimitBackend):
+    """Состояния RateLimiter в mmap-файле, общем для процессов одного сервера.
+
+    Файл — хеш-таблица фиксированного размера: корзины по WAYS слотов, слот —
+    64-битный хеш ключа и до четырёх чисел состояния. Ключ живёт только в своей
+    корзине; при нехватке места занимается пустой, устаревший или самый давний
+    слот, поэтому обновление — O(1), а память постоянна. Корзины защищены
+    полосами блокировок: fcntl.lockf на байт файла (между процессами) и
+    threading.Lock (между потоками: блокировки fcntl принадлежат процессу).
+    Файл создаётся один раз (create), нодам передаётся путь, например через
+    переменную окружения SHARED_RATE_ENV.
+    """
+
+    fixed_state = True
+
+    MAGIC = b"SECRL001"
+    HEADER_SIZE = 4096
+    STRIPES = 1024
+    _LOCK_OFFSET = 1024
+    WAYS = 8
+    _HEADER = struct.Struct("<8sII")
+    _SLOT = struct.Struct("<Q4d")
+
+    def __init__(self, path: str):
+        if fcntl is None:
+            raise RuntimeError("общее состояние RateLimiter требует fcntl (недоступно на этой платформе)")
+        self.path = path
+        self._file = open(path, "r+b")
+        self._mmap = mmap.mmap(self._file.fileno(), 0)
+        magic, self.buckets, ways = self._HEADER.unpack_from(self._mmap, 0)
+        if magic != self.MAGIC or ways != self.WAYS:
+            raise ValueError(f"{path} не является файлом состояния RateLimiter")
+        self._locks = [threading.Lock() for _ in range(self.STRIPES)]
+
+    @classmethod
+    def create(cls, path: Optional[str] = None, capacity: int = 100_000) -> str:
+        """Создаёт файл состояния на capacity ключей и возвращает путь (по умолчанию — в /dev/shm)."""
+        buckets = max(1, -(-capacity // cls.WAYS))
+        if path is None:
+            directory = "/dev/shm" if os.path.isdir("/dev/shm") else None
+            fd, path = tempfile.mkstemp(prefix="sec-ratelimit-", suffix=".shm", dir=directory)
+            os.close(fd)
+        with open(path, "wb") as f:
+            f.write(cls._HEADER.pack(cls.MAGIC, buckets, cls.WAYS).ljust(cls.HEADER_SIZE, b"\0"))
+            f.truncate(cls.HEADER_SIZE + buckets * cls.WAYS * cls._SLOT.size)
+        return path
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        # hash() случаен в каждом процессе (PYTHONHASHSEED), нужен одинаковый для всех нод; 0 — пустой слот
+        digest = hashlib.blake2b(key.encode(), digest_size=8).digest()
+        return int.from_bytes(digest, "little") or 1
+
+    def hit(self, key: str, algorithm: RateAlgorithm, now: float) -> tuple[bool, int]:
+        key_hash = self._hash(f"{algorithm.namespace}|{key}")
+        bucket = key_hash % self.buckets
+        stripe = bucket % self.STRIPES
+        base = self.HEADER_SIZE + bucket * self.WAYS * self._SLOT.size
+        mm = self._mmap
+        slot = self._SLOT
+
+        with self._locks[stripe]:
+            fcntl.lockf(self._file, fcntl.LOCK_EX, 1, self._LOCK_OFFSET + stripe)
+            try:
+                state = None
+                victim, victim_seen = base, float("inf")
+                for i in range(self.WAYS):
+                    offset = base + i * slot.size
+                    slot_hash, *values = slot.unpack_from(mm, offset)
+                    if slot_hash == key_hash:
+                        victim = offset
+                        if now - values[0] < algorithm.idle_after:
+                            state = values
+                        break
+                    # Пустой слот — самый «давний»; иначе вытесняется наименее активный ключ
+                    seen = values[0] if slot_hash else float("-inf")
+                    if seen < victim_seen:
+                        victim, victim_seen = offset, seen
+                if state is None:
+                    state = algorithm.new_state(now)
+
+                allowed, current = algorithm.allow(state, now)
+                state[0] = now
+                state.extend([0.0] * (4 - len(state)))
+                slot.pack_into(mm, victim, key_hash, *state)
+            finally:
+                fcntl.lockf(self._file, fcntl.LOCK_UN, 1, self._LOCK_OFFSET + stripe)
+        return allowed, current
+
+    def close(self) -> None:
+        self._mmap.close()
+        self._file.close()
+
+
+def _is_loopback(host: str) -> bool:
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+class RateLimitServer:
+    """Сервис счётчиков RateLimiter для нескольких серверов (запускается на master кластера).
+
+    Протокол — строки JSON по TCP, одно постоянное соединение на клиента:
+        запрос: {"client": id, "token": ..., "batches": [{"spec": [алгоритм, max, window],
+                 "used": {ключ: запросов с прошлого обмена}}]}
+        ответ:  {"leases": [{ключ: разрешённых запросов до следующего обмена}]}
+    Сервер засчитывает присланные запросы в состояние ключа (LocalRateBackend)
+    и делит оставшийся лимит ключа между активными клиентами — это аренда
+    (lease), которую клиент расходует локально без обращения к сервису.
+
+    На адресе, отличном от loopback, сервис запускается только с token.
+    """
+
+    # Клиент считается активным, если обращался за последние NODE_TTL секунд
+    NODE_TTL = 10.0
+    MAX_SPECS = 256
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8890, max_keys: int = 100_000,
+                 token: Optional[str] = None):
+        self.host = host
+        self.port = port
+        self.token = token
+        self.backend = LocalRateBackend(max_keys)
+        self.requests = 0
+        self._algorithms: dict[tuple, RateAlgorithm] = {}
+        self._clients: dict[str, float] = {}
+        # (spec, ключ) → {клиент: (выданная аренда, время выдачи)}
+        self._grants: dict[tuple, dict[str, tuple[int, float]]] = {}
+        self._lock = threading.Lock()
+        self._running = False
+        self._server: Optional[socket.socket] = None
+
+    def start(self) -> "RateLimitServer":
+        # Без token любой, кто достаёт до порта, может расходовать и сбрасывать лимиты
+        if not self.token and not _is_loopback(self.host):
+            raise ValueError(f"RateLimitServer на адресе {self.host!r} требует token")
+        self._server = socket.create_server((self.host, self.port))
+        self._server.settimeout(1.0)
+        self._running = True
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self._running = False
+
+    def _accept_loop(self) -> None:
+        server = self._server
+        while self._running:
+            try:
+                client, _addr = server.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            threading.Thread(target=self._serve_client, args=(client,), daemon=True).start()
+        server.close()
+
+    def _serve_client(self, client: socket.socket) -> None:
+        with client, client.makefile("rwb") as stream:
+            for line in stream:
+                if not self._running:
+                    break
+                try:
+                    reply = self.process(json.loads(line))
+                except (ValueError, TypeError, KeyError) as e:
+                    reply = {"error": str(e)}
+                stream.write(json.dumps(reply).encode() + b"\n")
+                stream.flush()
+
+    def _algorithm(self, spec: list) -> RateAlgorithm:
+        """Алгоритм по spec клиента (вызывается под _lock)."""
+        spec = tuple(spec)
+        algorithm = self._algorithms.get(spec)
+        if algorithm is None:
+            if len(self._algorithms) >= self.MAX_SPECS:
+                raise ValueError("слишком много разных лимитов")
+            algorithm = self._algorithms[spec] = RateAlgorithm(*spec)
+        return algorithm
+
+    def process(self, message: dict) -> dict:
+        """Обрабатывает один обмен: засчитывает использованные запросы и выдаёт новые аренды."""
+        if self.token and not hmac.compare_digest(str(message.get("token")).encode(), self.token.encode()):
+            raise ValueError("неверный token")
+        now = time.time()
+        client = str(message.get("client"))
+        leases = []
+        with self._lock:
+            self.requests += 1
+            self._clients[client] = now
+            for other, seen in list(self._clients.items()):
+                if now - seen >= self.NODE_TTL:
+                    del self._clients[other]
+            nodes = len(self._clients)
+
+            for batch in message.get("batches", []):
+                algorithm = self._algorithm(batch["spec"])
+                for key in batch.get("release", []):
+                    self._grants.get((algorithm.spec, key), {}).pop(client, None)
+                result = {}
+                for key, used in batch.get("used", {}).items():
+                    remaining = self.backend.lease(key, algorithm, int(used), now)
+                    grants = self._grants.pop((algorithm.spec, key), {})
+                    self._grants[(algorithm.spec, key)] = grants
+                    # Аренды других клиентов ещё могут быть израсходованы — они вычитаются из остатка
+                    outstanding = sum(lease for other, (lease, granted) in grants.items()
+                                      if other != client and now - granted < self.NODE_TTL)
+                    available = remaining - outstanding
+                    # Остаток делится между активными клиентами; единичный остаток не теряется
+                    lease = max(available // nodes, 1 if available > 0 else 0)
+                    grants[client] = (lease, now)
+                    result[key] = lease
+                leases.append(result)
+            while len(self._grants) > self.backend.max_keys:
+                del self._grants[next(iter(self._grants))]
+        return {"leases": leases}
+
+    def stats(self) -> dict:
+        return {
+            "port": self.port,
+            "clients": len(self._clients),
+            "keys": len(self.backend),
+            "requests": self.requests,
+        }
+
+
+class NetworkRateBackend(RateLimitBackend):
+    """Состояния RateLimiter на сервисе RateLimitServer (общий лимит для нескольких серверов).
+
+    Запросы расходуют локальную аренду ключа без сетевого обмена. Раз в
+    flush_interval фоновый поток одним сообщением отправляет использованные
+    запросы всех активных ключей и получает новые аренды. Синхронный обмен
+    на запросе нужен, только когда аренда ключа исчерпана; если сервис
+    разрешил 0, ключ отклоняется локально до следующего обмена. Новый ключ
+    получает initial_lease запросов авансом, поэтому превышение лимита
+    ограничено initial_lease × число клиентов на flush_interval. При
+    недоступности сервиса лимит считается локально (LocalRateBackend),
+    повторное подключение — через retry_interval.
+
+    Failover: клиент всегда подключается к host (адрес Master кластера,
+    имя заново разрешается при каждом подключении). Пока Master недоступен,
+    лимит считается локально (fail-open, не строже лимита на один сервер);
+    когда сервис снова слушает этот адрес, клиент переподключается к нему,
+    и счётчики начинаются заново.
+    """
+
+    def __init__(self, host: str, port: int = 8890, flush_interval: float = 0.2,
+                 initial_lease: int = 1, timeout: float = 1.0, retry_interval: float = 5.0,
+                 max_keys: int = 100_000, token: Optional[str] = None):
+        self.address = (host, port)
+        self.flush_interval = flush_interval
+        self.initial_lease = initial_lease
+        self.timeout = timeout
+        self.retry_interval = retry_interval
+        self.max_keys = max_keys
+        self.token = token
+        self.client_id = f"{socket.gethostname()}:{os.getpid()}:{id(self)}"
+        self.local_hits = 0
+        self.round_trips = 0
+        self.fallback_hits = 0
+        # (spec, ключ) → [аренда, использовано с прошлого обмена, последний запрос, отказ до]
+        self._leases: "OrderedDict[tuple, list]" = OrderedDict()
+        self._algorithms: dict[tuple, RateAlgorithm] = {}
+        self._fallback = LocalRateBackend(max_keys)
+        self._lock = threading.Lock()
+        self._io_lock = threading.Lock()
+        self._stream = None
+        self._down_until = 0.0
+        self._last_flush = time.time()
+        self._stop = threading.Event()
+        threading.Thread(target=self._flush_loop, daemon=True).start()
+
+    def hit(self, key: str, algorithm: RateAlgorithm, now: float) -> tuple[bool, int]:
+        if now < self._down_until:
+            self.fallback_hits += 1
+            return self._fallback.hit(key, algorithm, now)
+
+        spec = algorithm.spec
+        with self._lock:
+            self._algorithms[spec] = algorithm
+            entry = self._leases.get((spec, key))
+            if entry is None:
+                entry = self._leases[(spec, key)] = [self.initial_lease, 0, now, 0.0]
+                if len(self._leases) > self.max_keys:
+                    self._leases.popitem(last=False)
+            else:
+                self._leases.move_to_end((spec, key))
+            entry[2] = now
+            if entry[0] > 0:
+                entry[0] -= 1
+                entry[1] += 1
+                self.local_hits += 1
+                return True, entry[1]
+            if now < entry[3]:
+                return False, algorithm.max_requests
+            used, entry[1] = entry[1], 0
+
+        # Аренда исчерпана — синхронный обмен только по этому ключу
+        leases = self._exchange({spec: {key: used}})
+        if leases is None:
+            self.fallback_hits += 1
+            return self._fallback.hit(key, algorithm, now)
+        lease = leases[spec].get(key, 0)
+        with self._lock:
+            if lease > 0:
+                entry[0] = lease - 1
+                entry[1] += 1
+                return True, entry[1]
+            entry[0] = 0
+            entry[3] = now + self.flush_interval
+        return False, algorithm.max_requests
+
+    def _flush_loop(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            if time.time() >= self._down_until:
+                self.flush()
+
+    def flush(self) -> None:
+        """Отправляет использованные запросы активных ключей и обновляет их аренды."""
+        with self._lock:
+            since, self._last_flush = self._last_flush, time.time()
+            batches: dict[tuple, dict[str, int]] = {}
+            released: dict[tuple, list[str]] = {}
+            for entry_key, entry in list(self._leases.items()):
+                spec, key = entry_key
+                # Ключ без запросов с прошлого обмена забывается: его запросы уже засчитаны,
+                # остаток аренды возвращается сервису
+                if entry[2] < since and not entry[1]:
+                    del self._leases[entry_key]
+                    released.setdefault(spec, []).append(key)
+                    continue
+                batches.setdefault(spec, {})[key] = entry[1]
+                entry[1] = 0
+        if not batches and not released:
+            return
+
+        leases = self._exchange(batches, released)
+        if leases is None:
+            return
+        with self._lock:
+            for spec, result in leases.items():
+                for key, lease in result.items():
+                    entry = self._leases.get((spec, key))
+                    if entry is not None:
+                        entry[0] = lease
+                        entry[3] = 0.0
+
+    def _exchange(self, batches: dict[tuple, dict[str, int]],
+                  released: Optional[dict[tuple, list[str]]] = None) -> Optional[dict[tuple, dict[str, int]]]:
+        """Один обмен с сервисом: {spec: {ключ: использовано}} → {spec: {ключ: аренда}} (None при ошибке)."""
+        released = released or {}
+        specs = list(batches) + [spec for spec in released if spec not in batches]
+        message = {
+            "client": self.client_id,
+            "token": self.token,
+            "batches": [
+                {"spec": list(spec), "used": batches.get(spec, {}), "release": released.get(spec, [])}
+                for spec in specs
+            ],
+        }
+        with self._io_lock:
+            try:
+                if self._stream is None:
+                    sock = socket.create_connection(self.address, timeout=self.timeout)
+                    self._stream = sock.makefile("rwb")
+                    sock.close()
+                self._stream.write(json.dumps(message).encode() + b"\n")
+                self._stream.flush()
+                reply = json.loads(self._stream.readline() or b"{}")
+                if "error" in reply or "leases" not in reply:
+                    raise ValueError(reply.get("error", "пустой ответ"))
+            except (OSError, ValueError) as e:
+                self._disconnect()
+                self._down_until = time.time() + self.retry_interval
+                print(f"[IPS] Сервис лимитов {self.address[0]}:{self.address[1]} недоступен ({e}), лимит считается локально")
+                return None
+            self.round_trips += 1
+        return {tuple(spec): result for spec, result in zip(specs, reply["leases"])}
+
+    def _disconnect(self) -> None:
+        if self._stream is not None:
+            try:
+                self._stream.close()
+            except OSError:
+                pass
+            self._stream = None
 
-        # 2. Проверка спецсимволов ТОЛЬКО в данных пользователя (параметры и тело)
-        # Мы НЕ проверяем заголовки на спецсимволы, так как там часто бывают ';' и '#'
-        user_inputs = _get_all_input_values()
-        # Добавляем путь запроса в проверку
-        user_inputs.append(request.full_path)
-        
-        for val in user_inputs:
-            decoded_val = unquote(val).upper()
-            if any(s in decoded_val for s in self.special):
-                # Исключаем ложное срабатывание на простые ';' в параметрах, если это не похоже на инъекцию
-                # Но для безопасности блокируем большинство спецсимволов в параметрах
-                self.log(f"DETECTED SQLi (special char): {request.method} {request.path} | char in payload: {val[:50]}")
-                self.trigger_response()
-                return
+    def close(self) -> None:
+        self._stop.set()
+        with self._io_lock:
+            self._disconnect()
 
+    def stats(self) -> dict:
+        return {
+            "server": f"{self.address[0]}:{self.address[1]}",
+            "keys": len(self._leases),
+            "local_hits": self.local_hits,
+            "round_trips": self.round_trips,
+            "fallback_hits": self.fallback_hits,
+        }
 
-class XSSDetector(BaseDetector):
-    """Обнаружение Cross-Site Scripting."""
-    # Разделяем на критические (сразу бан) и подозрительные (нужно комбо)
-    critical_patterns = [
-        "<script", "javascript:", "onerror=", "onload=", "onclick=", "eval(", "alert("
-    ]
-    suspicious_patterns = [
-        "<", ">", "/*", "*/", " src=", " href=", "document.", "cookie"
-    ]
 
-    def run(self) -> None:
-        user_inputs = _get_all_input_values()
-        user_inputs.append(request.full_path)
-        
-        for val in user_inputs:
-            decoded = unquote(val).lower()
-            
-            # 1. Проверка критических паттернов
-            for p in self.critical_patterns:
-                if p in decoded:
-                    self.log(f"DETECTED XSS (critical): {request.method} {request.path} | pattern '{p}' in {val[:30]}")
-                    self.trigger_response()
-                    return
-            
-            # 2. Проверка комбинации подозрительных (3 и более)
-            matches = [p for p in self.suspicious_patterns if p in decoded]
-            if len(matches) >= 3:
-                self.log(f"DETECTED XSS (pattern match): {request.method} {request.path} | patterns {matches} in {val[:30]}")
-                self.trigger_response()
-                return
+class RatePolicy:
+    """Декларативное правило лимита: какие запросы считаются, по какому ключу и с каким лимитом.
 
+    key — функция запроса (flask.Request → строка или None) либо спецификация:
+        "ip" — адрес клиента;
+        "ip_prefix:24" — подсеть клиента (IPv4 /24, IPv6 — /64 или "ip_prefix:24/48");
+        "header:X-API-Key" — значение заголовка;
+        "session:user_id" — значение из flask.session (например, пользователь);
+        "endpoint" / "path" — маршрут или путь запроса;
+        "global" — один счётчик на все запросы правила.
+    Кортеж спецификаций даёт составной ключ: ("endpoint", "ip"). Если ключ
+    (или его часть) — None, правило к запросу не применяется: так правило для
+    API-ключей не трогает анонимный трафик.
 
-class SignatureDetector(BaseDetector):
-    """Сигнатурный анализ: поиск известных CVE и паттернов атак.
-    
-    Загружает сигнатуры из открытой базы signatures_db.json.
-    Если файл не найден — использует встроенный набор.
+    routes — endpoint или URL-префиксы ("/api/"), к которым относится правило
+    (None — все маршруты); methods — HTTP-методы (None — все). ban_ttl — при
+    превышении лимита адрес клиента банится на ban_ttl секунд (нужен
+    RateLimiter(ban_list=...)).
+
+    Пример:
+        RatePolicy("login", 5, 60, key="ip", routes=["/login"], methods=["POST"])
+        RatePolicy("api", 1000, 60, key="header:X-API-Key", routes=["/api/"])
     """
-    
-    # Встроенные сигнатуры (fallback)
-    _builtin_signatures = {
-        "Log4Shell (CVE-2021-44228)": re.compile(r"\$\{jndi:(ldap|rmi|ldaps|dns):", re.I),
-        "Spring4Shell (CVE-2022-22965)": re.compile(r"class\.module\.classLoader\.(resources|URLs)", re.I),
-        "Shellshock (CVE-2014-6271)": re.compile(r"\(\)\s*\{\s*[:;]\s*\}\s*;", re.I),
-        "Struts2 RCE (S2-045)": re.compile(r"%\{\(#[^}]+\)\.?(getValue|exec|getRuntime)", re.I),
-        "PHP Serialization Exploit": re.compile(r"O:\d+:\"[^\"]+\":\d+:\{", re.I),
-        "Generic Web Shell": re.compile(r"(passthru|shell_exec|system|phpinfo|base64_decode)\s*\(", re.I),
-    }
-    
-    signatures = {}
-    _db_loaded = False
 
-    def __init__(self, app: Flask):
-        super().__init__(app)
-        if not SignatureDetector._db_loaded:
-            SignatureDetector._load_db()
-    
+    # Длинные значения ключей (токены, заголовки) хранятся хешем фиксированного размера
+    MAX_KEY_LENGTH = 64
+
+    def __init__(self, name: str, max_requests: int, window: float, key="ip",
+                 algorithm: str = "sliding_window", routes: Optional[list[str]] = None,
+                 methods: Optional[list[str]] = None, ban_ttl: Optional[float] = None):
+        if "|" in name:
+            raise ValueError("имя правила не может содержать '|'")
+        self.name = name
+        self.rate = RateAlgorithm(algorithm, max_requests, window)
+        self.key = key
+        self.routes = tuple(routes) if routes is not None else None
+        self.methods = frozenset(m.upper() for m in methods) if methods is not None else None
+        self.ban_ttl = ban_ttl
+        specs = key if isinstance(key, (tuple, list)) else (key,)
+        self._key_funcs = tuple(self._compile_key(spec) for spec in specs)
+
     @classmethod
-    def _load_db(cls):
-        """Загружает сигнатуры из signatures_db.json рядом с этим файлом."""
-        import json
-        db_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "signatures_db.json")
-        
-        if os.path.exists(db_path):
+    def _compile_key(cls, spec) -> Callable:
+        if callable(spec):
+            return spec
+        kind, _, arg = str(spec).partition(":")
+        if kind == "ip":
+            return lambda req: req.remote_addr or "unknown"
+        if kind == "ip_prefix":
+            v4, _, v6 = (arg or "24").partition("/")
+            return cls._prefix_key(int(v4), int(v6 or 64))
+        if kind == "header" and arg:
+            return lambda req: req.headers.get(arg)
+        if kind == "session" and arg:
+            return lambda req: session.get(arg)
+        if kind == "endpoint":
+            return lambda req: req.endpoint or ""
+        if kind == "path":
+            return lambda req: req.path
+        if kind == "global":
+            return lambda req: "*"
+        raise ValueError(f"Неизвестный ключ лимита: {spec}")
+
+    @staticmethod
+    def _prefix_key(v4: int, v6: int) -> Callable:
+        def key(req):
+            addr = req.remote_addr or "unknown"
             try:
-                with open(db_path, "r", encoding="utf-8") as f:
-                    db = json.load(f)
-                
-                loaded = 0
-                for sig in db.get("signatures", []):
-                    name = sig.get("name", "Unknown")
-                    pattern = sig.get("pattern")
-                    flags_str = sig.get("flags", "")
-                    
-                    if not pattern:
-                        continue
-                    
-                    flags = 0
-                    if "i" in flags_str:
-                        flags |= re.IGNORECASE
-                    if "s" in flags_str:
-                        flags |= re.DOTALL
-                    if "m" in flags_str:
-                        flags |= re.MULTILINE
-                    
-                    try:
-                        cls.signatures[name] = re.compile(pattern, flags)
-                        loaded += 1
-                    except re.error:
-                        pass
-                
-                cls._db_loaded = True
-                print(f"[IPS] Загружено {loaded} сигнатур из открытой базы ({os.path.basename(db_path)})")
-                return
-            except (json.JSONDecodeError, IOError) as e:
-                print(f"[IPS] Ошибка загрузки базы сигнатур: {e}, используем встроенные")
-        
-        cls.signatures = dict(cls._builtin_signatures)
-        cls._db_loaded = True
-        print(f"[IPS] Используется встроенная база ({len(cls.signatures)} сигнатур)")
-    
-    @classmethod
-    def load_signatures(cls, path: str):
-        """Загрузить дополнительные сигнатуры из указанного JSON файла."""
-        import json
-        try:
-            with open(path, "r", encoding="utf-8") as f:
-                db = json.load(f)
-            for sig in db.get("signatures", []):
-                pattern = sig.get("pattern")
-                if pattern:
-                    flags = re.IGNORECASE if "i" in sig.get("flags", "") else 0
-                    if "s" in sig.get("flags", ""):
-                        flags |= re.DOTALL
-                    cls.signatures[sig.get("name", "Custom")] = re.compile(pattern, flags)
-        except Exception as e:
-            print(f"[IPS] Ошибка загрузки доп. сигнатур: {e}")
+                ip = ipaddress.ip_address(addr)
+            except ValueError:
+                return addr
+            return str(ipaddress.ip_network(f"{addr}/{v4 if ip.version == 4 else v6}", strict=False))
+        return key
 
-    def run(self) -> None:
-        full_data = _get_request_full_data()
-        decoded = unquote(full_data)
-        
-        for name, pattern in self.signatures.items():
-            if pattern.search(decoded):
-                self.log(f"DETECTED SIGNATURE: {name} | {request.method} {request.path}")
-                self.trigger_response()
-                return
+    def matches(self, endpoint: Optional[str], rule: Optional[str]) -> bool:
+        """Относится ли правило к маршруту (endpoint и шаблону URL)."""
+        if self.routes is None:
+            return True
+        for route in self.routes:
+            if route.startswith("/") and rule is not None and rule.startswith(route):
+                return True
+            if route == endpoint:
+                return True
+        return False
 
+    def key_for(self, req) -> Optional[str]:
+        """Ключ счётчика для запроса или None, если правило не применяется."""
+        if self.methods is not None and req.method not in self.methods:
+            return None
+        parts = []
+        for func in self._key_funcs:
+            value = func(req)
+            if value is None:
+                return None
+            value = str(value)
+            if len(value) > self.MAX_KEY_LENGTH:
+                value = hashlib.blake2b(value.encode(), digest_size=16).hexdigest()
+            parts.append(value)
+        return f"{self.name}|{'|'.join(parts)}"
 
-class RuleDetector(BaseDetector):
-    """Анализ на основе правил (Rule-based Analysis)."""
-    
-    rules = [] # Список функций-правил или объектов
 
-    def add_rule(self, condition_fn, action_msg="Rule Triggered"):
-        self.rules.append((condition_fn, action_msg))
+class RateLimiter:
+    """Ограничитель частоты запросов.
 
-    def run(self) -> None:
-        # Пример дефолтного правила: блокировка curl (если нужно)
-        # if "curl" in request.headers.get("User-Agent", "").lower():
-        #     self.log("BLOCK RULE: curl access denied")
-        #     self.trigger_response()
-        #     return
+    По умолчанию — одно правило "default": max_requests запросов за window
+    секунд с одного IP (max_requests=None — без него). Дополнительные правила
+    (RatePolicy) задаются параметром policies, методом add_policy или
+    декоратором limit; запрос отклоняется (429), если его не пропускает хотя бы
+    одно применимое правило. Правила маршрута предвычисляются в карту
+    endpoint → правила.
 
-        for condition, msg in self.rules:
-            try:
-                if condition(request):
-                    self.log(f"BLOCK RULE: {msg} | {request.method} {request.path}")
-                    self.trigger_response()
-                    return
-            except Exception as e:
-                pass
+    Алгоритм (algorithm) — см. RateAlgorithm: "sliding_window" (по умолчанию),
+    "token_bucket", "gcra" или "log".
 
+    С ban_list адрес, превысивший лимит правила с ban_ttl (для правила
+    "default" — параметр ban_ttl), банится в BanList, и следующие его запросы
+    отклоняются первым before_request.
 
-# ─── Rate Limiter ─────────────────────────────────────────────
+    Состояния всех правил хранит один backend (RateLimitBackend): по умолчанию
+    LocalRateBackend (память процесса, LRU на max_keys ключей; attack_threshold —
+    порог перехода в режим атаки, см. LocalRateBackend). Если задан
+    shared_path или переменная окружения SHARED_RATE_ENV (её выставляет
+    LocalCluster), используется SharedMemoryRateBackend — общий лимит для
+    процессов-нод сервера. Для нескольких серверов — NetworkRateBackend
+    (сервис RateLimitServer на master кластера, см. ClusterNode.rate_limit_backend).
 
-class RateLimiter:
-    """Ограничитель частоты запросов по IP.
-    
     Пример:
         limiter = RateLimiter(app, max_requests=100, window=60)
         # Макс. 100 запросов в минуту с одного IP
     """
-    
-    def __init__(self, app, max_requests: int = 100, window: int = 60):
+
+    ALGORITHMS = RateAlgorithm.NAMES
+
+    def __init__(self, app, max_requests: Optional[int] = 100, window: int = 60,
+                 algorithm: str = "sliding_window", max_keys: int = 100_000,
+                 shared_path: Optional[str] = None, backend: Optional[RateLimitBackend] = None,
+                 policies: Optional[list[RatePolicy]] = None, attack_threshold: Optional[int] = None,
+                 ban_list: Optional[BanList] = None, ban_ttl: Optional[float] = None):
         self.flask_app: Flask = app.flask
         self.max_requests = max_requests
         self.window = window  # секунды
-        self._requests: dict[str, list[float]] = defaultdict(list)
+        self.algorithm = algorithm
+        self.max_keys = max_keys
+        self.attack_threshold = attack_threshold
+        self.policies: list[RatePolicy] = []
+        if max_requests is not None:
+            self.policies.append(RatePolicy("default", max_requests, window, key="ip", algorithm=algorithm,
+                                            ban_ttl=ban_ttl))
+        self.policies.extend(policies or [])
+        self.rate = self.policies[0].rate if self.policies else None
+        self.backend = backend if backend is not None else self._make_backend(shared_path)
+        for policy in self.policies:
+            self._check_policy(policy)
+        self._endpoint_policies: Optional[dict[Optional[str], tuple]] = None
         self.flask_app.before_request(self._check_rate)
-    
+        self.ban_list = ban_list
+        if ban_list is not None:
+            ban_list.install(self.flask_app)
+
+    def _make_backend(self, shared_path: Optional[str]) -> RateLimitBackend:
+        explicit = shared_path is not None
+        shared_path = shared_path or os.environ.get(SHARED_RATE_ENV)
+        if shared_path:
+            try:
+                if any(policy.rate.name == "log" for policy in self.policies):
+                    raise ValueError("алгоритм log хранит журнал переменной длины и не поддерживает общее состояние")
+                return SharedMemoryRateBackend(shared_path)
+            except (OSError, RuntimeError, ValueError) as e:
+                if explicit:
+                    raise
+                print(f"[IPS] Общее состояние RateLimiter недоступно ({e}), лимит считается в процессе")
+        return LocalRateBackend(self.max_keys, attack_threshold=self.attack_threshold)
+
+    def _check_policy(self, policy: RatePolicy) -> None:
+        if self.backend.fixed_state and policy.rate.name == "log":
+            raise ValueError(f"алгоритм log не поддерживается {type(self.backend).__name__}")
+        if any(p.name == policy.name and p is not policy for p in self.policies):
+            raise ValueError(f"Правило лимита {policy.name} уже задано")
+
+    # ─── Правила ─────────────────────────────────────────────
+
+    def add_policy(self, policy: RatePolicy) -> None:
+        """Добавляет правило лимита."""
+        self._check_policy(policy)
+        self.policies.append(policy)
+        self._endpoint_policies = None
+
+    def limit(self, max_requests: int, window: float, key="ip", algorithm: str = "sliding_window",
+              methods: Optional[list[str]] = None, name: Optional[str] = None) -> Callable:
+        """Декоратор: правило лимита для view-функции или класса API.
+
+        Пример:
+            @app.flask.route("/login", methods=["POST"])
+            @limiter.limit(5, 60)
+            def login(): ...
+        """
+        def decorator(view):
+            policy = RatePolicy(name or f"{view.__module__}.{view.__qualname__}", max_requests, window,
+                                key=key, algorithm=algorithm, methods=methods)
+            self._check_policy(policy)
+            view._rate_policies = getattr(view, "_rate_policies", ()) + (policy,)
+            self._endpoint_policies = None
+            return view
+        return decorator
+
+    def _policies_for_rule(self, endpoint: Optional[str], rule: Optional[str]) -> tuple:
+        view = self.flask_app.view_functions.get(endpoint)
+        attached = getattr(view, "_rate_policies", None) or getattr(getattr(view, "view_class", None), "_rate_policies", ())
+        return tuple(p for p in self.policies if p.matches(endpoint, rule)) + tuple(attached)
+
+    def _build_endpoint_policies(self) -> dict[Optional[str], tuple]:
+        """Предвычисляет карту endpoint → правила по url_map приложения."""
+        policies = {None: self._policies_for_rule(None, None)}
+        for rule in self.flask_app.url_map.iter_rules():
+            policies[rule.endpoint] = self._policies_for_rule(rule.endpoint, rule.rule)
+        self._endpoint_policies = policies
+        return policies
+
     def _check_rate(self):
-        ip = request.remote_addr or "unknown"
+        policies = self._endpoint_policies
+        if policies is None:
+            policies = self._build_endpoint_policies()
+        endpoint = request.endpoint
+        matched = policies.get(endpoint)
+        if matched is None:
+            # Маршрут добавлен после построения карты
+            matched = self._build_endpoint_policies().get(endpoint, ())
+
         now = time.time()
-        
-        # Убираем устаревшие записи для текущего IP
-        self._requests[ip] = [
-            t for t in self._requests[ip] 
-            if now - t < self.window
-        ]
-        
-        if len(self._requests[ip]) >= self.max_requests:
-            self.flask_app.logger.warning(f"RATE LIMIT: {ip} ({len(self._requests[ip])} req/{self.window}s)")
-            abort(429)
-        
-        self._requests[ip].append(now)
+        for policy in matched:
+            key = policy.key_for(request)
+            if key is None:
+                continue
+            allowed, current = self.backend.hit(key, policy.rate, now)
+            if not allowed:
+                self.flask_app.logger.warning(
+                    f"RATE LIMIT [{policy.name}]: {key.partition('|')[2]} ({current} req/{policy.rate.window}s)"
+                )
+                if policy.ban_ttl and self.ban_list is not None and request.remote_addr:
+                    try:
+                        self.ban_list.ban(request.remote_addr, policy.ban_ttl, reason=f"rate:{policy.name}")
+                    except ValueError:
+                        pass
+                abort(429)
+
+
+# ─── Кеш вердиктов ────────────────────────────────────────────
+
+# Поколение набора правил: меняется при загрузке сигнатур и добавлении правил,
+# кеш вердиктов сбрасывается при его изменении. Поколение сигнатур меняется
+# только с базой сигнатур — по нему пересоздаются пулы процессов (_ScanPool),
+# которым правила RuleDetector не нужны.
+_ruleset_generation = 0
+_signature_generation = 0
+
+
+def _bump_ruleset_generation(signatures: bool = False) -> None:
+    global _ruleset_generation, _signature_generation
+    _ruleset_generation += 1
+    if signatures:
+        _signature_generation += 1
+
+
+class _VerdictCache:
+    """Ограниченный LRU-кеш вердиктов с TTL для повторяющихся запросов.
+
+    Ключ — хеш нормализованных данных, которые читают детекторы (метод и
+    полный поток: путь, заголовки, тело). Значение — "" (пропустить) или имя
+    сработавшего детектора (заблокировать). Кеш сбрасывается автоматически,
+    если изменился набор правил (load_signatures, add_rule).
+    """
+
+    ALLOW = ""
+
+    def __init__(self, max_size: int = 10000, ttl: float = 60.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[int, tuple[float, str]]" = OrderedDict()
+        self._generation = _ruleset_generation
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(ctx: InspectionContext) -> Optional[int]:
+        """Ключ для контекста или None, если запрос не кешируется (потоковое тело)."""
+        if ctx.body_streams:
+            return None
+        return hash((ctx.method, ctx.full_data))
+
+    def _check_generation(self) -> None:
+        if self._generation != _ruleset_generation:
+            self._entries.clear()
+            self._generation = _ruleset_generation
+
+    def get(self, key: int) -> Optional[str]:
+        now = time.monotonic()
+        with self._lock:
+            self._check_generation()
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: int, verdict: str) -> None:
+        with self._lock:
+            self._check_generation()
+            self._entries[key] = (time.monotonic() + self.ttl, verdict)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._check_generation()
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+# ─── Статистика детекторов ────────────────────────────────────
+
+class _DetectorStats:
+    """Счётчики детектора: вызовы, срабатывания, суммарное время и гистограмма задержек.
+
+    Гистограмма с фиксированными корзинами (экспоненциальные границы от 5 мкс
+    до ~2.6 с), поэтому запись — O(log buckets) без хранения отдельных замеров,
+    а перцентили оцениваются по верхней границе корзины.
+    """
+
+    BUCKETS = tuple(5e-6 * 2 ** i for i in range(20))
+
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+        self.triggers = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.histogram = [0] * (len(self.BUCKETS) + 1)
+
+    def record(self, elapsed: float) -> None:
+        self.calls += 1
+        self.total_time += elapsed
+        if elapsed > self.max_time:
+            self.max_time = elapsed
+        self.histogram[bisect.bisect_left(self.BUCKETS, elapsed)] += 1
+
+    def percentile(self, p: float) -> float:
+        """Оценка p-го перцентиля задержки (сек)."""
+        if not self.calls:
+            return 0.0
+        rank = self.calls * p / 100.0
+        seen = 0
+        for i, count in enumerate(self.histogram):
+            seen += count
+            if seen >= rank and count:
+                return min(self.BUCKETS[i], self.max_time) if i < len(self.BUCKETS) else self.max_time
+        return self.max_time
+
+    @property
+    def trigger_rate(self) -> float:
+        return self.triggers / self.calls if self.calls else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "triggers": self.triggers,
+            "trigger_rate": self.trigger_rate,
+            "total_ms": self.total_time * 1000,
+            "avg_ms": self.total_time * 1000 / self.calls if self.calls else 0.0,
+            "p50_ms": self.percentile(50) * 1000,
+            "p95_ms": self.percentile(95) * 1000,
+            "p99_ms": self.percentile(99) * 1000,
+            "max_ms": self.max_time * 1000,
+        }
+
 
-        # Легковесная очистка словаря от старых IP (защита от утечек памяти)
-        if len(self._requests) > 1000:
-            for k in list(self._requests.keys()):
-                self._requests[k] = [t for t in self._requests[k] if now - t < self.window]
-                if not self._requests[k]:
-                    del self._requests[k]
+# Экземпляры IDS с включённой статистикой (для дашборда)
+_instrumented_ids: "weakref.WeakSet[IDS]" = weakref.WeakSet()
+
+
+def get_ids_stats() -> dict:
+    """Статистика детекторов всех инструментированных IDS/IPS в процессе.
+
+    Используется эндпоинтом дашборда (`/api/ids_stats`).
+    """
+    result = {}
+    for ids in list(_instrumented_ids):
+        key = f"{type(ids).__name__}@{ids.app.name}"
+        result[key] = {
+            "detectors": ids.detector_stats(),
+            "cache": ids.cache_stats(),
+            "async": ids.async_stats(),
+            "scan_pool": ids.scan_pool.stats() if ids.scan_pool is not None else None,
+        }
+    return result
 
 
 # ─── IDS ──────────────────────────────────────────────────────
@@ -410,25 +3831,379 @@ class IDS:
             print("Атака обнаружена!")
     """
     
-    def __init__(self, app):
+    # Профили инспекции: имя → классы детекторов (None — все детекторы)
+    PROFILES: dict[str, Optional[tuple]] = {
+        "full": None,
+        "signatures": ("SignatureDetector",),
+        "none": (),
+    }
+    
+    def __init__(self, app, config: Optional[InspectionConfig] = None,
+                 verdict_cache: bool = False, cache_size: int = 10000, cache_ttl: float = 60.0,
+                 instrument: bool = False, adaptive: bool = False, reschedule_interval: int = 1000,
+                 profiles: Optional[dict[str, str]] = None, default_profile: str = "full",
+                 async_mode: bool = False, queue_size: int = 1000, workers: int = 2,
+                 scan_processes: int = 0, offload_threshold: int = 256 * 1024,
+                 scoring: bool = False, threshold: int = 5,
+                 watch_signatures: bool = False, watch_interval: float = 2.0):
+        """
+        Args:
+            app: Экземпляр AEngineApps App.
+            config: Параметры разбора запроса (InspectionConfig).
+            verdict_cache: Кешировать вердикты кешируемых детекторов для повторяющихся запросов.
+            cache_size: Максимальное число записей в кеше вердиктов.
+            cache_ttl: Время жизни вердикта (сек).
+            instrument: Собирать статистику детекторов (вызовы, задержки, срабатывания).
+            adaptive: Упорядочивать детекторы по собранной статистике (включает instrument).
+            reschedule_interval: Через сколько запросов пересчитывать порядок детекторов.
+            profiles: Профили инспекции маршрутов: {endpoint или "/префикс": профиль}.
+                Неизвестное имя профиля — ValueError со списком доступных.
+            default_profile: Профиль маршрутов без явной настройки.
+            async_mode: Инспектировать вне запроса: снимок данных ставится в очередь
+                фоновых воркеров, ответ не ждёт детекторов (только для IDS).
+            queue_size: Размер очереди асинхронного режима; при переполнении снимки отбрасываются.
+            workers: Количество потоков-воркеров асинхронного режима.
+            scan_processes: Размер пула процессов для больших сканов сигнатур и SQLi (0 — выключен).
+            offload_threshold: С какой длины (символов) текст сканируется в пуле процессов.
+            scoring: Режим оценки аномалий: срабатывания детекторов и сигнатур
+                суммируются в баллы, атака — при достижении threshold.
+            threshold: Порог баллов аномалии для режима оценки.
+            watch_signatures: Перезагружать signatures_db.json при изменении файла
+                (компиляция в фоновом потоке, атомарная замена набора).
+            watch_interval: Период проверки mtime файла базы (сек).
+        """
         self.app: Flask = app.flask
+        self.config = config or _DEFAULT_CONFIG
         self.detectors: list[BaseDetector] = []
         self.detect_funcs: list[Callable] = []
+        self.verdict_cache: Optional[_VerdictCache] = (
+            _VerdictCache(cache_size, cache_ttl) if verdict_cache else None
+        )
+        self.stats: Optional[dict[str, _DetectorStats]] = None
+        if instrument or adaptive:
+            self.enable_instrumentation()
+        self.adaptive = adaptive
+        self.reschedule_interval = reschedule_interval
+        self._schedule: Optional[list[BaseDetector]] = None
+        self._scheduled_requests = 0
+        self.profiles: dict[str, Optional[tuple]] = dict(self.PROFILES)
+        self.default_profile = default_profile
+        self._route_profiles: dict[str, str] = dict(profiles or {})
+        self._endpoint_profiles: Optional[dict[Optional[str], str]] = None
+        # Опечатка в имени профиля иначе всплывает KeyError (500) на каждом запросе маршрута
+        self._check_profile(default_profile, "default_profile")
+        for target, name in self._route_profiles.items():
+            self._check_profile(name, target)
+        self.async_mode = async_mode
+        self._queue: Optional[queue.Queue] = None
+        self.processed = 0
+        self.dropped = 0
+        if async_mode:
+            self._start_workers(queue_size, workers)
+        self.scan_pool: Optional[_ScanPool] = (
+            _ScanPool(scan_processes, offload_threshold) if scan_processes > 0 else None
+        )
+        self.scoring = scoring
+        self.threshold = threshold
+        if watch_signatures:
+            SignatureDetector.watch_db(interval=watch_interval)
         self.app.before_request(self.run_detectors)
 
     def add_detector(self, detector_cls: type) -> None:
         """Добавляет детектор."""
-        self.detectors.append(detector_cls(self.app))
+        detector = detector_cls(self.app)
+        if self.scan_pool is not None:
+            detector.scan_pool = self.scan_pool
+        detector.scoring = self.scoring
+        self.detectors.append(detector)
+        self._schedule = None
+
+    # ─── Профили маршрутов ──────────────────────────────────
+
+    def _check_profile(self, name: str, target: Optional[str] = None) -> None:
+        if name not in self.profiles:
+            where = f" для {target!r}" if target is not None else ""
+            raise ValueError(
+                f"Неизвестный профиль инспекции{where}: {name!r} (доступны: {', '.join(self.profiles)})"
+            )
+
+    def profile(self, name: str) -> Callable:
+        """Декоратор: профиль инспекции для view-функции или класса API.
+        
+        Пример:
+            @app.flask.route("/health")
+            @ids.profile("none")
+            def health(): ...
+        """
+        self._check_profile(name)
+        
+        def decorator(view):
+            view._ids_profile = name
+            self._endpoint_profiles = None
+            return view
+        return decorator
+
+    def set_profile(self, target: str, name: str) -> None:
+        """Профиль для endpoint (например "static", "api.health") или URL-префикса ("/assets/")."""
+        self._check_profile(name)
+        self._route_profiles[target] = name
+        self._endpoint_profiles = None
+
+    def add_profile(self, name: str, detectors: Optional[list]) -> None:
+        """Регистрирует профиль: список классов детекторов (или их имён); None — все детекторы."""
+        self.profiles[name] = None if detectors is None else tuple(
+            d if isinstance(d, str) else d.__name__ for d in detectors
+        )
+        self._endpoint_profiles = None
+
+    def _profile_for_rule(self, endpoint: str, rule: Optional[str]) -> str:
+        """Профиль endpoint: декоратор → endpoint в конфиге → самый длинный префикс → static → по умолчанию."""
+        view = self.app.view_functions.get(endpoint)
+        name = getattr(view, "_ids_profile", None) or getattr(getattr(view, "view_class", None), "_ids_profile", None)
+        if name:
+            return name
+        if endpoint in self._route_profiles:
+            return self._route_profiles[endpoint]
+        if rule is not None:
+            prefixes = [p for p in self._route_profiles if p.startswith("/") and rule.startswith(p)]
+            if prefixes:
+                return self._route_profiles[max(prefixes, key=len)]
+        if endpoint == "static" or endpoint.endswith(".static"):
+            return "none"
+        return self.default_profile
+
+    def _build_endpoint_profiles(self) -> dict[Optional[str], str]:
+        """Предвычисляет карту endpoint → профиль по url_map приложения."""
+        profiles = {None: self.default_profile}
+        for rule in self.app.url_map.iter_rules():
+            profiles[rule.endpoint] = self._profile_for_rule(rule.endpoint, rule.rule)
+        self._endpoint_profiles = profiles
+        return profiles
+
+    def _resolve_profile(self) -> str:
+        """Профиль текущего запроса: один поиск по словарю endpoint → профиль."""
+        profiles = self._endpoint_profiles
+        if profiles is None:
+            profiles = self._build_endpoint_profiles()
+        endpoint = request.endpoint
+        name = profiles.get(endpoint)
+        if name is None:
+            # Маршрут добавлен после построения карты
+            name = self._build_endpoint_profiles().get(endpoint, self.default_profile)
+        return name
+
+    def reschedule(self) -> list[BaseDetector]:
+        """Пересчитывает порядок запуска детекторов по собранной статистике.
+        
+        Детекторы сортируются по ожидаемой стоимости до срабатывания:
+        среднее время / вероятность срабатывания (со сглаживанием Лапласа).
+        Дешёвые и часто срабатывающие идут первыми: IPS прерывает запрос на
+        первом срабатывании, и дорогие детекторы для атак не запускаются.
+        Ещё не измеренные детекторы ставятся в начало, чтобы набрать статистику.
+        """
+        stats = self.stats or {}
+        
+        def rank(item):
+            index, detector = item
+            st = stats.get(type(detector).__name__)
+            if st is None or not st.calls:
+                return (0.0, index)
+            probability = (st.triggers + 1) / (st.calls + 2)
+            return (st.total_time / st.calls / probability, index)
+        
+        self._schedule = [d for _, d in sorted(enumerate(self.detectors), key=rank)]
+        self._scheduled_requests = 0
+        return self._schedule
+
+    def enable_instrumentation(self) -> None:
+        """Включает сбор статистики детекторов (можно вызвать на работающем приложении)."""
+        if self.stats is None:
+            self.stats = {}
+        _instrumented_ids.add(self)
+
+    def disable_instrumentation(self) -> None:
+        self.stats = None
+        _instrumented_ids.discard(self)
+
+    def detector_stats(self) -> dict:
+        """Статистика по детекторам: {имя: {calls, triggers, avg_ms, p50_ms, p95_ms, p99_ms, ...}}."""
+        if self.stats is None:
+            return {}
+        return {name: st.to_dict() for name, st in list(self.stats.items())}
+
+    def _stats_for(self, detector: BaseDetector) -> _DetectorStats:
+        name = type(detector).__name__
+        st = self.stats.get(name)
+        if st is None:
+            st = self.stats.setdefault(name, _DetectorStats(name))
+        return st
 
     def run_detectors(self) -> None:
-        """Запускает все детекторы на текущем запросе."""
-        for detector in self.detectors:
+        """Запускает все детекторы на текущем запросе.
+        
+        Контекст инспекции строится здесь один раз и переиспользуется
+        всеми детекторами (включая пользовательские наследники BaseDetector).
+        При включённом кеше вердиктов кешируемые детекторы для уже виденного
+        запроса не запускаются: сразу применяется сохранённый вердикт.
+        Профиль маршрута ("none", "signatures", ...) проверяется до разбора запроса.
+        """
+        allowed = self.profiles[self._resolve_profile()]
+        if allowed is not None and not allowed:
+            return
+        
+        ctx = _get_inspection_context(self.config)
+        if self._queue is not None:
+            self._enqueue(ctx, allowed)
+            return
+        self._inspect(ctx, allowed)
+
+    def _inspect(self, ctx: InspectionContext, allowed: Optional[tuple]) -> None:
+        """Прогоняет детекторы профиля по контексту (кеш вердиктов, порядок, статистика)."""
+        ctx.cache_key = None
+        ctx.current_detector = None
+        ctx.score = 0
+        ctx.score_details = []
+        ctx.score_cacheable = True
+        ctx.score_reported = False
+        if ctx.overflow_blocks:
+            self.app.logger.critical(f"DETECTED OVER-BUDGET REQUEST ({ctx.overflow}): {ctx.method} {ctx.path}")
+            self._on_detection_triggered()
+            return
+        detectors = self.detectors
+        if self.adaptive:
+            self._scheduled_requests += 1
+            if self._schedule is None or self._scheduled_requests >= self.reschedule_interval:
+                self.reschedule()
+            detectors = self._schedule
+        if allowed is not None:
+            detectors = [d for d in detectors if type(d).__name__ in allowed]
+        
+        cache = self.verdict_cache
+        if cache is not None and allowed is None:
+            # Кешируются только вердикты полного набора детекторов
+            key = cache.make_key(ctx)
+            verdict = cache.get(key) if key is not None else None
+            if verdict is None:
+                ctx.cache_key = key
+            elif verdict == cache.ALLOW:
+                detectors = [d for d in detectors if not d.cacheable]
+            else:
+                self.app.logger.critical(f"DETECTED (cached verdict): {verdict} | {ctx.method} {ctx.path}")
+                self._on_detection_triggered()
+                return
+        
+        stats = self.stats
+        scoring = self.scoring
+        for detector in detectors:
+            if detector.trigger_chars is not None and not detector.may_trigger(ctx):
+                continue
             detector.trigger_response = self._on_detection_triggered
-            detector.run()
+            ctx.current_detector = detector
+            if stats is None:
+                detector.run()
+            else:
+                start = time.perf_counter()
+                try:
+                    detector.run()
+                finally:
+                    # IPS прерывает запрос исключением из обработчика, замер всё равно учитывается
+                    self._stats_for(detector).record(time.perf_counter() - start)
+            if scoring and ctx.score >= self.threshold:
+                # Порог достигнут — остальные детекторы не нужны
+                break
+        ctx.current_detector = None
+        
+        # Частичные баллы ниже порога не кешируются: без них вердикт мог бы измениться
+        if ctx.cache_key is not None and not ctx.score:
+            cache.put(ctx.cache_key, cache.ALLOW)
 
-    def _on_detection_triggered(self) -> None:
+    def _on_detection_triggered(self, points: Optional[int] = None) -> bool:
+        ctx = _get_inspection_context(self.config)
+        detector = getattr(ctx, "current_detector", None)
+        if self.stats is not None and detector is not None:
+            self._stats_for(detector).triggers += 1
+        
+        if self.scoring and detector is not None:
+            points = detector.score if points is None else points
+            ctx.score += points
+            ctx.score_details.append(f"{type(detector).__name__}+{points}")
+            ctx.score_cacheable = ctx.score_cacheable and detector.cacheable
+            if ctx.score < self.threshold or ctx.score_reported:
+                return ctx.score >= self.threshold
+            ctx.score_reported = True
+            self.app.logger.critical(
+                f"DETECTED ANOMALY SCORE {ctx.score} >= {self.threshold} "
+                f"[{', '.join(ctx.score_details)}] | {ctx.method} {ctx.path}"
+            )
+            if not ctx.score_cacheable:
+                ctx.cache_key = None
+        
+        key = getattr(ctx, "cache_key", None)
+        if key is not None and detector is not None and detector.cacheable:
+            # Вердикт сохраняется до вызова обработчиков (IPS прерывает запрос через abort)
+            self.verdict_cache.put(key, type(detector).__name__)
+            ctx.cache_key = None
         for func in self.detect_funcs:
             func()
+        return True
+
+    # ─── Асинхронный режим ──────────────────────────────────
+
+    def _start_workers(self, queue_size: int, workers: int) -> None:
+        self._queue = queue.Queue(maxsize=queue_size)
+        for i in range(workers):
+            threading.Thread(target=self._worker, name=f"ids-worker-{i}", daemon=True).start()
+
+    def _enqueue(self, ctx: InspectionContext, allowed: Optional[tuple]) -> None:
+        """Ставит снимок запроса в очередь; при переполнении снимок отбрасывается (учёт в dropped)."""
+        try:
+            self._queue.put_nowait((ctx.snapshot(), allowed))
+        except queue.Full:
+            self.dropped += 1
+
+    def _worker(self) -> None:
+        while True:
+            ctx, allowed = self._queue.get()
+            token = _detached_context.set(ctx)
+            try:
+                self._inspect(ctx, allowed)
+            except Exception as e:
+                self.app.logger.error(f"IDS worker error: {e}")
+            finally:
+                _detached_context.reset(token)
+                self.processed += 1
+                self._queue.task_done()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Ждёт обработки всех снимков в очереди. True, если очередь пуста."""
+        if self._queue is None:
+            return True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.005)
+        return True
+
+    def async_stats(self) -> Optional[dict]:
+        """Состояние очереди асинхронного режима или None, если режим выключен."""
+        if self._queue is None:
+            return None
+        return {
+            "queued": self._queue.qsize(),
+            "capacity": self._queue.maxsize,
+            "processed": self.processed,
+            "dropped": self.dropped,
+        }
+
+    @staticmethod
+    def context() -> InspectionContext:
+        """Контекст инспекции текущего запроса (в том числе в обработчиках асинхронного режима)."""
+        return _get_inspection_context()
+
+    def cache_stats(self) -> Optional[dict]:
+        """Статистика кеша вердиктов (hits/misses/size) или None, если кеш выключен."""
+        return self.verdict_cache.stats() if self.verdict_cache is not None else None
 
     def on_trigger(self, func: Callable) -> Callable:
         """Регистрирует обработчик срабатывания (можно как декоратор)."""
@@ -448,8 +4223,18 @@ class IPS(IDS):
         # Атаки автоматически блокируются (abort 400)
     """
     
-    def __init__(self, app):
-        super().__init__(app)
+    def __init__(self, app, config: Optional[InspectionConfig] = None,
+                 ban_list: Optional[BanList] = None, ban_ttl: float = 3600.0, **options):
+        """Аргументы те же, что у IDS (verdict_cache, instrument, ...).
+        
+        ban_list: BanList, в который заносится адрес заблокированного запроса
+            на ban_ttl секунд; его следующие запросы отклоняются до инспекции.
+        """
+        if options.get("async_mode"):
+            raise ValueError("IPS блокирует запрос до ответа и не поддерживает async_mode")
+        super().__init__(app, config, **options)
+        self.ban_list = ban_list
+        self.ban_ttl = ban_ttl
         
         # Проверка статуса модуля
         try:
@@ -459,6 +4244,8 @@ class IPS(IDS):
         except ImportError: pass
 
         self.on_trigger(self.block_request)
+        if ban_list is not None:
+            ban_list.install(self.app)
         
         # Регистрация стандартных детекторов по умолчанию
         self.add_detector(SQLiDetector)
@@ -470,9 +4257,243 @@ class IPS(IDS):
 
     def block_request(self) -> None:
         self.app.logger.info(f"BLOCKED: {request.remote_addr} {request.method} {request.full_path}")
+        if self.ban_list is not None and request.remote_addr:
+            try:
+                self.ban_list.ban(request.remote_addr, self.ban_ttl, reason="ips")
+            except ValueError:
+                pass
         abort(400)
+
+
+# ─── Офлайн-прогон трафика ────────────────────────────────────
+
+REPLAY_DETECTORS = ["SQLiDetector", "XSSDetector", "LFIDetector", "RCEDetector", "SignatureDetector"]
+
+
+def load_recorded_requests(path: str) -> list[dict]:
+    """Читает записанные запросы из JSONL или HAR в единый формат.
+    
+    Запись JSONL: {"method", "path" или "url", "headers": {...} или [[k, v], ...],
+    "body", "remote_addr", "expected": "allow" | "block", "id"} — обязателен только путь.
+    """
+    import json
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+    
+    stripped = text.lstrip()
+    if stripped.startswith("{") and '"log"' in stripped[:200]:
+        try:
+            har = json.loads(text)
+        except json.JSONDecodeError:
+            har = None
+        if isinstance(har, dict) and "log" in har:
+            records = []
+            for entry in har["log"].get("entries", []):
+                req = entry.get("request", {})
+                records.append({
+                    "method": req.get("method", "GET"),
+                    "url": req.get("url", "/"),
+                    "headers": [(h.get("name", ""), h.get("value", "")) for h in req.get("headers", [])
+                                if not h.get("name", "").startswith(":")],
+                    "body": (req.get("postData") or {}).get("text", ""),
+                    "remote_addr": entry.get("serverIPAddress"),
+                })
+            return records
+    
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def _record_to_request(record: dict):
+    """Запись → объект flask.Request вне контекста приложения (разбор как у живого запроса)."""
+    from urllib.parse import urlsplit
+    from flask import Request
+    from werkzeug.test import EnvironBuilder
+    
+    url = urlsplit(record.get("url") or record.get("path") or "/")
+    path = url.path or "/"
+    if url.query:
+        path = f"{path}?{url.query}"
+    headers = record.get("headers") or {}
+    if isinstance(headers, dict):
+        headers = list(headers.items())
+    headers = [(k, v) for k, v in headers if k.lower() not in ("host", "content-length")]
+    body = record.get("body") or ""
+    
+    builder = EnvironBuilder(
+        path=path,
+        base_url=f"{url.scheme}://{url.netloc}" if url.netloc else None,
+        method=record.get("method", "GET").upper(),
+        headers=headers,
+        data=body.encode("utf-8") if isinstance(body, str) else body,
+        environ_base={"REMOTE_ADDR": record.get("remote_addr") or "127.0.0.1"},
+    )
+    try:
+        return builder.get_request(Request)
+    finally:
+        builder.close()
+
+
+class _ReplayRunner:
+    """Прогон детекторов по записям без контекста Flask (выполняется в процессе-воркере)."""
+
+    def __init__(self, detector_names: list[str], signatures_path: Optional[str] = None):
+        self.app = Flask("sec-replay")
+        self.app.logger.disabled = True
+        if signatures_path:
+            SignatureDetector._load_db(signatures_path)
+        self.detectors = [globals()[name](self.app) for name in detector_names]
+        self.config = InspectionConfig()
+
+    def run(self, records: list[dict]) -> tuple[list[list[str]], dict]:
+        """Возвращает сработавшие детекторы по каждой записи и {детектор: [вызовы, секунды]}."""
+        verdicts = []
+        timings = {type(d).__name__: [0, 0.0] for d in self.detectors}
+        for record in records:
+            triggered = []
+            try:
+                ctx = InspectionContext.from_request(self.config, _record_to_request(record))
+            except Exception as e:
+                verdicts.append([f"error: {e}"])
+                continue
+            if ctx.overflow_blocks:
+                triggered.append(f"overflow: {ctx.overflow}")
+            token = _detached_context.set(ctx)
+            try:
+                for detector in self.detectors:
+                    name = type(detector).__name__
+                    detector.trigger_response = lambda name=name: triggered.append(name)
+                    start = time.perf_counter()
+                    detector.run()
+                    timing = timings[name]
+                    timing[0] += 1
+                    timing[1] += time.perf_counter() - start
+            finally:
+                _detached_context.reset(token)
+            verdicts.append(triggered)
+        return verdicts, timings
+
+
+_replay_runner: Optional[_ReplayRunner] = None
+
+
+def _replay_worker_init(detector_names: list[str], signatures_path: Optional[str]) -> None:
+    global _replay_runner
+    _replay_runner = _ReplayRunner(detector_names, signatures_path)
+
+
+def _replay_batch(records: list[dict]) -> tuple[list[list[str]], dict]:
+    return _replay_runner.run(records)
+
+
+def replay_requests(records: list[dict], detectors: Optional[list[str]] = None,
+                    signatures_path: Optional[str] = None, workers: Optional[int] = None,
+                    batch_size: int = 200) -> dict:
+    """Прогоняет записанные запросы через детекторы IPS без Flask-запроса.
+    
+    Все детекторы выполняются для каждой записи (как в IDS), записи делятся
+    на пакеты по batch_size и обрабатываются в workers процессах (0 — в
+    текущем процессе). signatures_path — альтернативная база сигнатур.
+    
+    Возвращает отчёт: вердикты по записям, пропускную способность детекторов
+    (запросов/сек по чистому времени детектора) и, если у записей есть поле
+    "expected", ложные срабатывания и пропуски.
+    """
+    detectors = list(detectors or REPLAY_DETECTORS)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    batches = [records[i:i + batch_size] for i in range(0, len(records), batch_size)]
+    
+    start = time.perf_counter()
+    if workers > 0 and len(batches) > 1:
+        with ProcessPoolExecutor(
+            max_workers=min(workers, len(batches)),
+            initializer=_replay_worker_init,
+            initargs=(detectors, signatures_path),
+        ) as executor:
+            results = list(executor.map(_replay_batch, batches))
+    else:
+        # В текущем процессе альтернативная база подменяет сигнатуры только на время прогона
+        with SignatureDetector._swap_lock:
+            signatures, severities = SignatureDetector.signatures, SignatureDetector.severities
+            engine, db_loaded = SignatureDetector._engine, SignatureDetector._db_loaded
+        try:
+            runner = _ReplayRunner(detectors, signatures_path)
+            results = [runner.run(batch) for batch in batches]
+        finally:
+            if signatures_path:
+                # Опубликованные словари не изменяются, поэтому ссылок достаточно для отката
+                SignatureDetector._install(signatures, severities, engine)
+                if not db_loaded:
+                    SignatureDetector._db_loaded = False
+    elapsed = time.perf_counter() - start
+    
+    triggered_all = [v for verdicts, _ in results for v in verdicts]
+    totals = {name: [0, 0.0] for name in detectors}
+    for _, timings in results:
+        for name, (calls, seconds) in timings.items():
+            totals[name][0] += calls
+            totals[name][1] += seconds
+    
+    detector_report = {}
+    for name, (calls, seconds) in totals.items():
+        detector_report[name] = {
+            "triggers": sum(name in v for v in triggered_all),
+            "total_ms": seconds * 1000,
+            "req_per_sec": calls / seconds if seconds else 0.0,
+        }
+    
+    verdicts = []
+    accuracy = {"false_positives": 0, "false_negatives": 0, "labeled": 0}
+    for index, (record, triggered) in enumerate(zip(records, triggered_all)):
+        verdict = "block" if triggered else "allow"
+        verdicts.append({
+            "index": index,
+            "id": record.get("id", index),
+            "method": record.get("method", "GET"),
+            "path": record.get("url") or record.get("path", "/"),
+            "verdict": verdict,
+            "detectors": triggered,
+        })
+        expected = record.get("expected")
+        if expected in ("allow", "block"):
+            accuracy["labeled"] += 1
+            if expected == "allow" and verdict == "block":
+                accuracy["false_positives"] += 1
+            elif expected == "block" and verdict == "allow":
+                accuracy["false_negatives"] += 1
+    
+    return {
+        "requests": len(records),
+        "blocked": sum(1 for v in verdicts if v["verdict"] == "block"),
+        "elapsed": elapsed,
+        "req_per_sec": len(records) / elapsed if elapsed else 0.0,
+        "signatures": signatures_path or "default",
+        "detectors": detector_report,
+        "accuracy": accuracy if accuracy["labeled"] else None,
+        "verdicts": verdicts,
+    }
+
+
+def diff_verdicts(before: dict, after: dict) -> list[dict]:
+    """Записи, у которых изменился вердикт или набор сработавших детекторов между двумя прогонами."""
+    changes = []
+    for old, new in zip(before["verdicts"], after["verdicts"]):
+        if old["verdict"] != new["verdict"] or old["detectors"] != new["detectors"]:
+            changes.append({
+                "index": old["index"],
+                "id": old["id"],
+                "path": old["path"],
+                "before": old["detectors"],
+                "after": new["detectors"],
+            })
+    return changes
+
+
 __all__ = [
-    "IDS", "IPS", "BaseDetector", 
+    "IDS", "IPS", "BaseDetector", "InspectionContext", "InspectionConfig",
     "SQLiDetector", "XSSDetector", "LFIDetector", "RCEDetector",
-    "SignatureDetector", "RuleDetector", "RateLimiter"
+    "SignatureDetector", "RuleDetector", "RateLimiter", "RatePolicy", "RateAlgorithm", "RateLimitBackend",
+    "LocalRateBackend", "SketchRateBackend", "SharedMemoryRateBackend", "NetworkRateBackend", "RateLimitServer",
+    "SHARED_RATE_ENV", "BanList", "get_ids_stats",
+    "load_recorded_requests", "replay_requests", "diff_verdicts"
 ]
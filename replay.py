@@ -0,0 +1,94 @@
+__help__ = "Офлайн-прогон детекторов IPS по записанному трафику (JSONL / HAR)"
+
+import json
+import os
+
+from rich import print
+from rich.table import Table
+
+try:
+    from . import intrusions
+except ImportError:
+    import intrusions
+
+
+USAGE = (
+    "Usage: apm sec replay FILE [--workers N] [--batch N] [--rules DB.json] "
+    "[--compare DB.json] [--detectors SQLiDetector,XSSDetector,...] [--out report.json]"
+)
+
+
+def _option(args, name, default=None):
+    if name not in args:
+        return default
+    try:
+        return args[args.index(name) + 1]
+    except IndexError:
+        raise ValueError(f"Не указано значение после {name}")
+
+
+def _print_report(report, title):
+    table = Table(title=title)
+    table.add_column("Детектор")
+    table.add_column("Срабатывания", justify="right")
+    table.add_column("Время, мс", justify="right")
+    table.add_column("Запросов/сек", justify="right")
+    for name, info in report["detectors"].items():
+        table.add_row(name, str(info["triggers"]), f"{info['total_ms']:.1f}", f"{info['req_per_sec']:.0f}")
+    print(table)
+    print(
+        f"[cyan]Запросов: {report['requests']}, заблокировано: {report['blocked']}, "
+        f"общая скорость: {report['req_per_sec']:.0f} req/s ({report['elapsed']:.2f} с)[/cyan]"
+    )
+    accuracy = report.get("accuracy")
+    if accuracy:
+        print(
+            f"[yellow]Размеченных: {accuracy['labeled']}, ложных срабатываний: {accuracy['false_positives']}, "
+            f"пропусков: {accuracy['false_negatives']}[/yellow]"
+        )
+
+
+def run(base_dir, *args, **kwargs):
+    """Wrapper for `apm sec replay ...`."""
+    args_list = kwargs.get("args", [])
+    if not args_list or args_list[0] in {"-h", "--help"}:
+        print(USAGE)
+        return
+
+    path = args_list[0]
+    if not os.path.exists(path):
+        print(f"[red][-] Файл не найден: {path}[/red]")
+        return
+
+    try:
+        workers = _option(args_list, "--workers")
+        batch = int(_option(args_list, "--batch", 200))
+        rules = _option(args_list, "--rules")
+        compare = _option(args_list, "--compare")
+        detectors = _option(args_list, "--detectors")
+        out = _option(args_list, "--out")
+        workers = int(workers) if workers is not None else None
+    except ValueError as exc:
+        print(f"[red][-] {exc}[/red]")
+        return
+
+    records = intrusions.load_recorded_requests(path)
+    detectors = detectors.split(",") if detectors else None
+    print(f"[green][+] Загружено {len(records)} запросов из {path}[/green]")
+
+    report = intrusions.replay_requests(records, detectors, rules, workers, batch)
+    _print_report(report, f"Прогон: {report['signatures']}")
+
+    if compare:
+        candidate = intrusions.replay_requests(records, detectors, compare, workers, batch)
+        _print_report(candidate, f"Прогон: {compare}")
+        changes = intrusions.diff_verdicts(report, candidate)
+        print(f"[bold]Изменившихся вердиктов: {len(changes)}[/bold]")
+        for change in changes[:50]:
+            print(f"  #{change['id']} {change['path'][:80]}: {change['before']} → {change['after']}")
+        report = {"baseline": report, "candidate": candidate, "diff": changes}
+
+    if out:
+        with open(out, "w", encoding="utf-8") as handle:
+            json.dump(report, handle, ensure_ascii=False, indent=2)
+        print(f"[green][+] Отчёт сохранён: {out}[/green]")
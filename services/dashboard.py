@@ -29,6 +29,15 @@ except ImportError:
         AdvancedSystemProtection = None
         auth = None
 
+# Статистика детекторов IDS/IPS (если модуль intrusion установлен)
+try:
+    from sec.intrusions import get_ids_stats
+except ImportError:
+    try:
+        from AEngineApps.intrusions import get_ids_stats
+    except ImportError:
+        get_ids_stats = lambda: {}
+
 # Загрузка конфига
 sec_config = None
 def load_sec_config():
@@ -288,6 +297,14 @@ class SecDashboardService(Service):
                     except: pass
                 return {"logs": logs}
 
+        class IdsStatsAPI(API):
+            """API статистики детекторов IDS/IPS (вызовы, задержки, срабатывания)"""
+            methods = ["GET"]
+            def get(self):
+                if not session.get("sec_admin_logged_in"):
+                    return {"error": "Unauthorized"}, 401
+                return {"ids": get_ids_stats()}
+
         self.add_screen("/login", LoginScreen, endpoint="login_page")
         self.add_screen("/dashboard", DashboardScreen, endpoint="dashboard_page")
         self.add_screen("/logout", LogoutAPI, endpoint="logout_api")
@@ -296,6 +313,7 @@ class SecDashboardService(Service):
         self.add_screen("/api/settings/update", UpdateCredentialsAPI)
         self.add_screen("/api/scan", ScanAPI, endpoint="api_scan")
         self.add_screen("/api/logs", LogReaderAPI)
+        self.add_screen("/api/ids_stats", IdsStatsAPI)
         
         @self.blueprint.route("/")
         def index_redirect():
@@ -0,0 +1,46 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from sec import bench
+
+
+def _results(mean_us, peak_kb=100.0):
+    return {
+        "end_to_end": {"small_get": {"mean_us": mean_us, "p50_us": mean_us, "p95_us": mean_us,
+                                     "peak_kb": peak_kb}},
+        "detectors": {"RuleDetector": {"mean_us": mean_us / 100, "p50_us": mean_us / 100,
+                                       "p95_us": mean_us / 100}},
+    }
+
+
+def test_compare_ignores_small_absolute_deltas():
+    # 1.4 → 1.9 мкс у RuleDetector — +35%, но ниже абсолютного порога
+    baseline = _results(140.0)
+    assert bench.compare(_results(140.0), baseline, 0.2) == []
+    assert bench.compare(_results(180.0), baseline, 0.2) == []
+
+
+def test_compare_flags_real_regression():
+    regressions = bench.compare(_results(400.0), _results(140.0), 0.2)
+    assert [(r["name"], r["metric"]) for r in regressions] == [
+        ("small_get", "mean_us"), ("small_get", "p50_us"),
+    ]
+
+
+def test_compare_memory_has_separate_tolerance():
+    baseline = _results(140.0, peak_kb=200.0)
+    assert bench.compare(_results(140.0, peak_kb=290.0), baseline, 0.2) == []
+    regressions = bench.compare(_results(140.0, peak_kb=400.0), baseline, 0.2)
+    assert [r["metric"] for r in regressions] == ["peak_kb"]
+
+
+def test_ci_fails_without_baseline(tmp_path, monkeypatch):
+    monkeypatch.setattr(bench, "measure", lambda corpus, repeat: _results(140.0))
+    args = ["--requests", "4", "--baseline", str(tmp_path / "missing.json")]
+    bench.run(".", args=args)
+    with pytest.raises(SystemExit) as exc:
+        bench.run(".", args=args + ["--ci"])
+    assert exc.value.code == 1
